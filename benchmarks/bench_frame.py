@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+FBUS Frame Builder Microbenchmark
+Compares frames per second of the original and in-place frame builders
+
+Developed by Khanfar Systems © 2025
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from src.fbus.protocol import FBUSProtocol
+
+class OfflineFBUS(FBUSProtocol):
+    """FBUS protocol handler that never opens a serial port."""
+
+    def _connect(self):
+        pass
+
+def legacy_checksum(data: bytes):
+    """Original per-byte checksum loop."""
+    odd_sum = 0
+    even_sum = 0
+    for i, byte in enumerate(data):
+        if i % 2:
+            odd_sum ^= byte
+        else:
+            even_sum ^= byte
+    return odd_sum, even_sum
+
+def legacy_create_frame(fbus: FBUSProtocol, msg_type: int, payload: bytes) -> bytes:
+    """Original concatenating frame builder."""
+    frame = bytes([
+        fbus.FRAME_ID,
+        fbus.PHONE_DEV,
+        fbus.PC_DEV,
+        msg_type,
+        0x00,
+        len(payload)
+    ])
+    frame += payload
+    frame += bytes([0x01, fbus.sequence])
+    odd_sum, even_sum = legacy_checksum(frame)
+    frame += bytes([odd_sum, even_sum])
+    fbus.sequence = (fbus.sequence + 1) & 0x07 | 0x08
+    return frame
+
+def frames_per_second(build, duration: float) -> float:
+    """Run a frame builder repeatedly and return its rate."""
+    count = 0
+    batch = 1000
+    start = time.perf_counter()
+    deadline = start + duration
+    while True:
+        for _ in range(batch):
+            build()
+        count += batch
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - start)
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='FBUS frame builder microbenchmark')
+    parser.add_argument('--duration', type=float, default=1.0,
+                        help='Seconds to run each case')
+    return parser.parse_args()
+
+def main():
+    """Main entry point."""
+    args = parse_args()
+    fbus = OfflineFBUS(port='offline')
+
+    cases = [
+        ('keypress poll', 0x21, b''),
+        ('display 5x14', 0x20, b'x' * 74),
+        ('full frame', 0x24, bytes(range(120))),
+    ]
+
+    print(f"{'case':<16}{'before':>14}{'after':>14}{'speedup':>10}")
+    print("-" * 54)
+    for name, msg_type, payload in cases:
+        # Both builders must produce identical frames
+        fbus.sequence = 0x08
+        expected = legacy_create_frame(fbus, msg_type, payload)
+        fbus.sequence = 0x08
+        if bytes(fbus._build_frame(msg_type, payload)) != expected:
+            raise SystemExit(f"Frame mismatch for case: {name}")
+
+        before = frames_per_second(
+            lambda: legacy_create_frame(fbus, msg_type, payload), args.duration
+        )
+        after = frames_per_second(
+            lambda: fbus._build_frame(msg_type, payload), args.duration
+        )
+        print(f"{name:<16}{before:>12,.0f}/s{after:>12,.0f}/s{after / before:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
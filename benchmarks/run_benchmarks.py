@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite for Nokia 3310 CAN Bus Interface
+Measures the frame, display, storage and OBD hot paths and checks for regressions
+
+Developed by Khanfar Systems © 2025
+"""
+
+import sys
+import json
+import time
+import struct
+import fnmatch
+import logging
+import platform
+import argparse
+import statistics
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+sys.path.append(str(project_root))
+
+from benchmarks.bench_frame import OfflineFBUS
+from src.fbus.decoder import FBUSDecoder, FBUSReassembler, xor_checksum
+from src.storage.commands import CommandStorage
+from src.ui.interface import UserInterface
+
+DEFAULT_BASELINE = Path(__file__).parent / 'baseline.json'
+
+class MemoryPhone:
+    """In-process stand-in answering CommandStorage memory commands."""
+
+    def __init__(self, size: int = 0x4000):
+        self.memory = bytearray(size)
+
+    def send_command(self, msg_type: int, payload: bytes) -> bytes:
+        if msg_type == CommandStorage.CMD_READ_MEM:
+            address, length = struct.unpack('>HB', payload)
+            return bytes(self.memory[address:address + length])
+        address = struct.unpack('>H', payload[:2])[0]
+        self.memory[address:address + len(payload) - 2] = payload[2:]
+        return b'\x00'
+
+def rate(action: Callable[[], object], duration: float, batch: int = 1000) -> float:
+    """Run an action repeatedly and return calls per second."""
+    count = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while True:
+        for _ in range(batch):
+            action()
+        count += batch
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - start)
+
+def phone_frame(msg_type: int, payload: bytes, remaining: int = 1, sequence: int = 0x40) -> bytes:
+    """Build a phone-to-PC frame as the decoder receives it."""
+    frame = bytearray(struct.pack('>BBBBH', 0x1E, 0x0C, 0x00, msg_type, len(payload)))
+    frame += payload + bytes((remaining, sequence))
+    return bytes(frame + bytes(xor_checksum(frame)))
+
+def bench_create_frame(duration: float) -> Dict[str, float]:
+    fbus = OfflineFBUS(port='offline')
+    display = b'x' * 74
+    return {
+        'create_frame.keypress': rate(lambda: fbus._create_frame(0x21, b''), duration),
+        'create_frame.display': rate(lambda: fbus._create_frame(0x20, display), duration),
+    }
+
+def bench_checksum(duration: float) -> Dict[str, float]:
+    fbus = OfflineFBUS(port='offline')
+    frame = bytes(range(126))
+    return {'checksum.126_bytes': rate(lambda: fbus._calculate_checksum(frame), duration)}
+
+def bench_response_parsing(duration: float) -> Dict[str, float]:
+    # Ack, a short response and a 255-byte memory read in three frames
+    stream = (bytes((0x7F, 0x08)) + phone_frame(0x21, b'\x05')
+              + bytes((0x7F, 0x09)) + phone_frame(0x23, bytes(120), 3)
+              + phone_frame(0x23, bytes(120), 2, 0x41)
+              + phone_frame(0x23, bytes(15), 1, 0x42))
+    decoder = FBUSDecoder()
+    reassembler = FBUSReassembler()
+
+    def parse():
+        for frame in decoder.feed(stream):
+            if frame.msg_type != 0x7F:
+                reassembler.add(frame)
+
+    return {'response_parsing.stream': rate(parse, duration, 100)}
+
+def bench_format_display(duration: float) -> Dict[str, float]:
+    ui = UserInterface.__new__(UserInterface)
+    text = "Select Sensor:\n1.RPM  2.Speed\n3.Temp 4.Load\n5.All  0.Back"
+    return {'format_display.menu': rate(lambda: ui._format_display(text), duration)}
+
+def bench_storage(duration: float) -> Dict[str, float]:
+    phone = MemoryPhone()
+    storage = CommandStorage(phone)
+    with storage.batch():
+        for i in range(50):
+            storage.add_command(f'Cmd{i}', 0x01, bytes([0x01, i % 256, 0x0C]))
+    return {
+        'storage.serialize_50': rate(storage._serialize, duration, 10),
+        'storage.load_50': rate(lambda: CommandStorage(phone), duration, 10),
+    }
+
+def bench_keypress_latency(duration: float) -> Dict[str, float]:
+    """Keypress-to-display latency through the full host stack.
+
+    A virtual phone pushes keys over a pty, and an emulated ELM327
+    stands in for the adapter.
+    """
+    import obd
+    from src.sim.phone import VirtualPhone
+    from src.sim.elm327 import ELM327Emulator
+    from src.fbus.protocol import FBUSProtocol
+    from src.canbus.interface import CANBusInterface
+
+    phone = VirtualPhone(push_keys=True)
+    adapter = ELM327Emulator()
+    fbus = FBUSProtocol(phone.start())
+    canbus = CANBusInterface(
+        connection=obd.OBD(adapter.start(), protocol='6', fast=False)
+    )
+    ui = UserInterface(fbus, canbus)
+    thread = threading.Thread(target=ui.run, daemon=True)
+    thread.start()
+
+    latencies = []
+    try:
+        # Wait for the main menu, then toggle in and out of the sensor menu
+        deadline = time.monotonic() + 5
+        while not phone.screen and time.monotonic() < deadline:
+            time.sleep(0.001)
+        end = time.monotonic() + duration
+        key = 1
+        while time.monotonic() < end or len(latencies) < 20:
+            before = phone.screen_time
+            phone.press(key)
+            timeout = time.monotonic() + 2
+            while phone.screen_time == before and time.monotonic() < timeout:
+                time.sleep(0.0002)
+            if phone.screen_time != before:
+                latencies.append((phone.screen_time - phone.key_time) * 1000)
+            key = 0 if key else 1
+    finally:
+        ui.running = False
+        thread.join(timeout=3)
+        phone.stop()
+        adapter.stop()
+
+    latencies.sort()
+    return {
+        'keypress_to_display.p50_ms': statistics.median(latencies),
+        'keypress_to_display.p95_ms': latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+def bench_isotp_transfer(duration: float) -> Dict[str, float]:
+    """VIN and 40-code DTC transfer time over ISO-TP.
+
+    Two virtual ECUs answer on python-can's in-process virtual bus,
+    which has no bit timing, so this is the host-side cost of a
+    transfer on top of the time the frames take on a real bus.
+    """
+    import obd
+    from src.sim.can_ecu import VirtualECU
+    from src.sim.elm327 import VehicleModel
+    from src.canbus.raw import RawCANConnection
+    from src.canbus.interface import CANBusInterface
+
+    dtcs = [f'P{0x100 + i:04X}' for i in range(40)]
+    ecus = [
+        VirtualECU(VehicleModel(dtcs=dtcs), channel='bench'),
+        VirtualECU(VehicleModel(sensors={'SPEED': 0.0}, dtcs=dtcs[:20]),
+                   channel='bench', address=1),
+    ]
+    for ecu in ecus:
+        ecu.start()
+    canbus = CANBusInterface(connection=RawCANConnection(interface='virtual', channel='bench'))
+
+    def transfer_ms(action: Callable[[], object]) -> float:
+        times = []
+        end = time.monotonic() + duration / 2
+        while time.monotonic() < end or len(times) < 20:
+            start = time.perf_counter()
+            action()
+            times.append((time.perf_counter() - start) * 1000)
+        return statistics.median(times)
+
+    try:
+        return {
+            'isotp_transfer.vin_ms': transfer_ms(
+                lambda: canbus.connection.query(obd.commands.VIN, force=True)
+            ),
+            'isotp_transfer.dtc_40_ms': transfer_ms(canbus.get_dtc_codes),
+        }
+    finally:
+        canbus.close()
+        for ecu in ecus:
+            ecu.stop()
+
+# Benchmark name -> function returning {metric: value}
+BENCHMARKS = {
+    'create_frame': bench_create_frame,
+    'checksum': bench_checksum,
+    'response_parsing': bench_response_parsing,
+    'format_display': bench_format_display,
+    'storage': bench_storage,
+    'keypress_latency': bench_keypress_latency,
+    'isotp_transfer': bench_isotp_transfer,
+}
+
+def lower_is_better(metric: str) -> bool:
+    """Latencies improve downwards, rates upwards."""
+    return metric.endswith('_ms')
+
+def compare(results: Dict[str, float], baseline: Dict[str, float],
+            tolerance: float) -> List[str]:
+    """Find metrics worse than the baseline by more than `tolerance`.
+
+    Returns:
+        One description per regressed metric
+    """
+    regressions = []
+    for metric, value in sorted(results.items()):
+        base = baseline.get(metric)
+        if not base:
+            continue
+        change = (value - base) / base
+        if lower_is_better(metric):
+            change = -change
+        if change < -tolerance:
+            regressions.append(f"{metric}: {value:,.2f} vs baseline {base:,.2f} ({change:+.0%})")
+    return regressions
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Hot path benchmark suite')
+    parser.add_argument('--duration', type=float, default=1.0,
+                        help='Seconds to run each measurement')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per benchmark; the best value of each metric is kept')
+    parser.add_argument('--only', type=str, default='*',
+                        help=f"Benchmarks to run, glob over: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--output', type=str, help='Write results as JSON to this file')
+    parser.add_argument('--baseline', type=str, default=str(DEFAULT_BASELINE),
+                        help='Baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Allowed slowdown before failing (0.15 = 15%%)')
+    return parser.parse_args()
+
+def main():
+    """Main entry point."""
+    args = parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results: Dict[str, float] = {}
+    for name, bench in BENCHMARKS.items():
+        if not fnmatch.fnmatch(name, args.only):
+            continue
+        best: Dict[str, float] = {}
+        for _ in range(max(1, args.repeat)):
+            for metric, value in bench(args.duration).items():
+                if metric not in best:
+                    best[metric] = value
+                elif lower_is_better(metric):
+                    best[metric] = min(best[metric], value)
+                else:
+                    best[metric] = max(best[metric], value)
+        for metric, value in best.items():
+            results[metric] = value
+            unit = 'ms' if lower_is_better(metric) else '/s'
+            print(f"{metric:<32}{value:>16,.2f} {unit}")
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=1))
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=1))
+        print(f"Baseline saved to {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print(f"\nNo baseline at {baseline_path}, nothing to compare against "
+              f"(create one with --save-baseline)", file=sys.stderr)
+        sys.exit(2)
+
+    baseline = json.loads(baseline_path.read_text()).get('results', {})
+    missing = sorted(metric for metric in results if metric not in baseline)
+    if missing:
+        print(f"\nNot in baseline, not checked: {', '.join(missing)}", file=sys.stderr)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions against baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.tolerance:.0%} against {baseline_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Capability Cache for Nokia 3310 CAN Bus Interface
+Remembers the OBD protocol and supported commands of each adapter/vehicle
+
+Developed by Khanfar Systems © 2025
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class CapabilityCache:
+    """On-disk cache of detected protocol and supported commands.
+
+    Entries are keyed by adapter port and VIN. At startup the VIN is not
+    known yet, so `lookup` returns the most recent entry for the port;
+    the caller confirms the VIN once connected.
+    """
+
+    VERSION = 1
+    DEFAULT_PATH = Path.home() / '.cache' / 'nokia3310-canbus' / 'capabilities.json'
+
+    def __init__(self, path: Optional[Path] = None):
+        """Initialize capability cache.
+
+        Args:
+            path: Cache file location (default: ~/.cache/nokia3310-canbus)
+        """
+        self.path = Path(path) if path else self.DEFAULT_PATH
+        self._lock = threading.Lock()
+        self._entries = self._read()
+
+    @staticmethod
+    def _key(port: str, vin: str) -> str:
+        return f"{port}|{vin}"
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        """Load cache file, ignoring missing or unreadable files."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != self.VERSION:
+                return {}
+            return data.get('entries', {})
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable capability cache {self.path}: {e}")
+            return {}
+
+    def _write(self) -> None:
+        """Atomically replace the cache file."""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump({'version': self.VERSION, 'entries': self._entries}, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to write capability cache {self.path}: {e}")
+
+    def lookup(self, port: Optional[str], vin: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Find cached capabilities.
+
+        Args:
+            port: Adapter port, or None for the most recently used adapter
+            vin: Vehicle VIN if already known
+
+        Returns:
+            Entry with 'port', 'vin', 'protocol' and 'commands', or None
+        """
+        with self._lock:
+            if port and vin:
+                return self._entries.get(self._key(port, vin))
+
+            candidates = [
+                entry for entry in self._entries.values()
+                if port is None or entry['port'] == port
+            ]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda entry: entry.get('updated', 0))
+
+    def store(self, port: str, vin: str, protocol: str, commands: List[str]) -> None:
+        """Save capabilities for an adapter and vehicle.
+
+        Args:
+            port: Adapter port
+            vin: Vehicle VIN ('' if the vehicle does not report one)
+            protocol: ELM327 protocol ID
+            commands: Names of supported OBD commands
+        """
+        with self._lock:
+            self._entries[self._key(port, vin)] = {
+                'port': port,
+                'vin': vin,
+                'protocol': protocol,
+                'commands': sorted(commands),
+                'updated': time.time(),
+            }
+            self._write()
+
+    def invalidate(self, port: str, vin: str) -> None:
+        """Forget cached capabilities for an adapter and vehicle."""
+        with self._lock:
+            if self._entries.pop(self._key(port, vin), None) is not None:
+                self._write()
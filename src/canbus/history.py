@@ -0,0 +1,206 @@
+"""
+Sensor History for Nokia 3310 CAN Bus Interface
+Keeps a bounded time series of recent readings for each sensor
+
+Developed by Khanfar Systems © 2025
+"""
+
+import math
+import time
+import bisect
+import logging
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Optional, plain arrays are used instead
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# (min, max, mean) of one window, None when the window holds no samples
+WindowStats = Optional[Tuple[float, float, float]]
+
+class SensorSeries:
+    """Fixed-capacity ring of (timestamp, value) samples for one sensor.
+
+    Timestamps and values live in two preallocated float buffers (NumPy
+    arrays when available, `array('d')` otherwise), so appending is O(1)
+    and allocates nothing. Once full, the oldest samples are overwritten.
+    Not thread-safe on its own; `SensorHistory` serializes access.
+    """
+
+    def __init__(self, capacity: int):
+        """Initialize series.
+
+        Args:
+            capacity: Number of samples kept
+        """
+        if capacity < 1:
+            raise ValueError(f"Invalid history capacity: {capacity}")
+        self.capacity = capacity
+        if np is not None:
+            self._times = np.zeros(capacity)
+            self._values = np.zeros(capacity)
+        else:
+            self._times = array('d', bytes(8 * capacity))
+            self._values = array('d', bytes(8 * capacity))
+        self._head = 0  # Next slot to write
+        self.count = 0
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Add a sample, overwriting the oldest one when full."""
+        head = self._head
+        self._times[head] = timestamp
+        self._values[head] = value
+        self._head = (head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def latest(self) -> Optional[Tuple[float, float]]:
+        """Get the newest (timestamp, value) sample, if any."""
+        if not self.count:
+            return None
+        last = self._head - 1
+        return float(self._times[last]), float(self._values[last])
+
+    def _ordered(self):
+        """Get (times, values) copies, oldest sample first."""
+        head, count = self._head, self.count
+        if count < self.capacity:
+            return self._times[:count], self._values[:count]
+        if np is not None:
+            return (np.concatenate((self._times[head:], self._times[:head])),
+                    np.concatenate((self._values[head:], self._values[:head])))
+        return (self._times[head:] + self._times[:head],
+                self._values[head:] + self._values[:head])
+
+    def downsample(self, buckets: int, span: float,
+                   now: Optional[float] = None) -> List[WindowStats]:
+        """Reduce the last `span` seconds to equal-width time windows.
+
+        Args:
+            buckets: Number of windows
+            span: Seconds covered, ending at `now`
+            now: End of the last window (default: time.monotonic())
+
+        Returns:
+            (min, max, mean) per window, oldest first; None for windows
+            without samples
+        """
+        if now is None:
+            now = time.monotonic()
+        start = now - span
+        width = span / buckets
+        edges = [start + width * i for i in range(buckets)] + [now]
+        times, values = self._ordered()
+
+        if np is not None:
+            idx = np.searchsorted(times, edges, side='right')
+            starts, ends = idx[:-1], idx[1:]
+            filled = ends > starts
+            result: List[WindowStats] = [None] * buckets
+            if not filled.any():
+                return result
+            # Empty windows have zero width, so each filled window runs up
+            # to the next filled one; trim so the last one stops at `now`
+            offsets = starts[filled]
+            values = values[:idx[-1]]
+            mins = np.minimum.reduceat(values, offsets)
+            maxs = np.maximum.reduceat(values, offsets)
+            means = np.add.reduceat(values, offsets) / (ends - starts)[filled]
+            for i, lo, hi, mean in zip(np.flatnonzero(filled), mins, maxs, means):
+                result[i] = (float(lo), float(hi), float(mean))
+            return result
+
+        result = []
+        idx = [bisect.bisect_right(times, edge) for edge in edges]
+        for lo, hi in zip(idx, idx[1:]):
+            if lo == hi:
+                result.append(None)
+                continue
+            window = values[lo:hi]
+            result.append((min(window), max(window), sum(window) / (hi - lo)))
+        return result
+
+class SensorHistory:
+    """Recent readings of every sampled sensor, bounded in memory.
+
+    Each sensor gets a `SensorSeries` sized to hold `retention` seconds
+    at its sampling rate, so memory stays fixed however long the session
+    runs. `record` matches the `SensorSampler` callback signature.
+    """
+
+    DEFAULT_RETENTION = 600.0  # Seconds of samples kept per sensor
+    DEFAULT_CAPACITY = 1024    # Samples kept for sensors added without a rate
+
+    def __init__(self, retention: float = DEFAULT_RETENTION):
+        """Initialize sensor history.
+
+        Args:
+            retention: Seconds of samples to keep at each sensor's rate
+        """
+        self.retention = retention
+        self._series: Dict[str, SensorSeries] = {}
+        self._lock = threading.Lock()
+
+    def track(self, name: str, rate: float) -> None:
+        """Size a sensor's history for its sampling rate.
+
+        Existing samples are kept if the sensor is already tracked at
+        the same size.
+
+        Args:
+            name: Sensor name (e.g., 'RPM')
+            rate: Samples per second
+        """
+        capacity = max(1, math.ceil(rate * self.retention))
+        with self._lock:
+            series = self._series.get(name)
+            if series is None or series.capacity != capacity:
+                self._series[name] = SensorSeries(capacity)
+
+    def record(self, name: str, value: Optional[float], timestamp: float) -> None:
+        """Store one reading; failed reads (None) are not stored.
+
+        Args:
+            name: Sensor name
+            value: Reading
+            timestamp: time.monotonic() of the reading
+        """
+        if value is None:
+            return
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = SensorSeries(self.DEFAULT_CAPACITY)
+            series.append(timestamp, value)
+
+    def latest(self, name: str) -> Optional[Tuple[float, float]]:
+        """Get a sensor's newest (timestamp, value) sample, if any."""
+        with self._lock:
+            series = self._series.get(name)
+            return series.latest() if series else None
+
+    def downsample(self, name: str, buckets: int, span: float,
+                   now: Optional[float] = None) -> List[WindowStats]:
+        """Reduce a sensor's recent history to equal-width windows.
+
+        See `SensorSeries.downsample`.
+        """
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                return [None] * buckets
+            return series.downsample(buckets, span, now)
+
+    def stats(self, name: str, span: float, now: Optional[float] = None) -> WindowStats:
+        """Get (min, max, mean) of a sensor over the last `span` seconds."""
+        return self.downsample(name, 1, span, now)[0]
+
+    def clear(self) -> None:
+        """Drop all stored samples."""
+        with self._lock:
+            self._series.clear()
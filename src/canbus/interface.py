@@ -6,26 +6,87 @@ Developed by Khanfar Systems © 2025
 """
 
 import obd
+import time
 import logging
-from typing import Dict, Any, Optional
+import threading
+from typing import Dict, Any, List, Optional
 from obd import OBDCommand, OBDResponse
+from obd.protocols import ECU
+from obd.protocols.protocol import Message
+
+from src.canbus.cache import CapabilityCache
+from src.stats.metrics import Metrics
 
 logger = logging.getLogger(__name__)
 
+class _CachedOBD(obd.OBD):
+    """python-obd connection that takes supported commands from the cache.
+    
+    Skips the PID-support scan python-obd runs in its constructor; the
+    scan is repeated later in the background by CANBusInterface.
+    """
+    
+    def __init__(self, command_names: List[str], **kwargs):
+        self._cached_names = command_names
+        super().__init__(**kwargs)
+    
+    def _OBD__load_commands(self):
+        # Replaces OBD.__load_commands (name-mangled)
+        for name in self._cached_names:
+            if obd.commands.has_name(name):
+                self.supported_commands.add(obd.commands[name])
+
 class CANBusInterface:
     """Interface for communicating with vehicle CAN bus through OBDLink SX."""
     
-    def __init__(self):
-        """Initialize CAN bus interface."""
-        self.connection = None
+    MAX_PIDS_PER_REQUEST = 6  # SAE J1979 limit for one Mode 01 request
+    
+    def __init__(self, port: Optional[str] = None,
+                 cache: Optional[CapabilityCache] = None,
+                 recorder=None, connection=None,
+                 metrics: Optional[Metrics] = None):
+        """Initialize CAN bus interface.
+        
+        Args:
+            port: Adapter serial port (default: auto-detect)
+            cache: Capability cache for fast reconnects, or None to always
+                run the full protocol search and PID scan
+            recorder: Optional SessionRecorder receiving every query,
+                response and sensor sample
+            connection: Already-open python-obd style connection to use
+                instead of connecting (e.g. a ReplayOBD)
+            metrics: Registry for query counters and per-PID latency
+                (default: a private registry)
+        """
+        self.port = port
+        self.cache = cache
+        self.recorder = recorder
+        self.connection = connection
         self.supported_commands = {}
+        self.multi_pid_supported = True  # Cleared if the ECU rejects batches
+        self.vin = None
+        self._lock = threading.RLock()  # python-obd is not thread-safe
+        self._validator = None
+        self.metrics = metrics or Metrics()
+        self._queries = self.metrics.counter('obd.queries')
+        self._null_responses = self.metrics.counter('obd.null_responses')
+        self._latency = {}  # Command name -> latency histogram
         self._connect()
     
     def _connect(self):
         """Establish connection with OBDLink SX and vehicle."""
+        self.multi_pid_supported = True  # The vehicle may differ from the last one
+        if self.connection is not None:
+            self.supported_commands = self._get_supported_commands()
+            self._record_connection()
+            return
         try:
+            entry = self.cache.lookup(self.port) if self.cache else None
+            if entry and self._connect_cached(entry):
+                return
+            
             # Auto-connect to OBDLink SX
-            self.connection = obd.OBD(fast=False)
+            self.connection = obd.OBD(portstr=self.port, fast=False)
             
             if not self.connection.is_connected():
                 raise ConnectionError("Failed to connect to OBDLink SX")
@@ -33,11 +94,178 @@ class CANBusInterface:
             # Query available commands
             self.supported_commands = self._get_supported_commands()
             logger.info("Connected to vehicle through OBDLink SX")
+            self._record_connection()
+            
+            if self.cache:
+                self._start_validation(None)
             
         except Exception as e:
             logger.error(f"Failed to connect to OBDLink SX: {e}")
             raise
     
+    def _connect_cached(self, entry: Dict[str, Any]) -> bool:
+        """Connect in fast mode using cached protocol and commands.
+        
+        Args:
+            entry: Capability cache entry for this adapter
+            
+        Returns:
+            True if connected, False to fall back to a full scan
+        """
+        logger.info(f"Using cached capabilities for {entry['port']} (VIN {entry['vin'] or 'unknown'})")
+        try:
+            self.connection = _CachedOBD(
+                entry['commands'],
+                portstr=entry['port'],
+                protocol=entry['protocol'],
+                fast=True
+            )
+        except Exception as e:
+            logger.warning(f"Cached connection failed: {e}")
+            return False
+        
+        if not self.connection.is_connected():
+            logger.warning("Cached protocol did not connect, running full scan")
+            self.connection.close()
+            self.cache.invalidate(entry['port'], entry['vin'])
+            return False
+        
+        self.supported_commands = self._get_supported_commands()
+        logger.info("Connected to vehicle through OBDLink SX (cached)")
+        self._record_connection()
+        self._start_validation(entry)
+        return True
+    
+    def _start_validation(self, entry: Optional[Dict[str, Any]]) -> None:
+        """Check the VIN and supported PIDs in the background.
+        
+        Args:
+            entry: Cache entry the connection was made from, if any
+        """
+        self._validator = threading.Thread(
+            target=self._validate_capabilities,
+            args=(entry,),
+            name='obd-capability-check',
+            daemon=True
+        )
+        self._validator.start()
+    
+    def _validate_capabilities(self, entry: Optional[Dict[str, Any]]) -> None:
+        """Rescan VIN and supported PIDs and refresh the cache.
+        
+        Each query takes the connection lock on its own, so foreground
+        reads are only held up by one adapter round trip at a time.
+        
+        Args:
+            entry: Cache entry the connection was made from, if any
+        """
+        try:
+            response = self._query(obd.commands.VIN, force=True)
+            vin = response.value if not response.is_null() else None
+            if isinstance(vin, (bytes, bytearray)):
+                vin = vin.decode('ascii', errors='ignore')
+            self.vin = str(vin).strip() if vin else ''
+            
+            supported = set(self.supported_commands)
+            if entry is not None:
+                # Rescan what the cache skipped
+                supported = self._scan_supported_commands()
+                with self._lock:
+                    for name in supported - set(self.supported_commands):
+                        command = obd.commands[name]
+                        self.connection.supported_commands.add(command)
+                        self.supported_commands[name] = command
+                    for name in set(self.supported_commands) - supported:
+                        command = self.supported_commands.pop(name)
+                        self.connection.supported_commands.discard(command)
+                if entry['vin'] != self.vin:
+                    logger.info("Vehicle changed since capabilities were cached")
+                    self.cache.invalidate(entry['port'], entry['vin'])
+            
+            self.cache.store(
+                self.connection.port_name(),
+                self.vin,
+                self.connection.protocol_id(),
+                list(supported)
+            )
+            logger.info(f"Capability cache updated ({len(supported)} commands)")
+            
+        except Exception as e:
+            logger.warning(f"Capability check failed: {e}")
+    
+    def _scan_supported_commands(self) -> set:
+        """Query PID-support bitmaps like python-obd does at connect time.
+        
+        Returns:
+            Names of supported commands
+        """
+        supported = {command.name for command in obd.commands.base_commands()}
+        for getter in obd.commands.pid_getters():
+            if getter.name not in supported:
+                continue
+            
+            response = self._query(getter, force=True)
+            if response.is_null():
+                continue
+            
+            for i, bit in enumerate(response.value):
+                if not bit:
+                    continue
+                mode = getter.mode
+                pid = getter.pid + i + 1
+                if obd.commands.has_pid(mode, pid):
+                    supported.add(obd.commands[mode][pid].name)
+                if mode == 1 and obd.commands.has_pid(2, pid):
+                    supported.add(obd.commands[2][pid].name)
+        return supported
+    
+    def _query(self, command: OBDCommand, force: bool = False) -> OBDResponse:
+        """Send one query while holding the connection lock."""
+        with self._lock:
+            if self.recorder:
+                self.recorder.obd_query(command.command)
+            
+            started = time.perf_counter()
+            response = self.connection.query(command, force=force)
+            elapsed = time.perf_counter() - started
+            
+            latency = self._latency.get(command.name)
+            if latency is None:
+                latency = self._latency[command.name] = self.metrics.histogram(
+                    f'obd.latency.{command.name}'
+                )
+            latency.record(elapsed)
+            self._queries.inc()
+            if response.is_null():
+                self._null_responses.inc()
+            
+            if not self.recorder:
+                return response
+            
+            self.recorder.obd_response(
+                b'\n'.join(
+                    frame.raw.encode('ascii', 'replace')
+                    for message in response.messages
+                    for frame in message.frames
+                ),
+                None if response.is_null() else self._numeric(response.value)
+            )
+            return response
+    
+    @staticmethod
+    def _numeric(value) -> Optional[float]:
+        """Get a response value as a float, None if it is not a number."""
+        value = getattr(value, 'magnitude', value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        return None
+    
+    def _record_connection(self) -> None:
+        """Record the adapter and protocol in use."""
+        if self.recorder:
+            self.recorder.meta('obd_port', self.connection.port_name())
+            self.recorder.meta('obd_protocol', self.connection.protocol_id())
+    
     def _get_supported_commands(self) -> Dict[str, OBDCommand]:
         """Get dictionary of supported OBD commands.
         
@@ -58,12 +286,19 @@ class CANBusInterface:
         Returns:
             Sensor value if successful, None otherwise
         """
+        value = self._read_sensor(sensor_name)
+        if self.recorder:
+            self.recorder.sample(sensor_name, value)
+        return value
+    
+    def _read_sensor(self, sensor_name: str) -> Optional[float]:
+        """Query one sensor on its own, without recording the sample."""
         if sensor_name not in self.supported_commands:
             logger.warning(f"Unsupported sensor: {sensor_name}")
             return None
         
         try:
-            response = self.connection.query(self.supported_commands[sensor_name])
+            response = self._query(self.supported_commands[sensor_name])
             if response.is_null():
                 return None
                 
@@ -73,6 +308,121 @@ class CANBusInterface:
             logger.error(f"Error reading sensor {sensor_name}: {e}")
             return None
     
+    def read_sensors(self, sensor_names: List[str]) -> Dict[str, Optional[float]]:
+        """Read several sensors with as few adapter round trips as possible.
+        
+        Mode 01 sensors are packed up to MAX_PIDS_PER_REQUEST per request
+        and the combined response is split per PID. If the ECU rejects
+        multi-PID requests, every sensor is queried on its own from then on.
+        
+        Args:
+            sensor_names: Names of sensors to read (e.g., ['RPM', 'SPEED'])
+            
+        Returns:
+            Dictionary of sensor name to value (None if unavailable)
+        """
+        values = {name: None for name in sensor_names}
+        batch = []
+        singles = []
+        
+        for name in values:
+            command = self.supported_commands.get(name)
+            if command is None:
+                logger.warning(f"Unsupported sensor: {name}")
+            elif command.mode == 1 and command.bytes > 2:
+                batch.append(command)
+            else:
+                singles.append(name)
+        
+        if len(batch) > 1 and self.multi_pid_supported:
+            step = self.MAX_PIDS_PER_REQUEST
+            for start in range(0, len(batch), step):
+                chunk = batch[start:start + step]
+                decoded = None
+                if len(chunk) > 1 and self.multi_pid_supported:
+                    decoded = self._query_multi_pid(chunk)
+                if decoded is None:
+                    singles.extend(command.name for command in chunk)
+                    continue
+                
+                values.update(decoded)
+                # PIDs some ECU left out are retried on their own
+                singles.extend(c.name for c in chunk if c.name not in decoded)
+        else:
+            singles.extend(command.name for command in batch)
+        
+        for name in singles:
+            values[name] = self._read_sensor(name)
+        
+        if self.recorder:
+            for name, value in values.items():
+                self.recorder.sample(name, value)
+        
+        return values
+    
+    def _query_multi_pid(self, commands: List[OBDCommand]) -> Optional[Dict[str, float]]:
+        """Send one Mode 01 request for several PIDs and split the response.
+        
+        Args:
+            commands: Supported Mode 01 commands (at most 6)
+            
+        Returns:
+            Dictionary of decoded values by command name, or None if the
+            ECU does not answer multi-PID requests. PIDs an ECU left out
+            are missing from the dictionary.
+        """
+        by_pid = {command.pid: command for command in commands}
+        request = OBDCommand(
+            'MULTI_PID',
+            'Batched Mode 01 request',
+            b'01' + b''.join(b'%02X' % pid for pid in by_pid),
+            0,                          # Keep the whole combined response
+            lambda messages: messages,  # Split below, per PID
+            ECU.ALL,
+            False
+        )
+        
+        try:
+            response = self._query(request, force=True)
+        except Exception as e:
+            logger.error(f"Error reading sensors {list(by_pid)}: {e}")
+            return None
+        
+        values = {}
+        answered = set()  # PIDs present in any response
+        for message in response.messages:
+            data = message.data
+            if not data or data[0] != 0x41:
+                continue
+            
+            # Response is 0x41 followed by [PID, data bytes...] per PID
+            i = 1
+            while i < len(data):
+                command = by_pid.get(data[i])
+                if command is None:
+                    break  # Unknown PID, the rest cannot be delimited
+                answered.add(data[i])
+                
+                end = i + command.bytes - 1
+                part = Message(message.frames)
+                part.ecu = message.ecu
+                part.data = bytearray(b'\x41') + data[i:end]
+                decoded = command([part])
+                if not decoded.is_null():
+                    values[command.name] = getattr(decoded.value, 'magnitude', decoded.value)
+                i = end
+        
+        first = commands[0].pid
+        if not answered or answered == {first}:
+            # No answer, or only the first PID: the ECU ignores batches.
+            # Unsupported or undecodable PIDs in an answered batch are not
+            # a reason to stop batching; the caller retries them singly.
+            logger.info("ECU does not support multi-PID requests, using single queries")
+            self.multi_pid_supported = False
+            return None
+        
+        return values
+    
     def get_dtc_codes(self) -> list[str]:
         """Read Diagnostic Trouble Codes (DTCs).
         
@@ -80,7 +430,7 @@ class CANBusInterface:
             List of DTC codes
         """
         try:
-            response = self.connection.query(obd.commands.GET_DTC)
+            response = self._query(obd.commands.GET_DTC)
             if response.is_null():
                 return []
                 
@@ -97,7 +447,7 @@ class CANBusInterface:
             True if successful, False otherwise
         """
         try:
-            response = self.connection.query(obd.commands.CLEAR_DTC)
+            response = self._query(obd.commands.CLEAR_DTC)
             return not response.is_null()
             
         except Exception as e:
@@ -120,7 +470,7 @@ class CANBusInterface:
         
         for name, command in info_commands:
             try:
-                response = self.connection.query(command)
+                response = self._query(command)
                 if not response.is_null():
                     info[name] = response.value
             except:
@@ -161,5 +511,6 @@ class CANBusInterface:
         """Close connection to OBDLink SX."""
         if self.connection:
             self.stop_monitoring()
-            self.connection.close()
+            with self._lock:
+                self.connection.close()
             logger.info("Closed connection to OBDLink SX")
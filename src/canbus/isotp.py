@@ -0,0 +1,331 @@
+"""
+ISO-TP Transport for Nokia 3310 CAN Bus Interface
+ISO 15765-2 segmentation and flow control on a python-can bus
+
+Developed by Khanfar Systems © 2025
+"""
+
+import math
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import can
+
+logger = logging.getLogger(__name__)
+
+MAX_LENGTH = 4095  # Largest length a classic CAN first frame can announce
+PADDING = 0x55
+
+# Protocol control information, upper nibble of the first byte
+SINGLE_FRAME = 0x0
+FIRST_FRAME = 0x1
+CONSECUTIVE_FRAME = 0x2
+FLOW_CONTROL = 0x3
+
+# Flow status, lower nibble of a flow control frame
+CONTINUE = 0x0
+WAIT = 0x1
+OVERFLOW = 0x2
+
+N_BS = 1.0  # Sender's wait for flow control (ISO 15765-2)
+P2_EXTENDED = 5.0  # Response wait after a 'response pending' (ISO 15765-4)
+
+def encode_st_min(seconds: float) -> int:
+    """Encode a separation time as the STmin byte of a flow control frame.
+
+    Args:
+        seconds: Minimum gap between consecutive frames, 0 to 0.127
+
+    Returns:
+        STmin byte, rounded up to the next step the encoding allows
+    """
+    if seconds <= 0:
+        return 0
+    if seconds <= 0.0009:
+        return 0xF0 + max(1, math.ceil(round(seconds * 10000, 6)))  # 100 µs steps
+    milliseconds = math.ceil(round(seconds * 1000, 6))
+    if milliseconds > 0x7F:
+        raise ValueError(f"STmin out of range: {seconds}s (max 0.127s)")
+    return milliseconds
+
+def decode_st_min(value: int) -> float:
+    """Separation time in seconds for an STmin byte.
+
+    Reserved values are treated as the 127 ms maximum, as the standard
+    asks of the sender.
+    """
+    if value <= 0x7F:
+        return value / 1000
+    if 0xF1 <= value <= 0xF9:
+        return (value - 0xF0) / 10000
+    return 0.127
+
+class IsoTpSession:
+    """Receive state for one sender, with a buffer reused for every message.
+
+    The buffer is sized for the largest message plus one frame, so
+    copying a consecutive frame at the end never resizes it.
+    """
+    __slots__ = ('buffer', 'length', 'received', 'next_index', 'block', 'frames')
+
+    def __init__(self):
+        self.buffer = bytearray(MAX_LENGTH + 7)
+        self.length = 0
+        self.received = 0
+        self.next_index = 1
+        self.block = 0  # Consecutive frames since the last flow control
+        self.frames: List[can.Message] = []
+
+    @property
+    def data(self) -> memoryview:
+        """The reassembled message, valid until the session is reused."""
+        return memoryview(self.buffer)[:self.length]
+
+class IsoTpTransport:
+    """ISO 15765-2 transport for a tester or an ECU.
+
+    Messages from different senders are reassembled concurrently, each
+    in its own IsoTpSession. Sessions are created once per sender and
+    reused, so a transfer allocates nothing for its payload. Flow control
+    sent to ECUs carries the configured block size and STmin; when
+    sending, the peer's flow control is honored.
+
+    Frames are always padded to 8 bytes, as ISO 15765-4 requires.
+    """
+
+    def __init__(self, bus: can.BusABC, extended: bool = False, block_size: int = 0,
+                 st_min: float = 0.0, padding: int = PADDING):
+        """Initialize transport.
+
+        Args:
+            bus: Open python-can bus
+            extended: Use 29-bit instead of 11-bit identifiers
+            block_size: Consecutive frames an ECU may send before waiting
+                for the next flow control (0 = no limit)
+            st_min: Minimum seconds between an ECU's consecutive frames
+            padding: Byte filling unused frame data
+        """
+        if not 0 <= block_size <= 0xFF:
+            raise ValueError(f"Block size out of range: {block_size}")
+        self.bus = bus
+        self.extended = extended
+        self.block_size = block_size
+        self.st_min = decode_st_min(encode_st_min(st_min))
+        self._flow_control = bytes((FLOW_CONTROL << 4 | CONTINUE, block_size,
+                                    encode_st_min(st_min)))
+        self._padding = bytes((padding,)) * 8
+        self._sessions: Dict[int, IsoTpSession] = {}
+
+    def flow_id(self, arbitration_id: int) -> int:
+        """Identifier to send flow control on for a responding ECU.
+
+        Args:
+            arbitration_id: ECU response identifier (e.g. 0x7E8)
+
+        Returns:
+            The ECU's physical request identifier (e.g. 0x7E0)
+        """
+        if self.extended:
+            # Normal fixed addressing: swap target and source address
+            return (arbitration_id & 0x1FFF0000) | ((arbitration_id & 0xFF) << 8) \
+                | ((arbitration_id >> 8) & 0xFF)
+        return arbitration_id - 8
+
+    def send_frame(self, arbitration_id: int, data: bytes) -> None:
+        """Send one padded CAN frame."""
+        self.bus.send(can.Message(
+            arbitration_id=arbitration_id,
+            data=data + self._padding[len(data):],
+            is_extended_id=self.extended
+        ))
+
+    def _session(self, source: int) -> IsoTpSession:
+        session = self._sessions.get(source)
+        if session is None:
+            session = self._sessions[source] = IsoTpSession()
+        return session
+
+    def request(self, arbitration_id: int, payload: bytes, expected: Optional[set] = None,
+                timeout: float = 0.05) -> Dict[int, IsoTpSession]:
+        """Send a single-frame request and reassemble every response.
+
+        Args:
+            arbitration_id: Request identifier (functional or physical)
+            payload: Request, at most 7 bytes
+            expected: Identifiers whose answers end the wait early, or
+                None to wait for the timeout
+            timeout: Seconds to wait for each response frame; while a
+                message is incomplete, STmin is added
+
+        Returns:
+            Completed sessions by response identifier. Their data is
+            only valid until the next request on this transport.
+        """
+        if not 1 <= len(payload) <= 7:
+            raise ValueError(f"Request does not fit a single frame: {payload.hex()}")
+
+        recv = self.bus.recv
+        monotonic = time.monotonic
+        # Drop anything left over from an earlier, timed-out exchange
+        while recv(0) is not None:
+            pass
+        self.send_frame(arbitration_id, bytes((len(payload),)) + payload)
+
+        pending: Dict[int, IsoTpSession] = {}
+        complete: Dict[int, IsoTpSession] = {}
+        answered = set()
+        frame_timeout = timeout + self.st_min
+        deadline = monotonic() + timeout
+        while True:
+            if expected and not pending and answered >= expected:
+                break  # Everyone expected has answered
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            message = recv(remaining)
+            if message is None:
+                break
+
+            source = message.arbitration_id
+            data = message.data
+            if not data:
+                continue
+            kind = data[0] >> 4
+            if kind == CONSECUTIVE_FRAME:
+                session = pending.get(source)
+                if session is None:
+                    continue
+                if data[0] & 0x0F != session.next_index:
+                    logger.debug(f"Out-of-sequence frame from {source:X}, dropping message")
+                    del pending[source]
+                    continue
+                received = session.received
+                count = min(len(data) - 1, 7)
+                if count < 7 and received + count < session.length:
+                    logger.debug(f"Short consecutive frame from {source:X}, dropping message")
+                    del pending[source]
+                    continue
+                session.buffer[received:received + count] = data[1:1 + count]
+                session.received = received + count
+                session.next_index = (session.next_index + 1) & 0x0F
+                session.frames.append(message)
+                if session.received >= session.length:
+                    complete[source] = pending.pop(source)
+                    answered.add(source)
+                elif self.block_size:
+                    session.block += 1
+                    if session.block == self.block_size:
+                        session.block = 0
+                        self.send_frame(self.flow_id(source), self._flow_control)
+            elif kind == SINGLE_FRAME:
+                length = data[0] & 0x0F
+                if not 1 <= length < len(data):
+                    continue
+                if data[1] == 0x7F and length >= 3 and data[3] == 0x78:
+                    # Response pending: the ECU needs longer to answer
+                    deadline = monotonic() + P2_EXTENDED
+                    continue
+                answered.add(source)
+                if data[1] == 0x7F:
+                    continue  # Negative response
+                pending.pop(source, None)
+                session = self._session(source)
+                session.buffer[:length] = data[1:1 + length]
+                session.length = length
+                session.frames.clear()
+                session.frames.append(message)
+                complete[source] = session
+            elif kind == FIRST_FRAME:
+                if len(data) < 8:
+                    continue  # First frames always carry six data bytes
+                length = ((data[0] & 0x0F) << 8) | data[1]
+                if length < 8:
+                    continue  # Would have fit a single frame, or an escape length
+                session = self._session(source)
+                session.buffer[:6] = data[2:8]
+                session.length = length
+                session.received = 6
+                session.next_index = 1
+                session.block = 0
+                session.frames.clear()
+                session.frames.append(message)
+                pending[source] = session
+                complete.pop(source, None)
+                self.send_frame(self.flow_id(source), self._flow_control)
+            else:
+                continue
+            deadline = monotonic() + (frame_timeout if pending else timeout)
+
+        if pending:
+            logger.debug(f"Incomplete messages from {', '.join(f'{s:X}' for s in pending)}")
+        return complete
+
+    def _wait_flow_control(self, flow_id: int) -> Optional[Tuple[int, float]]:
+        """Wait for the receiver's flow control.
+
+        Returns:
+            (block size, STmin seconds), or None on timeout or overflow
+        """
+        deadline = time.monotonic() + N_BS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = self.bus.recv(remaining)
+            if message is None:
+                return None
+            data = message.data
+            if message.arbitration_id != flow_id or len(data) < 3 or data[0] >> 4 != FLOW_CONTROL:
+                continue
+            status = data[0] & 0x0F
+            if status == WAIT:
+                deadline = time.monotonic() + N_BS
+                continue
+            if status != CONTINUE:
+                return None
+            return data[1], decode_st_min(data[2])
+
+    def send(self, arbitration_id: int, payload: bytes, flow_id: int) -> bool:
+        """Send a message, segmenting it if it does not fit one frame.
+
+        Args:
+            arbitration_id: Identifier to send on
+            payload: Message, up to MAX_LENGTH bytes
+            flow_id: Identifier the receiver sends flow control on
+
+        Returns:
+            True if sent, False if the receiver's flow control did not
+            come or reported an overflow
+        """
+        length = len(payload)
+        if length <= 7:
+            self.send_frame(arbitration_id, bytes((length,)) + payload)
+            return True
+        if length > MAX_LENGTH:
+            raise ValueError(f"Message too long for ISO-TP: {length} bytes")
+
+        self.send_frame(arbitration_id, bytes((FIRST_FRAME << 4 | length >> 8, length & 0xFF))
+                        + payload[:6])
+        offset = 6
+        index = 1
+        while offset < length:
+            control = self._wait_flow_control(flow_id)
+            if control is None:
+                logger.debug(f"No flow control on {flow_id:X}, aborting transfer")
+                return False
+            block_size, separation = control
+            sent = 0
+            next_at = 0.0
+            while offset < length and (not block_size or sent < block_size):
+                if separation:
+                    delay = next_at - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    next_at = time.monotonic() + separation
+                self.send_frame(arbitration_id, bytes((CONSECUTIVE_FRAME << 4 | index,))
+                                + payload[offset:offset + 7])
+                index = (index + 1) & 0x0F
+                offset += 7
+                sent += 1
+        return True
@@ -0,0 +1,266 @@
+"""
+Raw CAN Backend for Nokia 3310 CAN Bus Interface
+Sends OBD requests as CAN frames through python-can instead of an ELM327
+
+Developed by Khanfar Systems © 2025
+"""
+
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import can
+import obd
+from obd import OBDCommand, OBDResponse, OBDStatus
+from obd.protocols import ECU
+from obd.protocols.protocol import Frame, Message
+
+from src.canbus.isotp import IsoTpSession, IsoTpTransport
+
+logger = logging.getLogger(__name__)
+
+class RawCANConnection:
+    """python-obd style connection speaking ISO 15765-4 on a raw CAN bus.
+
+    Used as the `connection` of CANBusInterface, so the sensor, DTC and
+    vehicle info API stays the same. Requests go out as functional
+    (broadcast) CAN frames and responses are decoded by the same
+    python-obd commands as on the ELM327 path, without the adapter's
+    text round trip. Multi-frame responses (VIN, long DTC lists,
+    multi-PID batches) are reassembled by IsoTpTransport, for all
+    responding ECUs at once.
+
+    The PID-support bitmaps read at connect time tell which ECUs answer
+    a request, so a query returns as soon as those have answered instead
+    of waiting for the response timeout.
+    """
+
+    # ISO 15765-4 addressing, 11-bit and 29-bit
+    FUNCTIONAL_ID = 0x7DF
+    RESPONSE_BASE = 0x7E8  # ECU n answers on 0x7E8 + n, listens on 0x7E0 + n
+    FUNCTIONAL_ID_29 = 0x18DB33F1
+    RESPONSE_BASE_29 = 0x18DAF100  # ECU address in the low byte
+
+    RESPONSE_TIMEOUT = 0.05  # P2 timeout for CAN (ISO 15765-4)
+
+    # python-obd protocol IDs by (29-bit, bitrate)
+    PROTOCOL_IDS = {
+        (False, 500000): '6',
+        (True, 500000): '7',
+        (False, 250000): '8',
+        (True, 250000): '9',
+    }
+
+    def __init__(self, bus: Optional[can.BusABC] = None, interface: str = 'socketcan',
+                 channel: str = 'can0', bitrate: int = 500000, extended: bool = False,
+                 timeout: float = RESPONSE_TIMEOUT, block_size: int = 0, st_min: float = 0.0):
+        """Open the bus and scan for supported commands.
+
+        Args:
+            bus: Already-open python-can bus (e.g. a virtual bus in tests),
+                or None to open `interface`/`channel`
+            interface: python-can interface (e.g. 'socketcan', 'virtual')
+            channel: Bus channel (e.g. 'can0', 'vcan0')
+            bitrate: Bus bitrate (SocketCAN takes it from `ip link` instead)
+            extended: Use 29-bit instead of 11-bit identifiers
+            timeout: Seconds to wait for each response frame
+            block_size: Consecutive frames an ECU may send per flow
+                control (0 = no limit)
+            st_min: Minimum seconds between an ECU's consecutive frames
+
+        Raises:
+            ConnectionError: If no ECU answers the PID support request
+        """
+        self.extended = extended
+        self.timeout = timeout
+        self._own_bus = bus is None
+        if bus is None:
+            bus = can.Bus(interface=interface, channel=channel, bitrate=bitrate)
+        self.bus = bus
+        self.transport = IsoTpTransport(bus, extended, block_size=block_size, st_min=st_min)
+        self._channel = f"{interface}:{channel}" if self._own_bus else str(bus.channel_info)
+        self._protocol_id = self.PROTOCOL_IDS.get((extended, bitrate), '7' if extended else '6')
+        self._lock = threading.Lock()
+        self._responders = set()  # Arbitration IDs of the ECUs that answered the scan
+        self._ecus: Dict[int, int] = {}  # Arbitration ID -> python-obd ECU flag
+        self._pids: Dict[int, set] = defaultdict(set)  # Arbitration ID -> (mode, PID) supported
+
+        if extended:
+            self._request_id = self.FUNCTIONAL_ID_29
+            self.bus.set_filters([{'can_id': self.RESPONSE_BASE_29, 'can_mask': 0x1FFFFF00,
+                                   'extended': True}])
+        else:
+            self._request_id = self.FUNCTIONAL_ID
+            self.bus.set_filters([{'can_id': self.RESPONSE_BASE, 'can_mask': 0x7F8,
+                                   'extended': False}])
+
+        self.supported_commands = set()
+        try:
+            self._load_commands()
+        except Exception:
+            self.close()
+            raise
+
+    def _load_commands(self) -> None:
+        """Find the responding ECUs and read each one's PID-support bitmaps."""
+        responses = self._transact(obd.commands.PIDS_A.command)
+        if not responses:
+            raise ConnectionError(f"No ECU answered on {self._channel}")
+        self._responders = set(responses)
+        self._map_ecus()
+
+        # ELM327 AT commands have no meaning on a raw bus
+        self.supported_commands = {
+            command for command in obd.commands.base_commands()
+            if not command.command.startswith(b'AT')
+        }
+        for getter in obd.commands.pid_getters():
+            if getter not in self.supported_commands:
+                continue
+            with self._lock:
+                responses = self._transact(getter.command, self._expected(getter.command))
+                bitmaps = {source: bytes(session.data[2:6]) for source, session in responses.items()}
+            for source, bitmap in bitmaps.items():
+                if len(bitmap) < 4:
+                    continue
+                bits = int.from_bytes(bitmap, 'big')
+                for i in range(32):
+                    if not bits & (1 << (31 - i)):
+                        continue
+                    mode = getter.mode
+                    pid = getter.pid + i + 1
+                    self._pids[source].add((mode, pid))
+                    if obd.commands.has_pid(mode, pid):
+                        self.supported_commands.add(obd.commands[mode][pid])
+                    if mode == 1 and obd.commands.has_pid(2, pid):
+                        self.supported_commands.add(obd.commands[2][pid])
+        logger.info(f"Raw CAN connected on {self._channel}: {len(self._responders)} ECU(s), "
+                    f"{len(self.supported_commands)} commands")
+
+    def _expected(self, command: bytes) -> Optional[set]:
+        """ECUs that will answer a request, as far as the bitmaps tell.
+
+        ECUs stay silent on PIDs they do not support, so without this a
+        query to several ECUs always ran into the response timeout.
+
+        Args:
+            command: Request in python-obd's hex form
+
+        Returns:
+            Arbitration IDs to wait for, or None to wait for the timeout
+        """
+        request = bytes.fromhex(command.decode('ascii'))
+        mode, pids = request[0], request[1:]
+        if mode == 0x02:
+            mode, pids = 0x01, pids[:1]  # Freeze frame PID, then frame number
+        if mode not in (0x01, 0x06, 0x09) or not pids:
+            return set(self._responders)
+        expected = set()
+        for source in self._responders:
+            supported = self._pids[source]
+            if any(pid == 0 or (mode, pid) in supported for pid in pids):
+                expected.add(source)
+        return expected or None
+
+    def _map_ecus(self) -> None:
+        """Assign python-obd ECU flags like the ELM327 path does."""
+        engine = 0x10 if self.extended else 0x00
+        for arbitration_id in self._responders:
+            address = arbitration_id & 0xFF if self.extended else arbitration_id - self.RESPONSE_BASE
+            if len(self._responders) == 1 or address == engine:
+                self._ecus[arbitration_id] = ECU.ENGINE
+            elif address == (0x18 if self.extended else 0x01):
+                self._ecus[arbitration_id] = ECU.TRANSMISSION
+            else:
+                self._ecus[arbitration_id] = ECU.UNKNOWN
+
+    def _frame(self, message: can.Message) -> Frame:
+        """Keep a received frame in ELM327 headers-on text form for recording."""
+        header = f"{message.arbitration_id:08X}" if self.extended else f"{message.arbitration_id:03X}"
+        return Frame(header + message.data.hex().upper())
+
+    def _transact(self, command: bytes,
+                  expected: Optional[set] = None) -> Dict[int, IsoTpSession]:
+        """Send a functional request and collect every ECU's response.
+
+        Args:
+            command: Request in python-obd's hex form (e.g. b'010C')
+            expected: Arbitration IDs whose answers end the wait early,
+                or None to wait for the response timeout
+
+        Returns:
+            Complete responses by arbitration ID, valid until the next
+            request
+        """
+        return self.transport.request(self._request_id, bytes.fromhex(command.decode('ascii')),
+                                      expected, self.timeout)
+
+    def _messages(self, responses: Dict[int, IsoTpSession]) -> List[Message]:
+        """Turn responses into python-obd messages."""
+        messages = []
+        for source, session in sorted(responses.items()):
+            message = Message([self._frame(frame) for frame in session.frames])
+            message.ecu = self._ecus.get(source, ECU.UNKNOWN)
+            data = session.data
+            if data[:1] == b'\x43' and len(data) > 1:
+                # Trim DTC responses to their count, as python-obd does for CAN
+                data = data[:2 + data[1] * 2]
+            message.data = bytearray(data)
+            messages.append(message)
+        return messages
+
+    def is_connected(self) -> bool:
+        return bool(self._responders)
+
+    def status(self) -> str:
+        return OBDStatus.CAR_CONNECTED if self._responders else OBDStatus.NOT_CONNECTED
+
+    def port_name(self) -> str:
+        return self._channel
+
+    def protocol_id(self) -> str:
+        return self._protocol_id
+
+    def query(self, command: OBDCommand, force: bool = False) -> OBDResponse:
+        """Send a command and decode the responses like python-obd.
+
+        Args:
+            command: python-obd command
+            force: Send even if the command is not known to be supported
+
+        Returns:
+            Decoded response (null if unsupported or unanswered)
+        """
+        if not force and command not in self.supported_commands:
+            logger.warning(f"'{command.name}' is not supported")
+            return OBDResponse()
+        if command.command.startswith(b'AT'):
+            return OBDResponse()
+
+        with self._lock:
+            responses = self._transact(command.command, self._expected(command.command))
+            messages = self._messages(responses)
+        if not messages:
+            return OBDResponse()
+        return command(messages)
+
+    def watch(self, command, callback=None, force: bool = False) -> None:
+        """Ignore python-obd's async watch; SensorSampler polls sensors instead."""
+        logger.warning(f"Not watching '{command.name}' on the raw CAN backend, "
+                       f"use SensorSampler to poll it")
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def unwatch_all(self) -> None:
+        pass
+
+    def close(self) -> None:
+        """Shut down the bus if this connection opened it."""
+        if self._own_bus and self.bus is not None:
+            self.bus.shutdown()
+            self.bus = None
@@ -0,0 +1,188 @@
+"""
+Sensor Sampling Scheduler for Nokia 3310 CAN Bus Interface
+Samples each PID at its own rate on top of CANBusInterface
+
+Developed by Khanfar Systems © 2025
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from src.stats.profiler import ActionProfiler
+
+logger = logging.getLogger(__name__)
+
+class SampleSpec:
+    """Sampling configuration and statistics for one sensor."""
+    __slots__ = ('name', 'rate', 'priority', 'period', 'deadline',
+                 'samples', 'missed', 'last_value', 'last_time')
+
+    def __init__(self, name: str, rate: float, priority: int):
+        self.name = name
+        self.rate = rate
+        self.priority = priority
+        self.period = 1.0 / rate
+        self.deadline = 0.0
+        self.samples = 0
+        self.missed = 0
+        self.last_value: Optional[float] = None
+        self.last_time = 0.0
+
+class SensorSampler:
+    """Deadline-driven sampler reading each sensor at its own rate.
+
+    Every sensor has a target rate and priority. Deadlines advance by a
+    fixed period from the previous deadline, not from when the query
+    finished, so query latency does not accumulate as drift. Sensors due
+    at the same time are fetched together with one batched read. When
+    the adapter falls a whole period behind, the skipped deadlines are
+    counted as missed and the sensor moves on to its next future slot.
+    """
+
+    def __init__(self, canbus, callback: Callable[[str, Optional[float], float], None],
+                 on_missed: Optional[Callable[[str, int], None]] = None,
+                 max_batch: Optional[int] = None,
+                 profiler: Optional[ActionProfiler] = None):
+        """Initialize sampler.
+
+        Args:
+            canbus: CANBusInterface to read from
+            callback: Called with (sensor name, value, timestamp) per sample
+            on_missed: Optional, called with (sensor name, periods missed)
+            max_batch: Most sensors read per cycle (default: one adapter
+                request's worth); lower priority sensors wait for the next
+            profiler: Optional profiler receiving each cycle as 'sensor.poll'
+        """
+        self.canbus = canbus
+        self.max_batch = max_batch or getattr(canbus, 'MAX_PIDS_PER_REQUEST', 6)
+        self.callback = callback
+        self.on_missed = on_missed
+        self.profiler = profiler or ActionProfiler(enabled=False)
+        self.specs: Dict[str, SampleSpec] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add(self, name: str, rate: float, priority: int = 0) -> None:
+        """Sample a sensor at a target rate.
+
+        Args:
+            name: Sensor name (e.g., 'RPM')
+            rate: Target samples per second (e.g., 10 for RPM, 0.2 for coolant)
+            priority: Lower values are read first when the adapter is behind
+        """
+        if rate <= 0:
+            raise ValueError(f"Invalid sampling rate for {name}: {rate}")
+        with self._lock:
+            spec = SampleSpec(name, rate, priority)
+            spec.deadline = time.monotonic()
+            self.specs[name] = spec
+
+    def remove(self, name: str) -> None:
+        """Stop sampling a sensor."""
+        with self._lock:
+            self.specs.pop(name, None)
+
+    def start(self) -> None:
+        """Start sampling in a background thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='sensor-sampler', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the thread to finish."""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Get per-sensor sample and missed-deadline counts.
+
+        Returns:
+            Dictionary of sensor name to statistics
+        """
+        with self._lock:
+            return {
+                spec.name: {
+                    'rate': spec.rate,
+                    'samples': spec.samples,
+                    'missed': spec.missed,
+                }
+                for spec in self.specs.values()
+            }
+
+    def _due(self, now: float) -> List[SampleSpec]:
+        """Collect sensors whose deadline has arrived, most urgent first."""
+        with self._lock:
+            due = [spec for spec in self.specs.values() if spec.deadline <= now]
+        due.sort(key=lambda spec: (spec.priority, spec.deadline))
+        return due[:self.max_batch]
+
+    def _next_deadline(self) -> Optional[float]:
+        with self._lock:
+            deadlines = [spec.deadline for spec in self.specs.values()]
+        return min(deadlines) if deadlines else None
+
+    def run_once(self) -> int:
+        """Sample every sensor that is due now.
+
+        Returns:
+            Number of sensors sampled
+        """
+        now = time.monotonic()
+        due = self._due(now)
+        if not due:
+            return 0
+
+        # One batched read for the most urgent sensors
+        values = self.canbus.read_sensors([spec.name for spec in due])
+        finished = time.monotonic()
+
+        for spec in due:
+            value = values.get(spec.name)
+            spec.samples += 1
+            spec.last_value = value
+            spec.last_time = finished
+
+            # Advance from the deadline, not from now, to avoid drift
+            spec.deadline += spec.period
+            if spec.deadline <= finished:
+                missed = int((finished - spec.deadline) // spec.period) + 1
+                spec.missed += missed
+                spec.deadline += missed * spec.period
+                if self.on_missed:
+                    self.on_missed(spec.name, missed)
+                logger.debug(f"{spec.name} missed {missed} sampling deadline(s)")
+
+            try:
+                self.callback(spec.name, value, finished)
+            except Exception as e:
+                logger.error(f"Error in sampler callback for {spec.name}: {e}")
+
+        return len(due)
+
+    def _run(self) -> None:
+        """Sampling thread: sleep until the next deadline, then sample."""
+        while not self._stop_event.is_set():
+            deadline = self._next_deadline()
+            if deadline is None:
+                self._stop_event.wait(0.1)
+                continue
+
+            delay = deadline - time.monotonic()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+
+            try:
+                with self.profiler.action('sensor.poll'):
+                    self.run_once()
+            except Exception as e:
+                logger.error(f"Error sampling sensors: {e}")
+                self._stop_event.wait(0.1)
@@ -0,0 +1,264 @@
+"""
+Asyncio FBUS Transport for Nokia 3310
+Pipelines several FBUS requests over one serial link
+
+Developed by Khanfar Systems © 2025
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from src.fbus.decoder import FBUSFrame
+from src.fbus.protocol import FBUSProtocol
+from src.stats.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+class _PendingRequest:
+    """A request in flight, waiting for its response."""
+    __slots__ = ('msg_type', 'response')
+
+    def __init__(self, msg_type: int, loop: asyncio.AbstractEventLoop):
+        self.msg_type = msg_type
+        self.response = loop.create_future()
+
+class AsyncFBUSProtocol(FBUSProtocol):
+    """FBUS protocol handler keeping several requests in flight.
+
+    Each frame's ack is matched by the sequence byte written into that
+    frame; a sequence value is not reused until its previous frame was
+    acknowledged or timed out. Responses carry the phone's own sequence,
+    which says nothing about the request, so they go to the oldest
+    request of the same message type still waiting, in the order the
+    requests were written. Callers no longer wait for one round trip
+    before the next frame goes out.
+
+    The transport reads the port itself and must not be combined with
+    start_reader().
+    """
+
+    BUS_GAP = 0.003     # Minimum idle time between frames (3ms)
+    MAX_WINDOW = 7      # Sequence nibble has 8 values, keep one spare
+
+    def __init__(self, port: str, baudrate: int = 9600,
+                 window: int = 4, timeout: float = 1.0, recorder=None,
+                 metrics: Optional[Metrics] = None):
+        """Initialize asyncio FBUS protocol handler.
+
+        Args:
+            port: Serial port for FBUS communication
+            baudrate: Baud rate (default: 9600)
+            window: Maximum number of requests in flight
+            timeout: Seconds to wait for each ack and response
+            recorder: Optional SessionRecorder receiving all link traffic
+            metrics: Registry for link counters and round-trip times
+        """
+        self.window = max(1, min(window, self.MAX_WINDOW))
+        self.timeout = timeout
+        self.on_unsolicited: Optional[Callable[[FBUSFrame], None]] = None
+        self._acks: Dict[int, asyncio.Future] = {}  # Sequence & 7 -> ack future
+        self._waiting: Dict[int, Deque[_PendingRequest]] = {}  # Type -> requests in send order
+        self._loop = None
+        self._slots = None
+        self._write_lock = None
+        self._reader_task = None
+        self._last_write = 0.0
+        super().__init__(port, baudrate, recorder, metrics=metrics)
+
+    async def open(self) -> None:
+        """Attach the serial port to the running event loop."""
+        if self._loop is not None:
+            return
+        if self.reader is not None:
+            raise RuntimeError("Port is owned by the reader thread")
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.window)
+        self._write_lock = asyncio.Lock()
+
+        try:
+            self._loop.add_reader(self.serial.fileno(), self._on_readable)
+        except (NotImplementedError, OSError, ValueError):
+            # No selectable handle (e.g. Windows): poll from a worker thread
+            self._reader_task = self._loop.create_task(self._poll_reader())
+
+    def _on_readable(self) -> None:
+        """Event loop callback: drain the port and dispatch frames."""
+        try:
+            # Only read what is buffered so the loop never blocks
+            data = self.serial.read(self.serial.in_waiting)
+        except Exception as e:
+            logger.error(f"Serial communication error: {e}")
+            return
+        if data:
+            if self.recorder:
+                self.recorder.fbus_rx(data)
+            self._dispatch(self.decoder.feed(data))
+
+    async def _poll_reader(self) -> None:
+        """Fallback reader for ports that cannot be watched by the loop."""
+        while self.serial and self.serial.is_open:
+            data = await self._loop.run_in_executor(
+                None, lambda: self.serial.read(self.serial.in_waiting or 1)
+            )
+            if data:
+                if self.recorder:
+                    self.recorder.fbus_rx(data)
+                self._dispatch(self.decoder.feed(data))
+
+    def _dispatch(self, frames: List[FBUSFrame]) -> None:
+        """Resolve pending acks and requests from decoded frames.
+
+        Args:
+            frames: Frames decoded from the latest chunk
+        """
+        for frame in frames:
+            if frame.msg_type == self.ACK_ID:
+                ack = self._acks.pop(frame.sequence & 0x07, None)
+                if ack is not None and not ack.done():
+                    ack.set_result(True)
+                else:
+                    logger.debug(f"Unmatched acknowledgment for sequence {frame.sequence & 0x07}")
+                continue
+
+            payload = self.reassembler.add(frame)
+            if payload is None:
+                continue  # Wait for the remaining frames of this message
+
+            # Oldest request of this type; timed-out ones are skipped
+            waiting = self._waiting.get(frame.msg_type)
+            request = None
+            while waiting and request is None:
+                request = waiting.popleft()
+                if request.response.done():
+                    request = None
+
+            if request is not None:
+                request.response.set_result(payload)
+            elif self.on_unsolicited:
+                self.on_unsolicited(frame._replace(payload=payload))
+            else:
+                logger.debug(f"Unsolicited frame type 0x{frame.msg_type:02X}")
+
+    async def _write_frames(self, msg_type: int, payload: bytes) -> Dict[int, asyncio.Future]:
+        """Write all frames of a message, registering an ack for each.
+
+        Must be called with the write lock held.
+
+        Args:
+            msg_type: Type of message to send
+            payload: Command payload
+
+        Returns:
+            Ack futures by sequence & 7, one per frame written
+        """
+        view = memoryview(payload)
+        size = self.MAX_FRAME_PAYLOAD
+        count = max(1, -(-len(view) // size))
+        acks = {}
+
+        for index in range(count):
+            # Keep the inter-frame gap without idling a whole round trip
+            gap = self._last_write + self.BUS_GAP - time.monotonic()
+            if gap > 0:
+                await asyncio.sleep(gap)
+
+            # Never hand out a sequence whose earlier frame is unacknowledged
+            key = self.sequence & 0x07
+            previous = self._acks.get(key)
+            while previous is not None and not previous.done():
+                await asyncio.wait([previous])
+                previous = self._acks.get(key)
+
+            frame = self._build_frame(msg_type, view[index * size:(index + 1) * size],
+                                      count - index)
+            acks[key] = self._acks[key] = self._loop.create_future()
+            self.serial.write(frame)
+            self._last_write = time.monotonic()
+            self._frames_tx.inc()
+            self._bytes_tx.inc(len(frame))
+            if self.recorder:
+                self.recorder.fbus_tx(frame)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Sent frame: {frame.hex()}")
+        return acks
+
+    async def send_command(self, msg_type: int, payload: bytes) -> Optional[bytes]:
+        """Send command to phone and await its response.
+
+        Up to `window` calls may be awaiting at the same time; each one
+        holds a slot from the moment its first frame is written until its
+        response arrives or times out.
+
+        Args:
+            msg_type: Type of message to send
+            payload: Command payload
+
+        Returns:
+            Response payload if successful, None otherwise
+        """
+        if not self.serial or not self.serial.is_open:
+            raise ConnectionError("Serial port not open")
+        await self.open()
+
+        async with self._slots:
+            request = _PendingRequest(msg_type, self._loop)
+            acks = {}
+            try:
+                async with self._write_lock:
+                    # Queued before the write, so the order matches the wire
+                    self._waiting.setdefault(msg_type, deque()).append(request)
+                    started = time.perf_counter()
+                    try:
+                        acks = await self._write_frames(msg_type, payload)
+                    except Exception as e:
+                        logger.error(f"Serial communication error: {e}")
+                        return None
+
+                try:
+                    await asyncio.wait_for(asyncio.gather(*acks.values()), self.timeout)
+                except asyncio.TimeoutError:
+                    if not request.response.done():
+                        self._ack_timeouts.inc()
+                        logger.warning("No acknowledgment received")
+                        return None  # A response implies receipt despite a lost ack
+
+                try:
+                    response = await asyncio.wait_for(request.response, self.timeout)
+                except asyncio.TimeoutError:
+                    self._response_timeouts.inc()
+                    logger.warning("No response received")
+                    return None
+                self._record_rtt(msg_type, time.perf_counter() - started)
+                return response
+            finally:
+                for key, ack in acks.items():
+                    if self._acks.get(key) is ack:
+                        del self._acks[key]
+                    ack.cancel()
+                request.response.cancel()
+                waiting = self._waiting.get(msg_type)
+                if waiting and request in waiting:
+                    waiting.remove(request)
+
+    def close(self):
+        """Detach from the event loop and close serial connection."""
+        if self._loop is not None:
+            if self._reader_task:
+                self._reader_task.cancel()
+            elif self.serial and self.serial.is_open:
+                try:
+                    self._loop.remove_reader(self.serial.fileno())
+                except Exception:
+                    pass
+            for ack in self._acks.values():
+                ack.cancel()
+            for waiting in self._waiting.values():
+                for request in waiting:
+                    request.response.cancel()
+            self._acks.clear()
+            self._waiting.clear()
+            self._loop = None
+        super().close()
@@ -0,0 +1,237 @@
+"""
+FBUS Stream Decoder for Nokia 3310
+Incremental, resynchronizing decoder for the FBUS byte stream
+
+Developed by Khanfar Systems © 2025
+"""
+
+import logging
+from typing import List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def xor_checksum(data) -> Tuple[int, int]:
+    """Calculate FBUS (odd, even) XOR checksums in bulk.
+
+    The data is read as one little-endian integer, so even-indexed bytes
+    sit in the low byte and odd-indexed bytes in the high byte of each
+    16-bit word. Folding the integer in halves XORs all words together in
+    O(log n) big-integer operations instead of a Python loop per byte.
+
+    Args:
+        data: Bytes-like object to checksum
+
+    Returns:
+        Tuple of (odd checksum, even checksum)
+    """
+    value = int.from_bytes(data, 'little')
+    bits = len(data) << 3
+    while bits > 64:
+        half = ((bits + 127) >> 7) << 6  # Half width, whole 64-bit words
+        value = (value & ((1 << half) - 1)) ^ (value >> half)
+        bits = half
+    value ^= value >> 32
+    value ^= value >> 16
+    return (value >> 8) & 0xFF, value & 0xFF
+
+class FBUSFrame(NamedTuple):
+    """A single decoded FBUS frame (or acknowledgment)."""
+    msg_type: int
+    payload: bytes
+    frames_remaining: int
+    sequence: int
+    source: int = 0x00
+
+class FBUSDecoder:
+    """State machine turning arbitrary byte chunks into FBUS frames.
+
+    Frames are assembled in a single preallocated buffer, so feeding
+    data never allocates per byte; only completed frames are copied out.
+    On a bad header or checksum the decoder rescans the bytes it already
+    buffered, so it resynchronizes within one frame after line noise.
+    Arrival times are not used: chunks reach the decoder whenever the
+    port is read, so a pause between them says nothing about the line.
+    A false frame start is bounded by MAX_PAYLOAD and the checksum.
+    """
+
+    FRAME_ID = 0x1E
+    ACK_ID = 0x7F
+    HEADER_LEN = 6
+    TRAILER_LEN = 4     # frames remaining + sequence + 2 checksums
+    MAX_PAYLOAD = 120   # Largest payload either side puts in one frame
+    ACK_SEQUENCES = (0x08, 0x40)  # Sequence & 0xF8 of PC and phone frames
+
+    # Decoder states
+    _HUNT = 0
+    _ACK = 1
+    _HEADER = 2
+    _BODY = 3
+
+    def __init__(self, local_dev: Optional[int] = 0x0C):
+        """Initialize decoder.
+
+        Args:
+            local_dev: Expected destination address of incoming frames,
+                or None to accept frames for any device
+        """
+        self.local_dev = local_dev
+        self._buffer = bytearray(self.HEADER_LEN + self.MAX_PAYLOAD + self.TRAILER_LEN)
+        self._view = memoryview(self._buffer)
+        self._filled = 0
+        self._needed = 0
+        self._state = self._HUNT
+        self.bytes_received = 0
+        self.frames_decoded = 0
+        self.acks_decoded = 0
+        self.checksum_errors = 0
+        self.bytes_discarded = 0
+
+    def reset(self) -> None:
+        """Drop any partially received frame and start hunting again."""
+        self._filled = 0
+        self._state = self._HUNT
+
+    def feed(self, data: bytes) -> List[FBUSFrame]:
+        """Feed received bytes into the decoder.
+
+        Args:
+            data: Any number of bytes read from the port
+
+        Returns:
+            List of frames completed by this chunk (may be empty)
+        """
+        frames: List[FBUSFrame] = []
+        self.bytes_received += len(data)
+        self._consume(bytes(data) if isinstance(data, memoryview) else data, frames)
+        return frames
+
+    def _consume(self, data: bytes, frames: List[FBUSFrame]) -> None:
+        """Run the state machine over a chunk of data."""
+        i = 0
+        end = len(data)
+        buf = self._buffer
+        view = memoryview(data)
+
+        while i < end:
+            state = self._state
+
+            if state == self._HUNT:
+                # Skip to the next frame start or acknowledgment
+                start = data.find(self.FRAME_ID, i)
+                ack = data.find(self.ACK_ID, i, start if start >= 0 else end)
+                if ack >= 0:
+                    self.bytes_discarded += ack - i
+                    i = ack + 1
+                    self._state = self._ACK
+                elif start >= 0:
+                    self.bytes_discarded += start - i
+                    buf[0] = self.FRAME_ID
+                    self._filled = 1
+                    self._needed = self.HEADER_LEN
+                    self._state = self._HEADER
+                    i = start + 1
+                else:
+                    self.bytes_discarded += end - i
+                    i = end
+
+            elif state == self._ACK:
+                self._state = self._HUNT
+                sequence = data[i]
+                if sequence & 0xF8 not in self.ACK_SEQUENCES:
+                    # A stray 0x7F; the byte after it may start a frame
+                    self.bytes_discarded += 1
+                    continue
+                frames.append(FBUSFrame(self.ACK_ID, b'', 0, sequence))
+                self.acks_decoded += 1
+                i += 1
+
+            else:
+                # Copy as much of the header or body as this chunk holds
+                take = min(self._needed - self._filled, end - i)
+                buf[self._filled:self._filled + take] = view[i:i + take]
+                self._filled += take
+                i += take
+                if self._filled < self._needed:
+                    continue
+
+                if state == self._HEADER:
+                    length = (buf[4] << 8) | buf[5]
+                    if ((self.local_dev is not None and buf[1] != self.local_dev)
+                            or length > self.MAX_PAYLOAD):
+                        self._resync(frames)
+                        continue
+                    self._needed = self.HEADER_LEN + length + self.TRAILER_LEN
+                    self._state = self._BODY
+                else:
+                    self._finish_frame(frames)
+
+    def _finish_frame(self, frames: List[FBUSFrame]) -> None:
+        """Validate checksums of the buffered frame and emit it."""
+        total = self._needed
+        odd_sum, even_sum = xor_checksum(self._view[:total - 2])
+        if odd_sum != self._buffer[total - 2] or even_sum != self._buffer[total - 1]:
+            self.checksum_errors += 1
+            logger.debug("FBUS checksum mismatch, resynchronizing")
+            self._resync(frames)
+            return
+
+        buf = self._buffer
+        frames.append(FBUSFrame(
+            msg_type=buf[3],
+            payload=bytes(buf[self.HEADER_LEN:total - self.TRAILER_LEN]),
+            frames_remaining=buf[total - 4],
+            sequence=buf[total - 3],
+            source=buf[2]
+        ))
+        self.frames_decoded += 1
+        self._filled = 0
+        self._state = self._HUNT
+
+    def _resync(self, frames: List[FBUSFrame]) -> None:
+        """Discard the false frame start and rescan what follows it."""
+        pending = bytes(self._buffer[1:self._filled])
+        self.bytes_discarded += 1
+        self._filled = 0
+        self._state = self._HUNT
+        self._consume(pending, frames)
+
+class FBUSReassembler:
+    """Joins multi-frame FBUS messages using the frames-remaining byte."""
+
+    def __init__(self):
+        """Initialize reassembler."""
+        self._parts = {}  # msg_type -> (bytearray, next expected remaining)
+
+    def reset(self) -> None:
+        """Drop all partially received messages."""
+        self._parts.clear()
+
+    def add(self, frame: FBUSFrame) -> Optional[bytes]:
+        """Add a decoded frame.
+
+        Args:
+            frame: Frame from FBUSDecoder (acks must be filtered out)
+
+        Returns:
+            Complete message payload once its last frame arrived, else None
+        """
+        remaining = frame.frames_remaining
+        partial = self._parts.get(frame.msg_type)
+
+        if partial is None or partial[1] != remaining:
+            if partial is not None:
+                logger.warning(f"Incomplete message type 0x{frame.msg_type:02X} dropped")
+                del self._parts[frame.msg_type]
+            if remaining <= 1:
+                # Single-frame message, the common case
+                return frame.payload
+            partial = (bytearray(), remaining)
+
+        data = partial[0]
+        data += frame.payload
+        if remaining <= 1:
+            del self._parts[frame.msg_type]
+            return bytes(data)
+
+        self._parts[frame.msg_type] = (data, remaining - 1)
+        return None
@@ -6,12 +6,22 @@ Developed by Khanfar Systems © 2025
 """
 
 import time
+import struct
 import serial
 import logging
+import threading
+from collections import deque
 from typing import List, Optional, Tuple
 
+from src.fbus.decoder import FBUSDecoder, FBUSFrame, FBUSReassembler, xor_checksum
+from src.fbus.reader import FBUSReader
+from src.stats.metrics import Metrics
+
 logger = logging.getLogger(__name__)
 
+# Frame ID, destination, source, message type, big-endian length
+_HEADER = struct.Struct('>BBBBH')
+
 class FBUSProtocol:
     """Implementation of Nokia FBUS protocol."""
     
@@ -19,36 +29,220 @@ class FBUSProtocol:
     FRAME_ID = 0x1E  # Serial FBUS
     PHONE_DEV = 0x00
     PC_DEV = 0x0C
+    ACK_ID = 0x7F
+    MAX_FRAME_PAYLOAD = FBUSDecoder.MAX_PAYLOAD  # Larger payloads are split across frames
+    HEADER_LEN = 6
+    TRAILER_LEN = 4  # Frames remaining + sequence + 2 checksums
+    RESPONSE_TIMEOUT = 1.0  # Seconds to wait for each ack and response
+    
+    # Line settings tried by baud negotiation, fastest first
+    LINE_SETTINGS = (
+        (115200, serial.PARITY_NONE),
+        (57600, serial.PARITY_NONE),
+        (38400, serial.PARITY_NONE),
+        (19200, serial.PARITY_NONE),
+        (9600, serial.PARITY_NONE),
+        (9600, serial.PARITY_ODD),  # Original fixed setting
+    )
+    SYNC_BYTE = 0x55     # Preamble the phone locks its UART onto
+    SYNC_LENGTH = 128
+    PROBE_MSG = 0x23     # One-byte memory read, answered without side effects
+    PROBE_COUNT = 3      # Clean exchanges needed to accept a setting
+    PROBE_TIMEOUT = 0.2  # Seconds to wait for each probe reply
+    FALLBACK_ERRORS = 3  # Link errors within FALLBACK_WINDOW before slowing down
+    FALLBACK_WINDOW = 30.0
     
-    def __init__(self, port: str, baudrate: int = 9600):
+    def __init__(self, port: str, baudrate: Optional[int] = 9600, recorder=None,
+                 serial_port=None, metrics: Optional[Metrics] = None):
         """Initialize FBUS protocol handler.
         
         Args:
             port: Serial port for FBUS communication
-            baudrate: Baud rate (default: 9600)
+            baudrate: Baud rate (default: 9600, 8O1), or None to negotiate
+                the fastest setting in LINE_SETTINGS the phone answers at
+            recorder: Optional SessionRecorder receiving all link traffic
+            serial_port: Already-open port to use instead of opening
+                `port` (e.g. a ReplaySerial)
+            metrics: Registry for link counters and round-trip times
+                (default: a private registry)
         """
         self.port = port
+        self.auto_baud = baudrate is None
         self.baudrate = baudrate
-        self.serial = None
+        self.parity = serial.PARITY_ODD
+        self._setting = 0  # Index into LINE_SETTINGS when negotiating
+        self._errors_seen = 0
+        self._error_times = deque()  # (time, new link errors)
+        self._link_lock = threading.Lock()  # Guards the error window above
+        self.recorder = recorder
+        self.serial = serial_port
         self.sequence = 0x08  # Initial sequence number for PC
+        self.decoder = FBUSDecoder(local_dev=self.PC_DEV)
+        self._frames = deque()  # Decoded frames not yet consumed
+        self.reassembler = FBUSReassembler()
+        self.reader = None  # Background reader, see start_reader()
+        self._lock = threading.RLock()
+        # Frames are built in place in one reusable transmit buffer
+        self._tx_buffer = bytearray(
+            self.HEADER_LEN + self.MAX_FRAME_PAYLOAD + self.TRAILER_LEN
+        )
+        self._tx_view = memoryview(self._tx_buffer)
+        self._init_metrics(metrics or Metrics())
         self._connect()
     
+    def _init_metrics(self, metrics: Metrics) -> None:
+        """Look up the counters and histograms the hot paths update."""
+        self.metrics = metrics
+        self._frames_tx = metrics.counter('fbus.frames_tx')
+        self._bytes_tx = metrics.counter('fbus.bytes_tx')
+        self._ack_timeouts = metrics.counter('fbus.ack_timeouts')
+        self._baud_fallbacks = metrics.counter('fbus.baud_fallbacks')
+        self._response_timeouts = metrics.counter('fbus.response_timeouts')
+        self._rtt = {}  # Message type -> round-trip histogram
+        
+        # Receive counts are kept by the decoder, which sees every byte
+        decoder = self.decoder
+        metrics.source('fbus.bytes_rx', lambda: decoder.bytes_received)
+        metrics.source('fbus.frames_rx', lambda: decoder.frames_decoded + decoder.acks_decoded)
+        metrics.source('fbus.checksum_errors', lambda: decoder.checksum_errors)
+        metrics.source('fbus.bytes_discarded', lambda: decoder.bytes_discarded)
+    
+    def _record_rtt(self, msg_type: int, seconds: float) -> None:
+        """Add a request/response round trip to its message type's histogram."""
+        histogram = self._rtt.get(msg_type)
+        if histogram is None:
+            histogram = self._rtt[msg_type] = self.metrics.histogram(f'fbus.rtt.0x{msg_type:02X}')
+        histogram.record(seconds)
+    
     def _connect(self):
         """Establish serial connection with Nokia phone."""
+        if self.serial is not None:
+            return
         try:
             self.serial = serial.Serial(
                 port=self.port,
-                baudrate=self.baudrate,
+                baudrate=self.baudrate or self.LINE_SETTINGS[0][0],
                 bytesize=serial.EIGHTBITS,
-                parity=serial.PARITY_ODD,
+                parity=self.parity,
                 stopbits=serial.STOPBITS_ONE,
                 timeout=1
             )
+            if self.auto_baud:
+                self._negotiate()
             logger.info(f"Connected to {self.port} at {self.baudrate} baud")
         except serial.SerialException as e:
             logger.error(f"Failed to connect to {self.port}: {e}")
             raise
     
+    def _negotiate(self) -> None:
+        """Pick the fastest line setting the phone answers cleanly at.
+        
+        Each setting in LINE_SETTINGS is applied, announced with the sync
+        preamble and probed with PROBE_COUNT memory reads. The first one
+        where every probe is answered without a checksum error is kept.
+        
+        Raises:
+            ConnectionError: If the phone answers at none of them
+        """
+        for index, (baudrate, parity) in enumerate(self.LINE_SETTINGS):
+            self._apply_setting(index)
+            if self._probe():
+                self._errors_seen = self.decoder.checksum_errors
+                return
+            logger.debug(f"No clean answer at {baudrate} baud, parity {parity}")
+        
+        self.serial.close()
+        raise ConnectionError(f"Phone on {self.port} did not answer at any baud rate")
+    
+    def _apply_setting(self, index: int) -> None:
+        """Switch the port to a line setting and send the sync preamble."""
+        baudrate, parity = self.LINE_SETTINGS[index]
+        # Only reconfigure what changes, some drivers reject no-op updates
+        if self.serial.baudrate != baudrate:
+            self.serial.baudrate = baudrate
+        if self.serial.parity != parity:
+            self.serial.parity = parity
+        self.baudrate, self.parity, self._setting = baudrate, parity, index
+        self.serial.write(bytes((self.SYNC_BYTE,)) * self.SYNC_LENGTH)
+        self.serial.flush()
+    
+    def _probe(self) -> bool:
+        """Check that probes at the current setting are answered cleanly."""
+        errors = self.decoder.checksum_errors
+        for _ in range(self.PROBE_COUNT):
+            if not self._probe_exchange():
+                return False
+        return self.decoder.checksum_errors == errors
+    
+    def _probe_exchange(self) -> bool:
+        """Send one probe and wait for its ack and response.
+        
+        Probes bypass the recorder, metrics and timeout warnings, since
+        most of them are expected to fail at the wrong setting.
+        """
+        self.serial.reset_input_buffer()
+        self.decoder.reset()
+        self.reassembler.reset()
+        self.serial.write(self._build_frame(self.PROBE_MSG, struct.pack('>HB', 0, 1)))
+        
+        acked = False
+        deadline = time.monotonic() + self.PROBE_TIMEOUT
+        while time.monotonic() < deadline:
+            # Poll instead of shortening the port timeout, which would
+            # reconfigure the port on every probe
+            waiting = self.serial.in_waiting
+            if not waiting:
+                time.sleep(0.001)
+                continue
+            for frame in self.decoder.feed(self.serial.read(waiting)):
+                if frame.msg_type == self.ACK_ID:
+                    acked = True
+                elif acked and self.reassembler.add(frame) is not None:
+                    return True
+        return False
+    
+    def _check_link(self, failed: bool) -> None:
+        """Fall back to a slower setting after repeated link errors.
+        
+        Checksum errors and failed exchanges both count, so a setting
+        the phone does not follow after a fallback is left again too.
+        Only active with a negotiated rate, and costs one comparison
+        while exchanges succeed without new checksum errors.
+        
+        Called by every thread that sends, never with the write lock
+        held. The error window and the fallback are handled under
+        `_link_lock`, so errors are counted once and only one caller
+        falls back for them.
+        
+        Args:
+            failed: The exchange just finished got no response
+        """
+        if not self.auto_baud:
+            return
+        if self.decoder.checksum_errors == self._errors_seen and not failed:
+            return
+        
+        with self._link_lock:
+            errors = self.decoder.checksum_errors
+            now = time.monotonic()
+            self._error_times.append((now, errors - self._errors_seen + failed))
+            self._errors_seen = errors
+            while self._error_times[0][0] < now - self.FALLBACK_WINDOW:
+                self._error_times.popleft()
+            if sum(count for _, count in self._error_times) < self.FALLBACK_ERRORS:
+                return
+            
+            self._error_times.clear()
+            if self._setting + 1 >= len(self.LINE_SETTINGS):
+                return  # Already at the most conservative setting
+            
+            previous = self.baudrate
+            with self._lock:
+                self._apply_setting(self._setting + 1)
+            self._baud_fallbacks.inc()
+            logger.warning(f"Repeated link errors at {previous} baud, falling back "
+                           f"to {self.baudrate} (parity {self.parity})")
+    
     def _calculate_checksum(self, data: bytes) -> Tuple[int, int]:
         """Calculate FBUS checksums.
         
@@ -58,55 +252,89 @@ class FBUSProtocol:
         Returns:
             Tuple of (odd checksum, even checksum)
         """
-        odd_sum = 0
-        even_sum = 0
+        return xor_checksum(data)
+    
+    def _build_frame(self, msg_type: int, payload: bytes,
+                     frames_remaining: int = 1) -> memoryview:
+        """Build FBUS frame in the preallocated transmit buffer.
+        
+        Header, payload, sequence and checksums are written in place, so
+        no intermediate bytes objects are created. The returned view is
+        only valid until the next frame is built.
+        
+        Args:
+            msg_type: Type of message
+            payload: Message payload bytes (at most MAX_FRAME_PAYLOAD)
+            frames_remaining: Frames left in this message, 1 = last frame
+            
+        Returns:
+            View of the complete frame in the transmit buffer
+        """
+        length = len(payload)
+        if length > self.MAX_FRAME_PAYLOAD:
+            raise ValueError(f"Frame payload too long: {length} bytes")
+        
+        buf = self._tx_buffer
+        end = self.HEADER_LEN + length
+        
+        # Header: frame ID, destination (phone), source (PC), type, length
+        _HEADER.pack_into(buf, 0, self.FRAME_ID, self.PHONE_DEV,
+                          self.PC_DEV, msg_type, length)
+        buf[self.HEADER_LEN:end] = payload
+        
+        # Frames remaining and sequence number
+        buf[end] = frames_remaining
+        buf[end + 1] = self.sequence
         
-        for i, byte in enumerate(data):
-            if i % 2:
-                odd_sum ^= byte
-            else:
-                even_sum ^= byte
+        # Checksums over everything before them
+        buf[end + 2], buf[end + 3] = xor_checksum(self._tx_view[:end + 2])
         
-        return odd_sum, even_sum
+        # Update sequence number for next frame
+        self.sequence = (self.sequence + 1) & 0x07 | 0x08
+        
+        return self._tx_view[:end + self.TRAILER_LEN]
     
-    def _create_frame(self, msg_type: int, payload: bytes) -> bytes:
+    def _create_frame(self, msg_type: int, payload: bytes,
+                      frames_remaining: int = 1) -> bytes:
         """Create FBUS frame with proper structure.
         
         Args:
             msg_type: Type of message
-            payload: Message payload bytes
+            payload: Message payload bytes (at most MAX_FRAME_PAYLOAD)
+            frames_remaining: Frames left in this message, 1 = last frame
             
         Returns:
             Complete FBUS frame as bytes
         """
-        # Basic frame structure
-        frame = bytes([
-            self.FRAME_ID,      # Frame ID
-            self.PHONE_DEV,     # Destination (phone)
-            self.PC_DEV,        # Source (PC)
-            msg_type,           # Message type
-            0x00,              # Command
-            len(payload)        # Length
-        ])
-        
-        # Add payload
-        frame += payload
-        
-        # Add sequence number
-        frame += bytes([0x01, self.sequence])  # 0x01 = last frame
-        
-        # Calculate and add checksums
-        odd_sum, even_sum = self._calculate_checksum(frame)
-        frame += bytes([odd_sum, even_sum])
+        return bytes(self._build_frame(msg_type, payload, frames_remaining))
+    
+    def start_reader(self) -> FBUSReader:
+        """Hand all reads from the port to a background reader thread.
         
-        # Update sequence number for next frame
-        self.sequence = (self.sequence + 1) & 0x07 | 0x08
+        Once started, concurrent send_command callers no longer steal each
+        other's bytes: the reader routes every ack and response to the
+        caller waiting for it, and unsolicited messages to subscribers.
         
-        return frame
+        Returns:
+            The running reader
+        """
+        with self._lock:
+            if self.reader is None:
+                if not self.serial or not self.serial.is_open:
+                    raise ConnectionError("Serial port not open")
+                self.reader = FBUSReader(self.serial, self.decoder,
+                                         recorder=self.recorder)
+                self.reader.start()
+                logger.info("FBUS reader thread started")
+            return self.reader
     
     def send_command(self, msg_type: int, payload: bytes) -> Optional[bytes]:
         """Send command to phone and wait for response.
         
+        Payloads longer than MAX_FRAME_PAYLOAD are sent as several frames,
+        each acknowledged by the phone, and multi-frame responses are
+        reassembled before being returned.
+        
         Args:
             msg_type: Type of message to send
             payload: Command payload
@@ -117,30 +345,112 @@ class FBUSProtocol:
         if not self.serial or not self.serial.is_open:
             raise ConnectionError("Serial port not open")
         
-        # Create and send frame
-        frame = self._create_frame(msg_type, payload)
+        reader = self.reader
+        if reader is None:
+            # Without a reader, the whole exchange owns the port
+            with self._lock:
+                started = time.perf_counter()
+                response = None
+                if self._send_frames(msg_type, payload, None):
+                    response = self._read_response()
+                if response is not None:
+                    self._record_rtt(msg_type, time.perf_counter() - started)
+            self._check_link(response is None)
+            return response
         
-        try:
-            # Wait for bus to be free (3ms)
-            time.sleep(0.003)
-            
-            # Send frame
-            self.serial.write(frame)
-            logger.debug(f"Sent frame: {frame.hex()}")
+        # With a reader, only the writes are serialized; the response is
+        # awaited while other callers use the link
+        waiter = reader.expect_response(msg_type)
+        with self._lock:
+            started = time.perf_counter()
+            sent = self._send_frames(msg_type, payload, reader)
+        
+        response = waiter.wait(self.RESPONSE_TIMEOUT) if sent else None
+        if response is None:
+            reader.cancel(msg_type, waiter)
+            if sent:
+                self._response_timeouts.inc()
+                logger.warning("No response received")
+        else:
+            self._record_rtt(msg_type, time.perf_counter() - started)
+        self._check_link(response is None)
+        return response
+    
+    def _send_frames(self, msg_type: int, payload: bytes,
+                     reader: Optional[FBUSReader]) -> bool:
+        """Write all frames of a message, waiting for each acknowledgment.
+        
+        Args:
+            msg_type: Type of message to send
+            payload: Command payload
+            reader: Running reader thread, or None to read the port directly
             
-            # Wait for acknowledgment (200ms timeout)
-            ack = self.serial.read(2)
-            if len(ack) != 2 or ack[0] != 0x7F:
-                logger.warning("No acknowledgment received")
-                return None
+        Returns:
+            True if every frame was acknowledged, False otherwise
+        """
+        view = memoryview(payload)
+        size = self.MAX_FRAME_PAYLOAD
+        count = max(1, -(-len(view) // size))
+        
+        try:
+            for index in range(count):
+                frame = self._build_frame(
+                    msg_type,
+                    view[index * size:(index + 1) * size],
+                    count - index
+                )
+                ack_waiter = reader.expect_ack(frame[-3]) if reader else None
+                
+                # Wait for bus to be free (3ms)
+                time.sleep(0.003)
+                
+                # Send frame straight from the transmit buffer
+                self.serial.write(frame)
+                self._frames_tx.inc()
+                self._bytes_tx.inc(len(frame))
+                if self.recorder:
+                    self.recorder.fbus_tx(frame)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Sent frame: {frame.hex()}")
+                
+                # Wait for acknowledgment
+                if ack_waiter:
+                    ack = ack_waiter.wait(self.RESPONSE_TIMEOUT)
+                else:
+                    ack = self._read_frame()
+                    while ack is not None and ack.msg_type != self.ACK_ID:
+                        logger.debug(f"Discarding stale frame type 0x{ack.msg_type:02X}")
+                        ack = self._read_frame()
+                if ack is None:
+                    self._ack_timeouts.inc()
+                    logger.warning("No acknowledgment received")
+                    return False
             
-            # Read response
-            response = self._read_response()
-            return response
+            return True
             
         except serial.SerialException as e:
             logger.error(f"Serial communication error: {e}")
-            return None
+            return False
+    
+    def _read_frame(self) -> Optional[FBUSFrame]:
+        """Read the next complete frame or acknowledgment from the port.
+        
+        Bytes are fed through the stream decoder, so noise and partial
+        frames are skipped instead of misaligning later reads.
+        
+        Returns:
+            Decoded frame, or None if nothing arrived before the timeout
+        """
+        deadline = time.monotonic() + (self.serial.timeout or 0)
+        while not self._frames:
+            chunk = self.serial.read(self.serial.in_waiting or 1)
+            if chunk:
+                if self.recorder:
+                    self.recorder.fbus_rx(chunk)
+                self._frames.extend(self.decoder.feed(chunk))
+            elif time.monotonic() >= deadline:
+                return None
+        return self._frames.popleft()
     
     def _read_response(self) -> Optional[bytes]:
         """Read and parse response from phone.
@@ -148,25 +458,27 @@ class FBUSProtocol:
         Returns:
             Response payload if valid, None otherwise
         """
-        # Read header (6 bytes)
-        header = self.serial.read(6)
-        if len(header) != 6:
-            logger.warning("Invalid response header")
-            return None
-        
-        # Get payload length
-        payload_len = header[5]
-        
-        # Read payload and footer
-        payload = self.serial.read(payload_len + 4)  # payload + seq + checksums
-        if len(payload) != payload_len + 4:
-            logger.warning("Invalid response payload")
-            return None
-        
-        return payload[:-4]  # Remove sequence and checksums
+        while True:
+            frame = self._read_frame()
+            if frame is None:
+                self._response_timeouts.inc()
+                logger.warning("No response received")
+                self.reassembler.reset()
+                return None
+            
+            if frame.msg_type == self.ACK_ID:
+                # Late acknowledgment of an earlier frame
+                continue
+            
+            message = self.reassembler.add(frame)
+            if message is not None:
+                return message
     
     def close(self):
         """Close serial connection."""
+        if self.reader:
+            self.reader.stop()
+            self.reader = None
         if self.serial and self.serial.is_open:
             self.serial.close()
             logger.info("Serial connection closed")
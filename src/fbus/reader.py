@@ -0,0 +1,251 @@
+"""
+FBUS Reader Thread for Nokia 3310
+Single background reader that drains the serial port and demultiplexes
+acknowledgments, responses and unsolicited phone messages
+
+Developed by Khanfar Systems © 2025
+"""
+
+import queue
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from src.fbus.decoder import FBUSDecoder, FBUSFrame, FBUSReassembler
+
+logger = logging.getLogger(__name__)
+
+class RingBuffer:
+    """Fixed-size byte ring buffer between the port and the decoder."""
+
+    def __init__(self, size: int = 4096):
+        """Initialize ring buffer.
+
+        Args:
+            size: Capacity in bytes
+        """
+        self.size = size
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._head = 0      # Next byte to read
+        self._count = 0     # Bytes currently stored
+        self.overflows = 0  # Bytes dropped because the buffer was full
+
+    def __len__(self) -> int:
+        return self._count
+
+    def write(self, data: bytes) -> None:
+        """Append data, dropping the oldest bytes if it does not fit.
+
+        Args:
+            data: Bytes to store
+        """
+        data = memoryview(data)
+        if len(data) > self.size:
+            self.overflows += len(data) - self.size
+            data = data[-self.size:]
+
+        excess = self._count + len(data) - self.size
+        if excess > 0:
+            self.overflows += excess
+            self._head = (self._head + excess) % self.size
+            self._count -= excess
+
+        tail = (self._head + self._count) % self.size
+        first = min(len(data), self.size - tail)
+        self._buffer[tail:tail + first] = data[:first]
+        self._buffer[:len(data) - first] = data[first:]
+        self._count += len(data)
+
+    def drain(self) -> List[memoryview]:
+        """Remove and return all stored bytes as at most two views.
+
+        The views stay valid until the next write.
+
+        Returns:
+            Contiguous spans in arrival order
+        """
+        spans = []
+        first = min(self._count, self.size - self._head)
+        if first:
+            spans.append(self._view[self._head:self._head + first])
+        if self._count > first:
+            spans.append(self._view[:self._count - first])
+        self._head = (self._head + self._count) % self.size
+        self._count = 0
+        return spans
+
+class _Waiter:
+    """One-shot slot a caller blocks on until the reader fills it."""
+    __slots__ = ('event', 'value')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+    def set(self, value) -> None:
+        self.value = value
+        self.event.set()
+
+    def wait(self, timeout: Optional[float]):
+        if self.event.wait(timeout):
+            return self.value
+        return None
+
+class FBUSReader(threading.Thread):
+    """Background thread owning all reads from the FBUS serial port.
+
+    Acks are routed to the sender waiting on that sequence nibble,
+    responses to the oldest caller expecting that message type, and
+    anything else to per-type callbacks or the `unsolicited` queue.
+    """
+
+    UNSOLICITED_MAX = 64  # Oldest unsolicited frames are dropped beyond this
+
+    def __init__(self, serial_port, decoder: FBUSDecoder, ring_size: int = 4096,
+                 recorder=None):
+        """Initialize reader thread.
+
+        Args:
+            serial_port: Open serial port to read from
+            decoder: Stream decoder for incoming bytes
+            ring_size: Size of the receive ring buffer in bytes
+            recorder: Optional SessionRecorder receiving every chunk read
+        """
+        super().__init__(name='fbus-reader', daemon=True)
+        self.serial = serial_port
+        self.decoder = decoder
+        self.recorder = recorder
+        self.reassembler = FBUSReassembler()
+        self.ring = RingBuffer(ring_size)
+        self.unsolicited = queue.Queue(maxsize=self.UNSOLICITED_MAX)
+        self._lock = threading.Lock()
+        self._acks: Dict[int, _Waiter] = {}
+        self._responses: Dict[int, deque] = {}
+        self._callbacks: Dict[int, List[Callable[[FBUSFrame], None]]] = {}
+        self._stop_event = threading.Event()
+
+    def expect_ack(self, sequence: int) -> _Waiter:
+        """Register interest in the ack for a frame about to be sent.
+
+        Args:
+            sequence: Sequence byte of the outgoing frame
+
+        Returns:
+            Waiter resolved with the ack frame
+        """
+        waiter = _Waiter()
+        with self._lock:
+            self._acks[sequence & 0x07] = waiter
+        return waiter
+
+    def expect_response(self, msg_type: int) -> _Waiter:
+        """Register interest in the next response of a message type.
+
+        Args:
+            msg_type: Message type of the request about to be sent
+
+        Returns:
+            Waiter resolved with the response payload
+        """
+        waiter = _Waiter()
+        with self._lock:
+            self._responses.setdefault(msg_type, deque()).append(waiter)
+        return waiter
+
+    def cancel(self, msg_type: int, waiter: _Waiter) -> None:
+        """Withdraw a response waiter that timed out."""
+        with self._lock:
+            waiters = self._responses.get(msg_type)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+
+    def subscribe(self, msg_type: int, callback: Callable[[FBUSFrame], None]) -> None:
+        """Receive unsolicited messages of a type through a callback.
+
+        Callbacks run on the reader thread and must not block.
+
+        Args:
+            msg_type: Message type to subscribe to
+            callback: Function called with each unsolicited frame
+        """
+        with self._lock:
+            self._callbacks.setdefault(msg_type, []).append(callback)
+
+    def unsubscribe(self, msg_type: int, callback: Callable[[FBUSFrame], None]) -> None:
+        """Remove a callback added with subscribe."""
+        with self._lock:
+            callbacks = self._callbacks.get(msg_type, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def run(self) -> None:
+        """Drain the port until stopped."""
+        while not self._stop_event.is_set():
+            try:
+                chunk = self.serial.read(self.serial.in_waiting or 1)
+            except Exception as e:
+                if not self._stop_event.is_set():
+                    logger.error(f"Serial communication error: {e}")
+                break
+
+            if not chunk:
+                continue
+
+            if self.recorder:
+                self.recorder.fbus_rx(chunk)
+            self.ring.write(chunk)
+            for span in self.ring.drain():
+                for frame in self.decoder.feed(span):
+                    self._dispatch(frame)
+
+    def _dispatch(self, frame: FBUSFrame) -> None:
+        """Route one decoded frame to whoever is waiting for it."""
+        if frame.msg_type == FBUSDecoder.ACK_ID:
+            with self._lock:
+                waiter = self._acks.pop(frame.sequence & 0x07, None)
+            if waiter:
+                waiter.set(frame)
+            else:
+                logger.debug(f"Unmatched acknowledgment for sequence {frame.sequence & 0x07}")
+            return
+
+        payload = self.reassembler.add(frame)
+        if payload is None:
+            return  # Wait for the remaining frames of this message
+
+        with self._lock:
+            waiters = self._responses.get(frame.msg_type)
+            waiter = waiters.popleft() if waiters else None
+            callbacks = list(self._callbacks.get(frame.msg_type, ()))
+
+        if waiter:
+            waiter.set(payload)
+            return
+
+        frame = frame._replace(payload=payload)
+        if callbacks:
+            for callback in callbacks:
+                try:
+                    callback(frame)
+                except Exception as e:
+                    logger.error(f"Error in FBUS callback: {e}")
+            return
+
+        if self.unsolicited.full():
+            try:
+                self.unsolicited.get_nowait()
+            except queue.Empty:
+                pass
+        self.unsolicited.put_nowait(frame)
+
+    def stop(self) -> None:
+        """Stop the reader and wake any blocked read."""
+        self._stop_event.set()
+        try:
+            self.serial.cancel_read()
+        except Exception:
+            pass
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout=2)
@@ -0,0 +1,212 @@
+"""
+FBUS Link Scheduler for Nokia 3310
+Single writer that orders all FBUS traffic by priority
+
+Developed by Khanfar Systems © 2025
+"""
+
+import heapq
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Traffic priorities, lower values are sent first
+PRIORITY_KEYPRESS = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_MONITOR = 2
+PRIORITY_BULK = 3
+
+class _Job:
+    """A queued link action and everyone waiting for its result."""
+    __slots__ = ('priority', 'order', 'action', 'coalesce_key',
+                 'futures', 'superseded')
+
+    def __init__(self, priority: int, order: int, action: Callable[[Any], Any],
+                 coalesce_key: Optional[str], futures: List[Future]):
+        self.priority = priority
+        self.order = order
+        self.action = action
+        self.coalesce_key = coalesce_key
+        self.futures = futures
+        self.superseded = False
+
+    def __lt__(self, other: '_Job') -> bool:
+        return (self.priority, self.order) < (other.priority, other.order)
+
+class LinkChannel:
+    """FBUS protocol stand-in that sends through the scheduler at one priority.
+
+    Anything written against `FBUSProtocol.send_command` (for example
+    `CommandStorage`) can be handed a channel instead of the protocol.
+    """
+
+    def __init__(self, scheduler: 'LinkScheduler', priority: int,
+                 coalesce_key: Optional[str] = None):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.coalesce_key = coalesce_key
+
+    def send_command(self, msg_type: int, payload: bytes) -> Optional[bytes]:
+        """Send command at this channel's priority and wait for response."""
+        return self.scheduler.send_command(
+            msg_type, payload, self.priority, self.coalesce_key
+        )
+
+class LinkScheduler:
+    """Owns the FBUS writer and sends queued commands by priority.
+
+    Keypresses go first, then interactive redraws, then background
+    monitor frames, then bulk memory I/O. Commands submitted with the
+    same coalesce key replace each other while still queued, so only the
+    latest redraw is sent and every waiter receives its result.
+    """
+
+    def __init__(self, fbus):
+        """Initialize link scheduler.
+
+        Args:
+            fbus: FBUS protocol handler that performs the actual I/O
+        """
+        self.fbus = fbus
+        self._queue: List[_Job] = []
+        self._pending: Dict[str, _Job] = {}  # coalesce key -> queued job
+        self._order = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.coalesced = 0
+
+    def start(self) -> None:
+        """Start the writer thread."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name='fbus-scheduler', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the writer thread and fail any queued commands."""
+        with self._cond:
+            self._running = False
+            queued, self._queue = self._queue, []
+            self._pending.clear()
+            self._cond.notify_all()
+
+        for job in queued:
+            if not job.superseded:
+                for future in job.futures:
+                    future.set_result(None)
+
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def channel(self, priority: int, coalesce_key: Optional[str] = None) -> LinkChannel:
+        """Get a send_command interface bound to one priority."""
+        return LinkChannel(self, priority, coalesce_key)
+
+    def submit(self, msg_type: int, payload: bytes,
+               priority: int = PRIORITY_INTERACTIVE,
+               coalesce_key: Optional[str] = None) -> Future:
+        """Queue a command for sending.
+
+        Args:
+            msg_type: Type of message to send
+            payload: Command payload
+            priority: One of the PRIORITY_* constants
+            coalesce_key: Commands sharing this key replace each other
+                while queued (e.g. 'display' for screen redraws)
+
+        Returns:
+            Future resolved with the response payload, or None on failure
+        """
+        return self.submit_call(
+            lambda fbus: fbus.send_command(msg_type, payload),
+            priority, coalesce_key
+        )
+
+    def submit_call(self, action: Callable[[Any], Any],
+                    priority: int = PRIORITY_INTERACTIVE,
+                    coalesce_key: Optional[str] = None) -> Future:
+        """Queue an action that runs on the writer thread.
+
+        The action receives the FBUS protocol handler and has the link
+        to itself while it runs, so it can decide what to send based on
+        state at send time rather than at submit time.
+
+        Args:
+            action: Function called with the protocol handler
+            priority: One of the PRIORITY_* constants
+            coalesce_key: Actions sharing this key replace each other
+                while queued
+
+        Returns:
+            Future resolved with the action's return value, or None on failure
+        """
+        future = Future()
+        with self._cond:
+            if not self._running:
+                raise ConnectionError("Link scheduler not running")
+
+            futures = [future]
+            stale = self._pending.get(coalesce_key) if coalesce_key else None
+            if stale is not None:
+                # Only the newest content is sent, at the most urgent priority
+                stale.superseded = True
+                futures = stale.futures + futures
+                priority = min(priority, stale.priority)
+                self.coalesced += 1
+
+            self._order += 1
+            job = _Job(priority, self._order, action, coalesce_key, futures)
+            heapq.heappush(self._queue, job)
+            if coalesce_key:
+                self._pending[coalesce_key] = job
+            self._cond.notify()
+        return future
+
+    def send_command(self, msg_type: int, payload: bytes,
+                     priority: int = PRIORITY_INTERACTIVE,
+                     coalesce_key: Optional[str] = None) -> Optional[bytes]:
+        """Queue a command and wait for its response.
+
+        Returns:
+            Response payload if successful, None otherwise
+        """
+        return self.submit(msg_type, payload, priority, coalesce_key).result()
+
+    def _next_job(self) -> Optional[_Job]:
+        """Block until a live job is queued, or return None when stopped."""
+        with self._cond:
+            while self._running:
+                while self._queue:
+                    job = heapq.heappop(self._queue)
+                    if job.superseded:
+                        continue
+                    if job.coalesce_key and self._pending.get(job.coalesce_key) is job:
+                        del self._pending[job.coalesce_key]
+                    return job
+                self._cond.wait()
+            return None
+
+    def _run(self) -> None:
+        """Writer thread: send jobs one at a time in priority order."""
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            try:
+                response = job.action(self.fbus)
+            except Exception as e:
+                logger.error(f"Error sending FBUS command: {e}")
+                response = None
+
+            for future in job.futures:
+                future.set_result(response)
@@ -12,6 +12,7 @@ import sys
 import time
 import logging
 import argparse
+import threading
 from pathlib import Path
 
 # Add project root to Python path
@@ -19,8 +20,14 @@ project_root = Path(__file__).parent.parent
 sys.path.append(str(project_root))
 
 from src.fbus.protocol import FBUSProtocol
+from src.canbus.cache import CapabilityCache
 from src.canbus.interface import CANBusInterface
+from src.canbus.raw import RawCANConnection
 from src.ui.interface import UserInterface
+from src.session.recorder import SessionRecorder
+from src.session.replay import SessionReplay
+from src.stats.metrics import Metrics, StatsExporter
+from src.stats.profiler import ActionProfiler, FORMATS as PROFILE_FORMATS
 
 # Configure logging
 logging.basicConfig(
@@ -33,18 +40,56 @@ def parse_args():
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(description='Nokia 3310 CAN Bus Interface')
     parser.add_argument('--port', type=str, help='FBUS serial port')
-    parser.add_argument('--baud', type=int, default=9600, help='FBUS baud rate')
+    parser.add_argument('--baud', type=int,
+                        help='Fixed FBUS baud rate at 8O1 (default: negotiate up to 115200 8N1)')
     parser.add_argument('--debug', action='store_true', help='Enable debug logging')
     parser.add_argument('--retry', type=int, default=3, help='Connection retry attempts')
+    parser.add_argument('--obd-port', type=str, help='OBD adapter serial port (default: auto-detect)')
+    parser.add_argument('--no-obd-cache', action='store_true',
+                        help='Always run the full OBD protocol search and PID scan')
+    parser.add_argument('--can-channel', type=str,
+                        help='Talk to the vehicle on this raw CAN channel instead of an ELM327 (e.g. can0)')
+    parser.add_argument('--can-interface', type=str, default='socketcan',
+                        help='python-can interface for --can-channel (e.g. socketcan, virtual)')
+    parser.add_argument('--can-bitrate', type=int, default=500000,
+                        help='Raw CAN bitrate (SocketCAN channels keep the one set with ip link)')
+    parser.add_argument('--can-extended', action='store_true',
+                        help='Use 29-bit CAN identifiers on the raw CAN backend')
+    parser.add_argument('--can-block-size', type=int, default=0,
+                        help='ISO-TP block size ECUs may send per flow control (0 = no limit)')
+    parser.add_argument('--can-st-min', type=float, default=0.0,
+                        help='ISO-TP minimum gap between ECU frames in ms (0.1-0.9 or 1-127)')
+    parser.add_argument('--record', type=str, metavar='PATH',
+                        help='Record all FBUS and OBD traffic to a session log')
+    parser.add_argument('--record-max-mb', type=int, default=16,
+                        help='Session log segment size before rotating (MB)')
+    parser.add_argument('--replay', type=str, metavar='PATH',
+                        help='Play a recorded session back instead of using the phone and vehicle')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed: 1 = real time, N = N times faster, 0 = as fast as possible')
+    parser.add_argument('--stats', type=str, metavar='PATH',
+                        help='Periodically write link statistics to a file (JSON if it ends in .json)')
+    parser.add_argument('--stats-interval', type=float, default=10.0,
+                        help='Seconds between statistics dumps')
+    parser.add_argument('--profile', type=str, metavar='DIR',
+                        help='Profile each user interface action, writing results to DIR at exit')
+    parser.add_argument('--profile-format', choices=PROFILE_FORMATS, default='pstats',
+                        help='Profile output: pstats files or collapsed stacks for flame graphs')
+    parser.add_argument('--profile-every', type=int, default=1,
+                        help='Profile one in N runs of each action to lower the overhead')
     return parser.parse_args()
 
-def wait_for_phone(port: str, baudrate: int, max_attempts: int = 3) -> FBUSProtocol:
+def wait_for_phone(port: str, baudrate: int, max_attempts: int = 3,
+                   recorder: SessionRecorder = None,
+                   metrics: Metrics = None) -> FBUSProtocol:
     """Wait for phone to become available.
     
     Args:
         port: Serial port to connect to
         baudrate: Baud rate for connection
         max_attempts: Maximum number of connection attempts
+        recorder: Optional session recorder for all FBUS traffic
+        metrics: Optional registry for link statistics
         
     Returns:
         Connected FBUSProtocol instance
@@ -55,7 +100,8 @@ def wait_for_phone(port: str, baudrate: int, max_attempts: int = 3) -> FBUSProto
     attempt = 0
     while attempt < max_attempts:
         try:
-            fbus = FBUSProtocol(port=port, baudrate=baudrate)
+            fbus = FBUSProtocol(port=port, baudrate=baudrate, recorder=recorder,
+                                metrics=metrics)
             logger.info("Successfully connected to phone")
             return fbus
         except Exception as e:
@@ -74,17 +120,88 @@ def main():
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
     
+    metrics = Metrics()
+    exporter = None
+    if args.stats:
+        exporter = StatsExporter(metrics, args.stats, interval=args.stats_interval)
+        exporter.start()
+    
+    profiler = ActionProfiler(enabled=bool(args.profile), every=args.profile_every)
+    
+    recorder = None
+    try:
+        if args.replay:
+            replay(args, metrics, profiler)
+            return
+        
+        if args.record:
+            recorder = SessionRecorder(args.record, max_bytes=args.record_max_mb * 1024 * 1024)
+        run(args, recorder, metrics, profiler)
+    finally:
+        if recorder:
+            recorder.close()
+        if exporter:
+            exporter.stop()
+        if args.profile:
+            profiler.write(args.profile, args.profile_format)
+            logger.info(f"Profiles written to {args.profile}\n{profiler.summary()}")
+
+def replay(args, metrics: Metrics = None, profiler: ActionProfiler = None):
+    """Run the user interface on a recorded session and report timing."""
+    session = SessionReplay(args.replay, speed=args.speed)
+    fbus = FBUSProtocol(port='replay', serial_port=session.serial, metrics=metrics)
+    canbus = CANBusInterface(connection=session.obd, metrics=metrics)
+    ui = UserInterface(fbus, canbus, profiler)
+    
+    def stop_when_finished():
+        session.serial.finished.wait()
+        ui.running = False
+    
+    threading.Thread(target=stop_when_finished, daemon=True).start()
+    started = time.monotonic()
+    ui.run()
+    elapsed = time.monotonic() - started
+    
+    logger.info(
+        f"Replayed {session.duration:.1f}s of session in {elapsed:.1f}s "
+        f"({session.duration / elapsed if elapsed else 0:.1f}x), "
+        f"{session.serial.mismatches} diverging frames, "
+        f"{session.obd.unanswered} unanswered OBD queries"
+    )
+
+def run(args, recorder: SessionRecorder = None, metrics: Metrics = None,
+        profiler: ActionProfiler = None):
+    """Connect and run the user interface until the user quits."""
     while True:
         try:
             # Initialize FBUS communication with retry
-            fbus = wait_for_phone(args.port, args.baud, args.retry)
+            fbus = wait_for_phone(args.port, args.baud, args.retry, recorder, metrics)
             
             # Initialize CAN bus interface
-            canbus = CANBusInterface()
+            if args.can_channel:
+                canbus = CANBusInterface(
+                    connection=RawCANConnection(
+                        interface=args.can_interface,
+                        channel=args.can_channel,
+                        bitrate=args.can_bitrate,
+                        extended=args.can_extended,
+                        block_size=args.can_block_size,
+                        st_min=args.can_st_min / 1000
+                    ),
+                    recorder=recorder,
+                    metrics=metrics
+                )
+            else:
+                canbus = CANBusInterface(
+                    port=args.obd_port,
+                    cache=None if args.no_obd_cache else CapabilityCache(),
+                    recorder=recorder,
+                    metrics=metrics
+                )
             logger.info("CAN bus interface initialized")
             
             # Start user interface
-            ui = UserInterface(fbus, canbus)
+            ui = UserInterface(fbus, canbus, profiler)
             ui.run()
             
         except KeyboardInterrupt:
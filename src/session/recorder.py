@@ -0,0 +1,370 @@
+"""
+Session Recorder for Nokia 3310 CAN Bus Interface
+Streams FBUS traffic, OBD queries and sensor samples to a binary log
+
+Developed by Khanfar Systems © 2025
+"""
+
+import math
+import time
+import queue
+import struct
+import logging
+import threading
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Event kinds
+EVENT_FBUS_TX = 1       # Frame bytes written to the phone
+EVENT_FBUS_RX = 2       # Raw bytes read from the phone
+EVENT_OBD_QUERY = 3     # OBD command sent to the adapter
+EVENT_OBD_RESPONSE = 4  # Raw adapter lines, value = decoded number
+EVENT_SAMPLE = 5        # Decoded sensor sample, data = sensor name
+EVENT_META = 6          # 'key=value' session information
+
+FLAG_NULL = 0x01  # No value (failed read or null response)
+
+# Time since session start, kind, flags, data length, value, inline data
+_RECORD = struct.Struct('<dBBHd12s')
+# Magic, version, record size, segment number, wall clock at session start
+_FILE_HEADER = struct.Struct('<4sBBHd')
+# Session time, record number within the segment
+_INDEX_ENTRY = struct.Struct('<dI')
+
+RECORD_SIZE = _RECORD.size
+INLINE_DATA = 12
+MAX_DATA = 0xFFFF
+_ZEROS = bytes(RECORD_SIZE)
+
+class Event(NamedTuple):
+    """One recorded event."""
+    time: float
+    kind: int
+    flags: int
+    value: float
+    data: bytes
+
+class SessionRecorder:
+    """Append-only recorder of everything that crosses the two links.
+
+    Every event is one 32-byte record: session time, kind, flags, data
+    length, a float value and the first 12 data bytes. Longer data runs
+    on into the following records. Record N of a segment therefore
+    starts at byte 32 * (N + 1), after the segment header.
+
+    Callers only pack records into an in-memory buffer. A writer thread
+    takes full buffers (or whatever has accumulated every
+    FLUSH_INTERVAL) and appends them to disk. Segments rotate at
+    `max_bytes`, and only the newest `max_segments` are kept. Each
+    segment has a `.idx` file mapping session time to record number
+    every INDEX_EVERY records for seeking. If a segment cannot be
+    created, recording stops for the rest of the session and later
+    events are dropped.
+    """
+
+    MAGIC = b'N3SL'
+    VERSION = 1
+    BUFFER_RECORDS = 2048  # Records packed in memory per disk write
+    FLUSH_INTERVAL = 1.0   # Seconds before a partial buffer is written anyway
+    INDEX_EVERY = 1024     # Records between seek index entries
+    DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+    DEFAULT_MAX_SEGMENTS = 8
+
+    def __init__(self, path: Union[str, Path], max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_segments: Optional[int] = DEFAULT_MAX_SEGMENTS):
+        """Initialize recorder and start its writer thread.
+
+        Args:
+            path: Base path; segments are named <stem>.<NNNN><suffix>
+            max_bytes: Segment size that triggers rotation
+            max_segments: Segments kept on disk, None to keep all
+        """
+        self.path = Path(path)
+        self.max_segments = max_segments
+        self._segment_limit = max(1, max_bytes // RECORD_SIZE - 1)
+        self._t0 = time.monotonic()
+        self._wall0 = time.time()
+        self._lock = threading.Lock()
+        self._buf = bytearray(self.BUFFER_RECORDS * RECORD_SIZE)
+        self._fill = 0
+        self._segment = 0
+        self._segment_records = 0
+        self._next_index = 0
+        self._closed = False
+        self.failed = False  # A segment could not be created, events are dropped
+        self._queue = queue.Queue()
+        self.records = 0
+        self.bytes_written = 0
+        self._file = None
+        self._index = None
+        self._thread = threading.Thread(
+            target=self._run, name='session-recorder', daemon=True
+        )
+        self._queue.put(('open', 0))
+        self._thread.start()
+
+    def segment_path(self, segment: int, suffix: Optional[str] = None) -> Path:
+        """Path of one segment (or its index, with suffix='.idx')."""
+        return self.path.with_name(
+            f"{self.path.stem}.{segment:04d}{suffix or self.path.suffix or '.n3log'}"
+        )
+
+    def record(self, kind: int, data: bytes = b'', value: float = 0.0,
+               flags: int = 0) -> None:
+        """Append one event.
+
+        Args:
+            kind: One of the EVENT_* constants
+            data: Event bytes (bytes, bytearray or memoryview)
+            value: Numeric value, if the event has one
+            flags: FLAG_* bits; data longer than MAX_DATA is split
+                into several events
+        """
+        length = len(data)
+        if length > MAX_DATA:
+            for start in range(0, length, MAX_DATA):
+                self.record(kind, data[start:start + MAX_DATA], value, flags)
+            return
+
+        now = time.monotonic() - self._t0
+        extra = -(-(length - INLINE_DATA) // RECORD_SIZE) if length > INLINE_DATA else 0
+        size = RECORD_SIZE * (1 + extra)
+
+        with self._lock:
+            if self._closed or self.failed:
+                return
+            if self._segment_records + 1 + extra > self._segment_limit and self._segment_records:
+                self._rotate()
+            if self._fill + size > len(self._buf):
+                self._flush()
+
+            if size <= len(self._buf):
+                buf, offset = self._buf, self._fill
+                self._fill += size
+            else:
+                buf, offset = bytearray(size), 0
+
+            _RECORD.pack_into(buf, offset, now, kind, flags, length, value,
+                              bytes(data[:INLINE_DATA]))
+            if extra:
+                start = offset + RECORD_SIZE
+                end = start + length - INLINE_DATA
+                buf[start:end] = data[INLINE_DATA:]
+                buf[end:offset + size] = _ZEROS[:offset + size - end]
+
+            if self._segment_records >= self._next_index:
+                self._queue.put(('index', _INDEX_ENTRY.pack(now, self._segment_records)))
+                self._next_index = self._segment_records + self.INDEX_EVERY
+            self._segment_records += 1 + extra
+            self.records += 1
+
+            if buf is not self._buf:
+                self._queue.put(('data', bytes(buf)))
+
+    def fbus_tx(self, frame: bytes) -> None:
+        """Record a frame written to the phone."""
+        self.record(EVENT_FBUS_TX, frame)
+
+    def fbus_rx(self, chunk: bytes) -> None:
+        """Record bytes read from the phone."""
+        self.record(EVENT_FBUS_RX, chunk)
+
+    def obd_query(self, command: bytes) -> None:
+        """Record an OBD command sent to the adapter."""
+        self.record(EVENT_OBD_QUERY, command)
+
+    def obd_response(self, lines: bytes, value: Optional[float]) -> None:
+        """Record an adapter response.
+
+        Args:
+            lines: Raw response lines joined by newlines
+            value: Decoded numeric value, None if not numeric or null
+        """
+        if value is None:
+            self.record(EVENT_OBD_RESPONSE, lines, math.nan, FLAG_NULL)
+        else:
+            self.record(EVENT_OBD_RESPONSE, lines, value)
+
+    def sample(self, name: str, value: Optional[float]) -> None:
+        """Record a decoded sensor sample."""
+        if value is None:
+            self.record(EVENT_SAMPLE, name.encode('ascii'), math.nan, FLAG_NULL)
+        else:
+            self.record(EVENT_SAMPLE, name.encode('ascii'), value)
+
+    def meta(self, key: str, value) -> None:
+        """Record session information, e.g. the OBD protocol."""
+        self.record(EVENT_META, f"{key}={value}".encode('utf-8'))
+
+    def _flush(self) -> None:
+        """Hand the filled part of the buffer to the writer. Lock held."""
+        if self._fill:
+            self._queue.put(('data', bytes(self._buf[:self._fill])))
+            self._fill = 0
+
+    def _rotate(self) -> None:
+        """Start a new segment. Lock held."""
+        self._flush()
+        self._segment += 1
+        self._segment_records = 0
+        self._next_index = 0
+        self._queue.put(('open', self._segment))
+
+    def flush(self) -> None:
+        """Write everything recorded so far to disk."""
+        with self._lock:
+            self._flush()
+        done = threading.Event()
+        self._queue.put(('sync', done))
+        done.wait()
+
+    def close(self) -> None:
+        """Write remaining records and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._flush()
+            self._queue.put(('close', None))
+        self._thread.join()
+
+    def _run(self) -> None:
+        """Writer thread: append buffers to the current segment."""
+        while True:
+            try:
+                op, arg = self._queue.get(timeout=self.FLUSH_INTERVAL)
+            except queue.Empty:
+                with self._lock:
+                    self._flush()
+                continue
+
+            if self.failed and op in ('data', 'index', 'open'):
+                continue  # Queued before recording stopped
+
+            try:
+                if op == 'data':
+                    self._file.write(arg)
+                    self.bytes_written += len(arg)
+                elif op == 'index':
+                    self._index.write(arg)
+                elif op == 'open':
+                    self._open_segment(arg)
+                elif op == 'sync':
+                    if self._file:
+                        self._file.flush()
+                        self._index.flush()
+                elif op == 'close':
+                    self._close_segment()
+                    return
+            except OSError as e:
+                if op == 'open':
+                    # Nothing to write to: stop instead of failing every write
+                    logger.error(f"Session recording stopped, cannot create segment: {e}")
+                    self._close_segment()
+                    with self._lock:
+                        self.failed = True
+                        self._fill = 0
+                else:
+                    logger.error(f"Session recording failed: {e}")
+            finally:
+                if op == 'sync':
+                    arg.set()
+
+    def _open_segment(self, segment: int) -> None:
+        """Close the current segment and start writing the next one."""
+        self._close_segment()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.segment_path(segment), 'wb')
+        self._index = open(self.segment_path(segment, '.idx'), 'wb')
+        header = _FILE_HEADER.pack(self.MAGIC, self.VERSION, RECORD_SIZE,
+                                   segment, self._wall0)
+        self._file.write(header.ljust(RECORD_SIZE, b'\x00'))
+        logger.info(f"Recording session to {self.segment_path(segment)}")
+
+        if self.max_segments and segment >= self.max_segments:
+            old = segment - self.max_segments
+            for path in (self.segment_path(old), self.segment_path(old, '.idx')):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _close_segment(self) -> None:
+        for f in (self._file, self._index):
+            if f:
+                try:
+                    f.close()
+                except OSError as e:
+                    logger.error(f"Session recording failed: {e}")
+        self._file = self._index = None
+
+def session_segments(path: Union[str, Path]) -> List[Path]:
+    """Find the segments of a recorded session, oldest first.
+
+    Args:
+        path: Base path given to SessionRecorder, or a single segment
+    """
+    path = Path(path)
+    if path.is_file():
+        return [path]
+    suffix = path.suffix or '.n3log'
+    return sorted(
+        p for p in path.parent.glob(f"{path.stem}.[0-9][0-9][0-9][0-9]{suffix}")
+    )
+
+def _read_index(segment: Path) -> List[Tuple[float, int]]:
+    """Load a segment's (session time, record number) seek index."""
+    try:
+        data = segment.with_suffix('.idx').read_bytes()
+    except FileNotFoundError:
+        return []
+    return list(_INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % _INDEX_ENTRY.size]))
+
+def _seek_record(index: List[Tuple[float, int]], start: float) -> int:
+    """Latest indexed record number at or before session time `start`."""
+    record = 0
+    for t, number in index:
+        if t > start:
+            break
+        record = number
+    return record
+
+def read_events(path: Union[str, Path], start: float = 0.0) -> Iterator[Event]:
+    """Iterate over the events of a recorded session.
+
+    Args:
+        path: Base path given to SessionRecorder, or a single segment
+        start: Skip events before this session time, using the seek index
+
+    Yields:
+        Events in recording order
+    """
+    segments = session_segments(path)
+    for number, segment in enumerate(segments):
+        # Skip whole segments when the next one starts before `start`
+        if start and number + 1 < len(segments):
+            following = _read_index(segments[number + 1])
+            if following and following[0][0] <= start:
+                continue
+
+        with open(segment, 'rb') as f:
+            header = f.read(RECORD_SIZE)
+            magic, version, size, _, _ = _FILE_HEADER.unpack_from(header)
+            if magic != SessionRecorder.MAGIC or version != SessionRecorder.VERSION:
+                raise ValueError(f"Not a session log: {segment}")
+
+            f.seek(RECORD_SIZE * (1 + (_seek_record(_read_index(segment), start) if start else 0)))
+            while True:
+                raw = f.read(RECORD_SIZE)
+                if len(raw) < RECORD_SIZE:
+                    break
+                t, kind, flags, length, value, inline = _RECORD.unpack(raw)
+                data = inline[:length]
+                if length > INLINE_DATA:
+                    rest = length - INLINE_DATA
+                    spill = f.read(-(-rest // RECORD_SIZE) * RECORD_SIZE)
+                    data += spill[:rest]
+                if t >= start:
+                    yield Event(t, kind, flags, value, data)
@@ -0,0 +1,295 @@
+"""
+Session Replay for Nokia 3310 CAN Bus Interface
+Plays a recorded session back through stand-ins for the serial port and OBD adapter
+
+Developed by Khanfar Systems © 2025
+"""
+
+import io
+import time
+import logging
+import threading
+from itertools import takewhile
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+import obd
+from obd import OBDResponse, OBDStatus
+from obd.elm327 import ELM327
+
+from src.session.recorder import (
+    Event, read_events, session_segments, EVENT_FBUS_TX, EVENT_FBUS_RX, EVENT_OBD_QUERY,
+    EVENT_OBD_RESPONSE, EVENT_META
+)
+
+logger = logging.getLogger(__name__)
+
+class ReplayClock:
+    """Maps recorded session time to wall time at a playback speed.
+
+    A speed of 0 plays back as fast as possible: nothing ever waits for
+    the clock, only for the events that precede it.
+    """
+
+    def __init__(self, speed: float = 1.0, start: float = 0.0):
+        """Initialize clock.
+
+        Args:
+            speed: Playback speed (1 = real time, 10 = ten times, 0 = unpaced)
+            start: Session time playback starts from
+        """
+        self.speed = speed
+        self.start = start
+        self._origin = None
+
+    def now(self) -> float:
+        """Current session time."""
+        if not self.speed:
+            return float('inf')
+        if self._origin is None:
+            self._origin = time.monotonic()
+        return self.start + (time.monotonic() - self._origin) * self.speed
+
+    def delay(self, t: float) -> float:
+        """Wall seconds until session time `t` (0 if already reached)."""
+        if not self.speed:
+            return 0.0
+        return max(0.0, (t - self.now()) / self.speed)
+
+    def wait_until(self, t: float) -> None:
+        """Sleep until session time `t`."""
+        delay = self.delay(t)
+        if delay:
+            time.sleep(delay)
+
+class ReplaySerial:
+    """Serial port stand-in that returns the bytes the phone sent.
+
+    Each recorded chunk from the phone becomes readable once playback
+    reaches its time and once as many frames have been written as had
+    been written before it in the recording. Responses therefore never
+    overtake the requests they answer, whatever the speed.
+    """
+
+    def __init__(self, events: List[Event], clock: ReplayClock):
+        """Initialize replay port.
+
+        Args:
+            events: Recorded FBUS events in order
+            clock: Playback clock
+        """
+        self.port = 'replay'
+        self.baudrate = 9600
+        self.timeout = 1
+        self.is_open = True
+        self.clock = clock
+        self._rx: Deque[Tuple[float, bytes, int]] = deque()
+        self._tx: List[bytes] = []
+        written = 0
+        for event in events:
+            if event.kind == EVENT_FBUS_TX:
+                self._tx.append(event.data)
+                written += 1
+            elif event.kind == EVENT_FBUS_RX:
+                self._rx.append((event.time, event.data, written))
+        self._pending = bytearray()
+        self._written = 0
+        self._cancelled = False
+        self._cond = threading.Condition()
+        self.mismatches = 0  # Written frames that differ from the recording
+        self.finished = threading.Event()  # Set once every chunk was read
+        if not self._rx:
+            self.finished.set()
+
+    def _release(self) -> Optional[float]:
+        """Move due chunks to the read buffer. Condition held.
+
+        Returns:
+            Wall seconds until the next chunk is due by time, or None if
+            it is waiting for a write (or there is none)
+        """
+        now = self.clock.now()
+        while self._rx:
+            t, data, after = self._rx[0]
+            if self._written < after:
+                return None
+            if t > now:
+                return self.clock.delay(t)
+            self._rx.popleft()
+            self._pending += data
+        return None
+
+    @property
+    def in_waiting(self) -> int:
+        with self._cond:
+            self._release()
+            return len(self._pending)
+
+    def read(self, size: int = 1) -> bytes:
+        """Read up to `size` replayed bytes, waiting up to `timeout`."""
+        deadline = time.monotonic() + (self.timeout or 0)
+        with self._cond:
+            while True:
+                delay = self._release()
+                if self._pending:
+                    data = bytes(self._pending[:size])
+                    del self._pending[:size]
+                    if not self._rx and not self._pending:
+                        self.finished.set()
+                    return data
+
+                remaining = deadline - time.monotonic()
+                if self._cancelled or not self.is_open or remaining <= 0:
+                    self._cancelled = False
+                    return b''
+                self._cond.wait(remaining if delay is None else min(delay, remaining))
+
+    def write(self, data: bytes) -> int:
+        """Accept a frame and let the chunks recorded after it through."""
+        with self._cond:
+            if self._written < len(self._tx) and bytes(data) != self._tx[self._written]:
+                self.mismatches += 1
+                logger.debug(f"Replay diverged at frame {self._written}: {bytes(data).hex()}")
+            self._written += 1
+            self._cond.notify_all()
+        return len(data)
+
+    def fileno(self) -> int:
+        raise io.UnsupportedOperation("Replay port has no file descriptor")
+
+    def cancel_read(self) -> None:
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+class ReplayOBD:
+    """python-obd connection stand-in answering from a recording.
+
+    Each query returns the next recorded response to the same command,
+    decoded by python-obd from the raw adapter lines, so decoding bugs
+    reproduce exactly. Commands never seen in the recording get a null
+    response.
+    """
+
+    def __init__(self, events: List[Event], clock: ReplayClock):
+        """Initialize replay connection.
+
+        Args:
+            events: Recorded OBD and metadata events in order
+            clock: Playback clock
+        """
+        self.clock = clock
+        self._responses: Dict[bytes, Deque[Tuple[float, List[str]]]] = {}
+        self._port = 'replay'
+        protocol_id = '6'
+
+        query = None
+        for event in events:
+            if event.kind == EVENT_OBD_QUERY:
+                query = event.data
+            elif event.kind == EVENT_OBD_RESPONSE and query is not None:
+                lines = event.data.decode('ascii', 'replace').split('\n')
+                self._responses.setdefault(query, deque()).append(
+                    (event.time, [line for line in lines if line])
+                )
+                query = None
+            elif event.kind == EVENT_META:
+                key, _, value = event.data.decode('utf-8').partition('=')
+                if key == 'obd_protocol':
+                    protocol_id = value
+                elif key == 'obd_port':
+                    self._port = value
+
+        self._protocol = ELM327._SUPPORTED_PROTOCOLS[protocol_id]([])
+        self._lock = threading.Lock()
+        # Everything the recorded session asked for counts as supported
+        self.supported_commands = {
+            command
+            for mode in obd.commands.modes
+            for command in mode
+            if command is not None and command.command in self._responses
+        }
+        self.unanswered = 0  # Queries the recording had no response for
+
+    def is_connected(self) -> bool:
+        return True
+
+    def status(self) -> str:
+        return OBDStatus.CAR_CONNECTED
+
+    def port_name(self) -> str:
+        return self._port
+
+    def protocol_id(self) -> str:
+        return self._protocol.ELM_ID
+
+    def query(self, command, force: bool = False) -> OBDResponse:
+        """Return the next recorded response to a command."""
+        with self._lock:
+            recorded = self._responses.get(command.command)
+            if not recorded:
+                self.unanswered += 1
+                return OBDResponse()
+            t, lines = recorded.popleft()
+
+        self.clock.wait_until(t)
+        messages = self._protocol(lines)
+        if not messages:
+            return OBDResponse()
+        return command(messages)
+
+    def watch(self, command, callback=None, force: bool = False) -> None:
+        pass
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def unwatch_all(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+class SessionReplay:
+    """A recorded session ready to be played back.
+
+    Example:
+        replay = SessionReplay('logs/session.n3log', speed=10)
+        fbus = FBUSProtocol(port='replay', serial_port=replay.serial)
+        canbus = CANBusInterface(connection=replay.obd)
+    """
+
+    def __init__(self, path: Union[str, Path], speed: float = 1.0, start: float = 0.0):
+        """Load a recorded session.
+
+        Args:
+            path: Base path the session was recorded to, or one segment
+            speed: Playback speed (1 = real time, 10 = ten times, 0 = unpaced)
+            start: Session time to start from
+        """
+        events = list(read_events(path, start))
+        if not events:
+            raise ValueError(f"No recorded events in {path}")
+        if start:
+            # Connection details are recorded at the start of the session
+            head = takewhile(lambda e: e.time < start, read_events(session_segments(path)[0]))
+            events[:0] = [e for e in head if e.kind == EVENT_META]
+        self.clock = ReplayClock(speed, events[0].time)
+        self.serial = ReplaySerial(
+            [e for e in events if e.kind in (EVENT_FBUS_TX, EVENT_FBUS_RX)],
+            self.clock
+        )
+        self.obd = ReplayOBD(
+            [e for e in events if e.kind in (EVENT_OBD_QUERY, EVENT_OBD_RESPONSE, EVENT_META)],
+            self.clock
+        )
+        self.duration = events[-1].time - events[0].time
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Virtual ECU for Nokia 3310 CAN Bus Interface
+Simulated engine ECU answering OBD requests on a python-can bus
+
+Developed by Khanfar Systems © 2025
+"""
+
+import sys
+import time
+import logging
+import argparse
+import threading
+from pathlib import Path
+from typing import Optional
+
+import can
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent
+sys.path.append(str(project_root))
+
+from src.canbus.isotp import IsoTpTransport
+from src.sim.elm327 import VehicleModel
+
+logger = logging.getLogger(__name__)
+
+class VirtualECU:
+    """Engine ECU speaking ISO 15765-4 on a python-can bus.
+
+    Answers functional and physical requests with the same vehicle
+    model as the ELM327 emulator. Multi-frame responses wait for the
+    tester's flow control and honor its block size and STmin.
+    """
+
+    FUNCTIONAL_ID = 0x7DF
+    FUNCTIONAL_ID_29 = 0x18DB33F1
+
+    def __init__(self, vehicle: Optional[VehicleModel] = None, interface: str = 'virtual',
+                 channel: str = 'vcan0', address: int = 0, extended: bool = False,
+                 delay: float = 0.0, bus: Optional[can.BusABC] = None):
+        """Initialize ECU.
+
+        Args:
+            vehicle: Emulated vehicle (default: VehicleModel())
+            interface: python-can interface the ECU opens its bus on
+            channel: Bus channel
+            address: ECU number (0 = engine, 1 = transmission, ...)
+            extended: Use 29-bit instead of 11-bit identifiers
+            delay: Seconds before each response
+            bus: Already-open bus to use instead of opening one
+        """
+        self.vehicle = vehicle or VehicleModel()
+        self.extended = extended
+        self.delay = delay
+        self._own_bus = bus is None
+        self.bus = bus or can.Bus(interface=interface, channel=channel)
+        self.transport = IsoTpTransport(self.bus, extended)
+        if extended:
+            ecu = 0x10 + address
+            self.functional_id = self.FUNCTIONAL_ID_29
+            self.request_id = 0x18DA00F1 | (ecu << 8)
+            self.response_id = 0x18DAF100 | ecu
+        else:
+            self.functional_id = self.FUNCTIONAL_ID
+            self.request_id = 0x7E0 + address
+            self.response_id = 0x7E8 + address
+        self._started = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.requests = 0
+
+    def start(self) -> None:
+        """Start answering requests."""
+        self._started = time.monotonic()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='virtual-ecu', daemon=True)
+        self._thread.start()
+        logger.info(f"Virtual ECU answering on {self.response_id:X}")
+
+    def stop(self) -> None:
+        """Stop answering and close the bus if the ECU opened it."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._own_bus:
+            self.bus.shutdown()
+
+    def _run(self) -> None:
+        """Answer single-frame requests until stopped."""
+        while not self._stop_event.is_set():
+            message = self.bus.recv(0.05)
+            if message is None or message.arbitration_id not in (self.functional_id,
+                                                                  self.request_id):
+                continue
+            data = message.data
+            if not data or data[0] >> 4 != 0x0:
+                continue  # Only single-frame requests (and stray flow control)
+            request = bytes(data[1:1 + (data[0] & 0x0F)])
+            if not request:
+                continue
+            self.requests += 1
+            response = self.vehicle.respond(request, time.monotonic() - self._started)
+            if response is None:
+                if message.arbitration_id == self.request_id:
+                    self._respond(bytes((0x7F, request[0], 0x12)))  # Sub-function not supported
+                continue
+            if self.delay:
+                time.sleep(self.delay)
+            self._respond(response)
+
+    def _respond(self, data: bytes) -> None:
+        """Send a response, segmented if it does not fit one frame."""
+        if not self.transport.send(self.response_id, data, flow_id=self.request_id):
+            logger.debug("No flow control, dropped response")
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Virtual engine ECU on a CAN bus')
+    parser.add_argument('--interface', type=str, default='socketcan',
+                        help='python-can interface (e.g. socketcan, virtual)')
+    parser.add_argument('--channel', type=str, default='vcan0', help='CAN channel')
+    parser.add_argument('--extended', action='store_true', help='Use 29-bit identifiers')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Seconds before each response')
+    parser.add_argument('--dtc', action='append', default=[],
+                        help='Stored trouble code (repeatable), e.g. P0301')
+    parser.add_argument('--vin', type=str, default='WVWZZZ1JZXW386759', help='Vehicle VIN')
+    return parser.parse_args()
+
+def main():
+    """Run a virtual ECU until interrupted."""
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    ecu = VirtualECU(
+        VehicleModel(dtcs=args.dtc, vin=args.vin),
+        interface=args.interface,
+        channel=args.channel,
+        extended=args.extended,
+        delay=args.delay
+    )
+    ecu.start()
+    print(f"Virtual ECU on {args.interface}:{args.channel}, connect with: "
+          f"python src/main.py --can-channel {args.channel}"
+          + (" --can-extended" if args.extended else ""))
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Answered {ecu.requests} OBD requests")
+        ecu.stop()
+
+if __name__ == '__main__':
+    main()
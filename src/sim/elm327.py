@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+ELM327 Emulator for Nokia 3310 CAN Bus Interface
+Simulated OBDLink/ELM327 adapter and vehicle on a pseudo-terminal
+
+Developed by Khanfar Systems © 2025
+"""
+
+import os
+import sys
+import tty
+import math
+import time
+import errno
+import random
+import select
+import logging
+import argparse
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent
+sys.path.append(str(project_root))
+
+logger = logging.getLogger(__name__)
+
+# A sensor value, or a function of seconds since the emulator started
+Signal = Union[float, Callable[[float], float]]
+
+def _byte(value: float) -> bytes:
+    return bytes([max(0, min(255, int(round(value))))])
+
+def _word(value: float) -> bytes:
+    value = max(0, min(0xFFFF, int(round(value))))
+    return bytes([value >> 8, value & 0xFF])
+
+# Mode 01 PID -> (name, encoder from physical value to data bytes)
+PID_ENCODERS = {
+    0x04: ('ENGINE_LOAD', lambda v: _byte(v * 255 / 100)),
+    0x05: ('COOLANT_TEMP', lambda v: _byte(v + 40)),
+    0x0B: ('INTAKE_PRESSURE', _byte),
+    0x0C: ('RPM', lambda v: _word(v * 4)),
+    0x0D: ('SPEED', _byte),
+    0x0F: ('INTAKE_TEMP', lambda v: _byte(v + 40)),
+    0x10: ('MAF', lambda v: _word(v * 100)),
+    0x11: ('THROTTLE_POS', lambda v: _byte(v * 255 / 100)),
+    0x2F: ('FUEL_LEVEL', lambda v: _byte(v * 255 / 100)),
+    0x46: ('AMBIANT_AIR_TEMP', lambda v: _byte(v + 40)),
+}
+
+class VehicleModel:
+    """Sensor values, trouble codes and identity of the emulated vehicle."""
+
+    def __init__(self, sensors: Optional[Dict[str, Signal]] = None,
+                 dtcs: Optional[List[str]] = None,
+                 vin: str = 'WVWZZZ1JZXW386759'):
+        """Initialize vehicle model.
+
+        Args:
+            sensors: Sensor name (as in PID_ENCODERS) to value or function
+                of time; default is an idling-then-driving engine
+            dtcs: Stored trouble codes, e.g. ['P0301']
+            vin: 17-character vehicle identification number
+        """
+        if sensors is None:
+            sensors = {
+                'RPM': lambda t: 1800 + 1000 * math.sin(t / 5),
+                'SPEED': lambda t: 60 + 30 * math.sin(t / 20),
+                'ENGINE_LOAD': lambda t: 35 + 15 * math.sin(t / 7),
+                'COOLANT_TEMP': lambda t: min(90.0, 20 + t),
+                'INTAKE_TEMP': 25.0,
+                'THROTTLE_POS': lambda t: 20 + 10 * math.sin(t / 3),
+                'FUEL_LEVEL': 62.0,
+            }
+        self.sensors = sensors
+        self.dtcs = list(dtcs or [])
+        self.vin = vin
+        self._by_name = {name: pid for pid, (name, _) in PID_ENCODERS.items()}
+
+    def supported_pids(self) -> List[int]:
+        """Mode 01 PIDs the vehicle answers."""
+        return sorted(self._by_name[name] for name in self.sensors if name in self._by_name)
+
+    def read_pid(self, pid: int, t: float) -> Optional[bytes]:
+        """Encode a Mode 01 PID's current value.
+
+        Args:
+            pid: Mode 01 PID
+            t: Seconds since the emulator started
+
+        Returns:
+            Data bytes after the PID, or None if not supported
+        """
+        entry = PID_ENCODERS.get(pid)
+        if entry is None or entry[0] not in self.sensors:
+            return None
+        name, encode = entry
+        signal = self.sensors[name]
+        return encode(signal(t) if callable(signal) else signal)
+
+    def dtc_bytes(self) -> bytes:
+        """Stored trouble codes in their two-byte encoding."""
+        data = bytearray()
+        for code in self.dtcs:
+            value = int(code[1:], 16) | ('PCBU'.index(code[0]) << 14)
+            data += bytes([value >> 8, value & 0xFF])
+        return bytes(data)
+
+    def respond(self, request: bytes, t: float) -> Optional[bytes]:
+        """Build the vehicle's response data to an OBD request.
+
+        Args:
+            request: Mode byte followed by PIDs (e.g. 01 0C 0D)
+            t: Seconds since the emulation started
+
+        Returns:
+            Response data starting with the mode byte + 0x40, or None
+            if nothing is supported
+        """
+        mode, pids = request[0], request[1:]
+        if mode == 0x01:
+            response = bytearray([0x41])
+            supported = self.supported_pids()
+            for pid in pids:
+                if pid % 0x20 == 0:
+                    # Next bitmap is advertised if any higher PID exists
+                    more = [pid + 0x20] if any(p > pid + 0x20 for p in supported) else []
+                    data = _bitmap(supported + more, pid)
+                else:
+                    data = self.read_pid(pid, t)
+                    if data is None:
+                        continue
+                response += bytes([pid]) + data
+            return bytes(response) if len(response) > 1 else None
+
+        if mode == 0x03:
+            codes = self.dtc_bytes()
+            return bytes([0x43, len(codes) // 2]) + codes
+
+        if mode == 0x04:
+            self.dtcs.clear()
+            return b'\x44'
+
+        if mode == 0x09 and pids:
+            pid = pids[0]
+            if pid == 0x00:
+                return b'\x49\x00' + _bitmap([0x02], 0)
+            if pid == 0x02:
+                return b'\x49\x02\x01' + self.vin.encode('ascii')[:17].ljust(17, b'0')
+        return None
+
+def _bitmap(pids: List[int], base: int) -> bytes:
+    """PID-support bitmap for PIDs base+1 to base+32."""
+    bits = 0
+    for pid in pids:
+        if base < pid <= base + 32:
+            bits |= 1 << (32 - (pid - base))
+    return bits.to_bytes(4, 'big')
+
+class ELM327Emulator:
+    """ELM327-compatible adapter on a pseudo-terminal.
+
+    Speaks enough of the ELM327 command set for python-obd to connect,
+    auto-detect the protocol and query Mode 01 (including multi-PID
+    requests), 03, 04 and 09. Only CAN protocols connect. Responses are
+    formatted as CAN frames with ISO-TP segmentation, exactly as the
+    adapter prints them with headers on or off.
+    """
+
+    PROMPT = b'>'
+    VERSION = 'ELM327 v1.5'
+    CAN_PROTOCOLS = {'6': False, '7': True, '8': False, '9': True}  # ID -> 29-bit
+
+    def __init__(self, vehicle: Optional[VehicleModel] = None, protocol: str = '6',
+                 delay: float = 0.0, jitter: float = 0.0, seed: Optional[int] = None):
+        """Initialize emulator.
+
+        Args:
+            vehicle: Emulated vehicle (default: VehicleModel())
+            protocol: Protocol the vehicle speaks ('6' to '9')
+            delay: Seconds before each OBD response
+            jitter: Up to this many extra random seconds per response
+            seed: Random seed for reproducible jitter
+        """
+        if protocol not in self.CAN_PROTOCOLS:
+            raise ValueError(f"Unsupported protocol: {protocol}")
+        self.vehicle = vehicle or VehicleModel()
+        self.vehicle_protocol = protocol
+        self.delay = delay
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._master = None
+        self._slave = None
+        self._started = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.port = None
+        self.requests = 0
+        self.resets = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        """Restore power-on settings (ATZ / ATD)."""
+        self.echo = True
+        self.headers = False
+        self.linefeeds = True
+        self.spaces = True
+        self.protocol = '0'  # Automatic
+
+    def start(self) -> str:
+        """Open the pseudo-terminal and start answering.
+
+        Returns:
+            Device path for python-obd to open (e.g. /dev/pts/4)
+        """
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._started = time.monotonic()
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='elm327-emulator', daemon=True
+        )
+        self._thread.start()
+        logger.info(f"ELM327 emulator listening on {self.port}")
+        return self.port
+
+    def stop(self) -> None:
+        """Stop answering and close the pseudo-terminal."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def _run(self) -> None:
+        """Read carriage-return terminated commands and answer them."""
+        line = bytearray()
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 1024)
+            except OSError as e:
+                if e.errno == errno.EIO:
+                    continue  # Client not connected
+                raise
+
+            for byte in data:
+                if byte != 0x0D:
+                    line.append(byte)
+                    continue
+                command = line.decode('ascii', 'ignore')
+                line.clear()
+                reply = self.handle(command)
+                out = (command + '\r' if self.echo else '') + reply
+                self._write(out)
+
+    def _write(self, text: str) -> None:
+        eol = '\r\n' if self.linefeeds else '\r'
+        os.write(self._master, text.replace('\r', eol).encode('ascii') + self.PROMPT)
+
+    def handle(self, command: str) -> str:
+        """Answer one command line.
+
+        Args:
+            command: Command without its carriage return
+
+        Returns:
+            Response text including the trailing blank line
+        """
+        cmd = command.replace(' ', '').upper().strip('\x7f')
+        if not cmd:
+            return '?\r\r'
+        if cmd.startswith('AT'):
+            return self._at(cmd[2:]) + '\r\r'
+        try:
+            request = bytes.fromhex(cmd[:len(cmd) & ~1])
+        except ValueError:
+            return '?\r\r'
+        if not request:
+            return '?\r\r'
+
+        self.requests += 1
+        delay = self.delay + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.protocol.lstrip('A') not in ('0', self.vehicle_protocol):
+            return 'UNABLE TO CONNECT\r\r'
+        if self.protocol == '0':
+            self.protocol = 'A' + self.vehicle_protocol  # Found by search
+
+        response = self._obd(request)
+        if response is None:
+            return 'NO DATA\r\r'
+        return '\r'.join(self._frames(response)) + '\r\r'
+
+    def _at(self, cmd: str) -> str:
+        """Answer an AT command (without the 'AT' prefix)."""
+        if cmd in ('Z', 'WS', 'D'):
+            self._reset()
+            if cmd == 'Z':
+                self.resets += 1
+            return self.VERSION if cmd != 'D' else 'OK'
+        if cmd == 'I':
+            return self.VERSION
+        if cmd == 'RV':
+            return '12.6V'
+        if cmd == 'DPN':
+            return self.protocol
+        if cmd == 'DP':
+            return 'AUTO, ISO 15765-4 (CAN)' if self.protocol.startswith('A') else 'ISO 15765-4 (CAN)'
+        if cmd[:2] in ('SP', 'TP'):
+            self.protocol = cmd[2:].lstrip('A') or '0'
+            return 'OK'
+        flags = {'E': 'echo', 'H': 'headers', 'L': 'linefeeds', 'S': 'spaces'}
+        if len(cmd) == 2 and cmd[0] in flags and cmd[1] in '01':
+            setattr(self, flags[cmd[0]], cmd[1] == '1')
+            return 'OK'
+        return 'OK'
+
+    def _obd(self, request: bytes) -> Optional[bytes]:
+        """Build the vehicle's response data to an OBD request."""
+        return self.vehicle.respond(request, time.monotonic() - self._started)
+
+    def _frames(self, data: bytes) -> List[str]:
+        """Format response data as the CAN frames the adapter prints."""
+        sep = ' ' if self.spaces else ''
+        header = '18DAF110' if self.CAN_PROTOCOLS[self.vehicle_protocol] else '7E8'
+        if self.spaces and len(header) == 8:
+            header = ' '.join(header[i:i + 2] for i in range(0, 8, 2))
+
+        def line(pci: bytes, payload: bytes) -> str:
+            text = sep.join(f"{b:02X}" for b in pci + payload)
+            return f"{header}{sep}{text}" if self.headers else text
+
+        if len(data) <= 7:
+            if self.headers:
+                return [line(bytes([len(data)]), data)]
+            return [sep.join(f"{b:02X}" for b in data)]
+
+        # ISO-TP: first frame, then consecutive frames of 7 bytes
+        frames = [line(bytes([0x10 | (len(data) >> 8), len(data) & 0xFF]), data[:6])]
+        for index, start in enumerate(range(6, len(data), 7)):
+            frames.append(line(bytes([0x20 | ((index + 1) & 0x0F)]), data[start:start + 7]))
+        if self.headers:
+            return frames
+
+        # Without headers the adapter prints the length and numbered lines
+        numbered = [f"{len(data):03X}", f"0:{sep}{sep.join(f'{b:02X}' for b in data[:6])}"]
+        for index, start in enumerate(range(6, len(data), 7)):
+            chunk = sep.join(f"{b:02X}" for b in data[start:start + 7])
+            numbered.append(f"{(index + 1) & 0x0F:X}:{sep}{chunk}")
+        return numbered
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='ELM327 adapter and vehicle emulator on a pseudo-terminal'
+    )
+    parser.add_argument('--protocol', type=str, default='6',
+                        help='Vehicle CAN protocol: 6/8 (11-bit), 7/9 (29-bit)')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Seconds before each OBD response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Random extra seconds per response, up to this value')
+    parser.add_argument('--dtc', action='append', default=[],
+                        help='Stored trouble code (repeatable), e.g. P0301')
+    parser.add_argument('--vin', type=str, default='WVWZZZ1JZXW386759', help='Vehicle VIN')
+    parser.add_argument('--seed', type=int, help='Random seed for jitter')
+    return parser.parse_args()
+
+def main():
+    """Run an emulated adapter until interrupted."""
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    emulator = ELM327Emulator(
+        VehicleModel(dtcs=args.dtc, vin=args.vin),
+        protocol=args.protocol,
+        delay=args.delay,
+        jitter=args.jitter,
+        seed=args.seed
+    )
+    port = emulator.start()
+    print(f"ELM327 emulator on {port}, connect with: python src/main.py --obd-port {port}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Answered {emulator.requests} OBD requests, {emulator.resets} resets")
+        emulator.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Virtual Nokia 3310 for the CAN Bus Interface
+Simulated phone speaking FBUS on a pseudo-terminal, for testing without hardware
+
+Developed by Khanfar Systems © 2025
+"""
+
+import os
+import sys
+import tty
+import time
+import errno
+import random
+import select
+import struct
+import termios
+import logging
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent.parent
+sys.path.append(str(project_root))
+
+from src.fbus.decoder import FBUSDecoder, FBUSFrame, FBUSReassembler, xor_checksum
+
+logger = logging.getLogger(__name__)
+
+# termios speed constants by baud rate
+_SPEEDS = {
+    getattr(termios, f'B{rate}'): rate
+    for rate in (1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200, 230400)
+    if hasattr(termios, f'B{rate}')
+}
+
+class VirtualPhone:
+    """FBUS peer emulating the phone side of the link.
+
+    Frames from the host are acknowledged and answered like the phone
+    does: memory reads and writes go to an emulated memory region,
+    display frames update an emulated screen, and keypress polls return
+    the next scripted key that is due. Keys can also be pushed as
+    unsolicited keypress frames.
+
+    Replies can be delayed by a fixed latency plus random jitter, and
+    each transmitted byte can be corrupted with a given probability to
+    exercise the host's resynchronization.
+
+    When `baud_rates` is given, the phone checks the line settings the
+    host applied to the pseudo-terminal, like a real UART would: at an
+    unsupported rate or with parity enabled, host bytes are dropped and
+    replies arrive as garbage.
+    """
+
+    # FBUS constants, phone side
+    FRAME_ID = 0x1E
+    PHONE_DEV = 0x00
+    PC_DEV = 0x0C
+    ACK_ID = 0x7F
+    MAX_FRAME_PAYLOAD = 120
+
+    # Message types handled
+    MSG_DISPLAY = 0x20
+    MSG_KEYPRESS = 0x21
+    MSG_MENU = 0x22
+    CMD_READ_MEM = 0x23
+    CMD_WRITE_MEM = 0x24
+    MSG_DISPLAY_UPDATE = 0x25
+
+    def __init__(self, memory_size: int = 0x10000, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0,
+                 keys: Optional[List[Tuple[float, int]]] = None,
+                 push_keys: bool = False, seed: Optional[int] = None,
+                 baud_rates: Optional[Sequence[int]] = None,
+                 baud_error_rates: Optional[Dict[int, float]] = None):
+        """Initialize virtual phone.
+
+        Args:
+            memory_size: Size of the emulated memory in bytes
+            latency: Seconds before each ack and reply is sent
+            jitter: Up to this many extra random seconds per reply
+            error_rate: Probability of corrupting each transmitted byte
+            keys: Scripted (seconds after start, key code) presses
+            push_keys: Send keys as unsolicited frames instead of
+                answering keypress polls
+            seed: Random seed for reproducible jitter and errors
+            baud_rates: Rates the phone understands at 8N1, or None to
+                ignore the line settings
+            baud_error_rates: Byte corruption probability per baud rate,
+                overriding `error_rate` (e.g. a noisy link at 115200)
+        """
+        self.memory = bytearray(memory_size)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.push_keys = push_keys
+        self.baud_rates = set(baud_rates) if baud_rates else None
+        self.baud_error_rates = baud_error_rates or {}
+        self.screen = b''
+        self.screen_time = 0.0  # time.monotonic() of the last screen change
+        self.key_time = 0.0     # time.monotonic() of the last key handed out
+        self._keys = sorted(keys or [])
+        self._random = random.Random(seed)
+        self._decoder = FBUSDecoder(local_dev=self.PHONE_DEV)
+        self._reassembler = FBUSReassembler()
+        self._sequence = 0x40
+        self._master = None
+        self._slave = None
+        self._started = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.port = None
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.bytes_corrupted = 0
+
+    @property
+    def checksum_errors(self) -> int:
+        """Host frames dropped for bad checksums."""
+        return self._decoder.checksum_errors
+
+    def start(self) -> str:
+        """Open the pseudo-terminal and start answering.
+
+        Returns:
+            Device path for the host to open (e.g. /dev/pts/3)
+        """
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._started = time.monotonic()
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='virtual-phone', daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Virtual phone listening on {self.port}")
+        return self.port
+
+    def stop(self) -> None:
+        """Stop answering and close the pseudo-terminal."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def press(self, key: int, delay: float = 0.0) -> None:
+        """Schedule a keypress `delay` seconds from now."""
+        at = time.monotonic() - self._started + delay
+        self._keys.append((at, key))
+        self._keys.sort()
+
+    def _next_key(self) -> Optional[int]:
+        """Take the next scripted key that is due."""
+        if self._keys and self._keys[0][0] <= time.monotonic() - self._started:
+            return self._keys.pop(0)[1]
+        return None
+
+    def _line_rate(self) -> Optional[int]:
+        """Baud rate the host set, or None if the phone cannot follow it."""
+        _, _, cflag, _, ispeed, _, _ = termios.tcgetattr(self._slave)
+        rate = _SPEEDS.get(ispeed)
+        if self.baud_rates is None:
+            return rate
+        if rate not in self.baud_rates or cflag & termios.PARENB:
+            return None
+        return rate
+
+    def _run(self) -> None:
+        """Answer host frames and push due keys until stopped."""
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.01)
+            if readable:
+                try:
+                    data = os.read(self._master, 4096)
+                except OSError as e:
+                    if e.errno == errno.EIO:
+                        continue  # Host not connected
+                    raise
+                if self.baud_rates is not None and self._line_rate() is None:
+                    continue  # Framing errors, nothing intelligible
+                for frame in self._decoder.feed(data):
+                    self._handle(frame)
+
+            if self.push_keys:
+                key = self._next_key()
+                if key is not None:
+                    self.key_time = time.monotonic()
+                    self._send(self.MSG_KEYPRESS, bytes([key]))
+
+    def _handle(self, frame: FBUSFrame) -> None:
+        """Acknowledge a host frame and answer complete messages."""
+        if frame.msg_type == self.ACK_ID:
+            return
+        self.frames_received += 1
+        self._delay()
+        self._write(bytes((self.ACK_ID, frame.sequence)))
+
+        payload = self._reassembler.add(frame)
+        if payload is None:
+            return
+
+        msg_type = frame.msg_type
+        if msg_type == self.CMD_READ_MEM and len(payload) >= 3:
+            address, length = struct.unpack('>HB', payload[:3])
+            reply = bytes(self.memory[address:address + length])
+        elif msg_type == self.CMD_WRITE_MEM and len(payload) >= 2:
+            address = struct.unpack('>H', payload[:2])[0]
+            data = payload[2:]
+            self.memory[address:address + len(data)] = data
+            reply = b'\x00'
+        elif msg_type == self.MSG_KEYPRESS:
+            key = None if self.push_keys else self._next_key()
+            reply = bytes([key]) if key is not None else b''
+            if key is not None:
+                self.key_time = time.monotonic()
+        elif msg_type == self.MSG_DISPLAY:
+            self.screen = payload
+            self.screen_time = time.monotonic()
+            reply = b''
+        elif msg_type == self.MSG_DISPLAY_UPDATE:
+            self._apply_update(payload)
+            self.screen_time = time.monotonic()
+            reply = b''
+        else:
+            reply = b''
+
+        self._delay()
+        self._send(msg_type, reply)
+
+    def _apply_update(self, payload: bytes) -> None:
+        """Apply [row][column][length][characters] runs to the screen."""
+        rows = [bytearray(row) for row in self.screen.split(b'\n')]
+        i = 0
+        while i + 3 <= len(payload):
+            row, column, length = payload[i:i + 3]
+            if row < len(rows):
+                rows[row][column:column + length] = payload[i + 3:i + 3 + length]
+            i += 3 + length
+        self.screen = b'\n'.join(bytes(row) for row in rows)
+
+    def _send(self, msg_type: int, payload: bytes) -> None:
+        """Send a message to the host, split into frames as needed."""
+        size = self.MAX_FRAME_PAYLOAD
+        count = max(1, -(-len(payload) // size))
+        for index in range(count):
+            part = payload[index * size:(index + 1) * size]
+            frame = bytearray(struct.pack(
+                '>BBBBH', self.FRAME_ID, self.PC_DEV, self.PHONE_DEV,
+                msg_type, len(part)
+            ))
+            frame += part
+            frame += bytes((count - index, self._sequence))
+            frame += bytes(xor_checksum(frame))
+            self._sequence = (self._sequence + 1) & 0x07 | 0x40
+            self._write(frame)
+            self.frames_sent += 1
+
+    def _delay(self) -> None:
+        """Wait the configured latency plus jitter."""
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _write(self, data: bytes) -> None:
+        """Write to the host, corrupting bytes at the configured rate."""
+        error_rate = self.error_rate
+        if self.baud_rates is not None or self.baud_error_rates:
+            rate = self._line_rate()
+            if rate is None and self.baud_rates is not None:
+                data = bytes(self._random.randrange(256) for _ in data)
+            error_rate = self.baud_error_rates.get(rate, error_rate)
+        if error_rate:
+            data = bytearray(data)
+            for i in range(len(data)):
+                if self._random.random() < error_rate:
+                    data[i] ^= 1 << self._random.randrange(8)
+                    self.bytes_corrupted += 1
+        os.write(self._master, data)
+
+def parse_keys(script: str) -> List[Tuple[float, int]]:
+    """Parse a key script like '1.0:1,2.5:5,4:0' into (time, key) pairs."""
+    keys = []
+    for item in filter(None, script.split(',')):
+        at, _, key = item.partition(':')
+        keys.append((float(at), int(key)))
+    return keys
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Simulated Nokia 3310 on a pseudo-terminal'
+    )
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds before each ack and reply')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Random extra seconds per reply, up to this value')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Probability of corrupting each transmitted byte')
+    parser.add_argument('--keys', type=str, default='',
+                        help="Scripted keys as 'seconds:key,...', e.g. '1:1,3:5,10:0'")
+    parser.add_argument('--push-keys', action='store_true',
+                        help='Push keys as unsolicited frames instead of answering polls')
+    parser.add_argument('--seed', type=int, help='Random seed for jitter and errors')
+    parser.add_argument('--baud-rates', type=str, default='',
+                        help="Rates understood at 8N1, e.g. '9600,115200' (default: any setting)")
+    return parser.parse_args()
+
+def main():
+    """Run a virtual phone until interrupted."""
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    phone = VirtualPhone(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        keys=parse_keys(args.keys),
+        push_keys=args.push_keys,
+        seed=args.seed,
+        baud_rates=[int(rate) for rate in args.baud_rates.split(',') if rate]
+    )
+    port = phone.start()
+    print(f"Virtual phone on {port}, connect with: python src/main.py --port {port}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Received {phone.frames_received} frames, sent {phone.frames_sent}, "
+              f"{phone.checksum_errors} checksum errors, {phone.bytes_corrupted} bytes corrupted")
+        phone.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+Link Metrics for Nokia 3310 CAN Bus Interface
+Counters and latency histograms cheap enough to stay on all the time
+
+Developed by Khanfar Systems © 2025
+"""
+
+import os
+import json
+import math
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+class Counter:
+    """Monotonic event counter.
+
+    Increments are not locked. Under the GIL a concurrent increment can
+    in rare cases be lost, which is acceptable for statistics and keeps
+    the cost to one attribute update.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+class Histogram:
+    """Log-linear latency histogram with fixed buckets.
+
+    Each power of two microseconds is split into SUB_BUCKETS linear
+    buckets, so percentiles are within 1/(2 * SUB_BUCKETS) of the true
+    value from 1 µs up to over an hour. Recording is one `frexp` and a
+    list update, with no allocation or locking.
+    """
+    __slots__ = ('counts', 'total', 'max')
+
+    SUB_BUCKETS = 8
+    EXPONENTS = 32  # 2**32 µs is about 71 minutes
+    SIZE = EXPONENTS * SUB_BUCKETS + 1  # Plus one bucket below 1 µs
+
+    def __init__(self):
+        self.counts = [0] * self.SIZE
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float, _frexp=math.frexp) -> None:
+        """Add one latency sample in seconds."""
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        mantissa, exponent = _frexp(seconds * 1e6)
+        if exponent < 1:
+            self.counts[0] += 1
+            return
+        # 1 + (exponent - 1) * SUB_BUCKETS + sub-bucket, with literals for speed
+        index = exponent * 8 - 7 + int(mantissa * 16 - 8)
+        self.counts[index if index < 257 else 256] += 1
+
+    @property
+    def count(self) -> int:
+        """Number of samples recorded."""
+        return sum(self.counts)
+
+    @classmethod
+    def _bucket_value(cls, index: int) -> float:
+        """Midpoint of a bucket in seconds."""
+        if index == 0:
+            return 0.5e-6
+        exponent, sub = divmod(index - 1, cls.SUB_BUCKETS)
+        low = 2.0 ** exponent
+        width = low / cls.SUB_BUCKETS
+        return (low + width * (sub + 0.5)) / 1e6
+
+    def percentiles(self, points: List[float]) -> List[float]:
+        """Estimate several percentiles at once.
+
+        Args:
+            points: Percentiles to estimate, ascending (e.g. [50, 90, 99])
+
+        Returns:
+            Estimated latency in seconds for each point (0 when empty)
+        """
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return [0.0] * len(points)
+        results = []
+        seen = 0
+        index = 0
+        for point in points:
+            rank = max(1, math.ceil(total * point / 100))
+            while seen + counts[index] < rank:
+                seen += counts[index]
+                index += 1
+            results.append(min(self._bucket_value(index), self.max))
+        return results
+
+    def summary(self) -> Dict[str, float]:
+        """Count, mean, percentiles and maximum in milliseconds."""
+        p50, p90, p99 = self.percentiles([50, 90, 99])
+        count = sum(self.counts)
+        return {
+            'count': count,
+            'mean_ms': self.total / count * 1000 if count else 0.0,
+            'p50_ms': p50 * 1000,
+            'p90_ms': p90 * 1000,
+            'p99_ms': p99 * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+class Metrics:
+    """Named counters and histograms shared by the link handlers.
+
+    Counters and histograms are created once and then updated directly
+    by the hot paths. Counts an object already keeps (e.g. the FBUS
+    decoder's) are registered as sources instead and only read when a
+    snapshot is taken, so they cost nothing per event.
+    """
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self.started = time.time()
+        self._counters: Dict[str, Counter] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._sources: Dict[str, List[Callable[[], int]]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str) -> Counter:
+        """Get or create a counter."""
+        counter = self._counters.get(name)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(name, Counter())
+        return counter
+
+    def histogram(self, name: str) -> Histogram:
+        """Get or create a latency histogram."""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        return histogram
+
+    def source(self, name: str, read: Callable[[], int]) -> None:
+        """Register a count kept by another object.
+
+        Values of all sources registered under one name are summed, so
+        totals carry over when a handler is replaced after a reconnect.
+        The callable should not keep the whole handler alive.
+        """
+        with self._lock:
+            self._sources.setdefault(name, []).append(read)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Get all current values.
+
+        Returns:
+            Dictionary with 'counters' and 'histograms' sections
+        """
+        with self._lock:
+            counters = {name: c.value for name, c in self._counters.items()}
+            histograms = dict(self._histograms)
+            sources = {name: list(reads) for name, reads in self._sources.items()}
+
+        for name, reads in sources.items():
+            counters[name] = counters.get(name, 0) + sum(read() for read in reads)
+
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.started,
+            'counters': dict(sorted(counters.items())),
+            'histograms': {
+                name: h.summary() for name, h in sorted(histograms.items()) if any(h.counts)
+            },
+        }
+
+    def format_text(self, snapshot: Optional[Dict[str, object]] = None) -> str:
+        """Render a snapshot as an aligned plain-text report."""
+        snapshot = snapshot or self.snapshot()
+        lines = [
+            f"Stats at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['time']))}"
+            f" (up {snapshot['uptime']:.0f}s)"
+        ]
+        for name, value in snapshot['counters'].items():
+            lines.append(f"  {name:<32}{value:>12}")
+        if snapshot['histograms']:
+            lines.append(
+                f"  {'latency (ms)':<32}{'count':>8}{'mean':>9}{'p50':>9}"
+                f"{'p90':>9}{'p99':>9}{'max':>9}"
+            )
+            for name, s in snapshot['histograms'].items():
+                lines.append(
+                    f"  {name:<32}{s['count']:>8}{s['mean_ms']:>9.2f}{s['p50_ms']:>9.2f}"
+                    f"{s['p90_ms']:>9.2f}{s['p99_ms']:>9.2f}{s['max_ms']:>9.2f}"
+                )
+        return '\n'.join(lines) + '\n'
+
+class StatsExporter:
+    """Background thread writing metrics snapshots to a file.
+
+    The file is replaced atomically on every dump, so it always holds
+    one complete report. JSON is used when the file name ends in .json,
+    plain text otherwise.
+    """
+
+    def __init__(self, metrics: Metrics, path: Union[str, Path],
+                 interval: float = 10.0, fmt: Optional[str] = None):
+        """Initialize exporter.
+
+        Args:
+            metrics: Registry to export
+            path: File to write
+            interval: Seconds between dumps
+            fmt: 'json' or 'text' (default: from the file extension)
+        """
+        self.metrics = metrics
+        self.path = Path(path)
+        self.interval = interval
+        self.fmt = fmt or ('json' if self.path.suffix == '.json' else 'text')
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """Start dumping periodically."""
+        self._thread = threading.Thread(target=self._run, name='stats-exporter', daemon=True)
+        self._thread.start()
+        logger.info(f"Writing stats to {self.path} every {self.interval:g}s")
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.dump()
+
+    def dump(self) -> None:
+        """Write one snapshot now."""
+        snapshot = self.metrics.snapshot()
+        if self.fmt == 'json':
+            text = json.dumps(snapshot, indent=1)
+        else:
+            text = self.metrics.format_text(snapshot)
+        try:
+            if self.path.parent:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+            with open(tmp, 'w') as f:
+                f.write(text)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to write stats to {self.path}: {e}")
+
+    def stop(self) -> None:
+        """Stop the thread and write a final snapshot."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        self.dump()
@@ -0,0 +1,246 @@
+"""
+Action Profiler for Nokia 3310 CAN Bus Interface
+Profiles each user interface action separately with cProfile
+
+Developed by Khanfar Systems © 2025
+"""
+
+import time
+import pstats
+import cProfile
+import logging
+import functools
+import threading
+from pathlib import Path
+from contextlib import nullcontext
+from collections import defaultdict
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('pstats', 'collapsed')
+
+class ActionTiming:
+    """Wall-clock statistics of one action, profiled or not."""
+    __slots__ = ('count', 'profiled', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.profiled = 0
+        self.total = 0.0
+        self.max = 0.0
+
+class ActionProfiler:
+    """Aggregates a cProfile profile per named action.
+
+    Profiling is switched on only while an action runs, so idle time
+    (keypress polling, waiting for the next sample) costs nothing.
+    cProfile only sees the thread that enabled it: time spent waiting
+    for the link scheduler's writer thread shows up as a wait on its
+    future, which is how serial latency is told apart from python-obd
+    decoding and our own formatting.
+
+    Nested actions are timed but not profiled separately; they are part
+    of the outer action's profile. When the same action is already
+    being profiled on another thread, or the interpreter allows only
+    one active profiler, the action is only timed.
+    """
+
+    def __init__(self, enabled: bool = True, every: int = 1):
+        """Initialize profiler.
+
+        Args:
+            enabled: Profile actions; when False, `action` does nothing
+            every: Profile one in this many runs of each action (all
+                runs are still timed)
+        """
+        self.enabled = enabled
+        self.every = max(1, every)
+        self.timings: Dict[str, ActionTiming] = defaultdict(ActionTiming)
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._busy = set()  # Actions currently being profiled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def action(self, name: str):
+        """Context manager profiling one run of an action.
+
+        Args:
+            name: Action name results are aggregated under (e.g. 'dtc.read')
+        """
+        if not self.enabled:
+            return nullcontext()
+        return _ActionRun(self, name)
+
+    def _begin(self, name: str) -> Optional[cProfile.Profile]:
+        """Count a run and pick the profile to enable, if any."""
+        with self._lock:
+            timing = self.timings[name]
+            timing.count += 1
+            if (getattr(self._local, 'active', False) or name in self._busy
+                    or (timing.count - 1) % self.every):
+                return None
+            profile = self._profiles.get(name)
+            if profile is None:
+                profile = self._profiles[name] = cProfile.Profile()
+            self._busy.add(name)
+        return profile
+
+    def _end(self, name: str, elapsed: float, claimed: bool, profiled: bool) -> None:
+        """Add a finished run to the action's timing.
+
+        Args:
+            name: Action name
+            elapsed: Wall seconds the run took
+            claimed: `_begin` handed this run the action's profile
+            profiled: The profile was actually enabled
+        """
+        with self._lock:
+            timing = self.timings[name]
+            timing.total += elapsed
+            timing.max = max(timing.max, elapsed)
+            if profiled:
+                timing.profiled += 1
+            if claimed:
+                self._busy.discard(name)
+
+    def summary(self) -> str:
+        """Per-action run counts and wall times as a text table."""
+        lines = [f"{'action':<24}{'runs':>7}{'profiled':>10}{'total ms':>11}"
+                 f"{'mean ms':>10}{'max ms':>10}"]
+        with self._lock:
+            timings = sorted(self.timings.items(), key=lambda item: -item[1].total)
+            for name, t in timings:
+                lines.append(
+                    f"{name:<24}{t.count:>7}{t.profiled:>10}{t.total * 1000:>11.1f}"
+                    f"{t.total / t.count * 1000:>10.2f}{t.max * 1000:>10.2f}"
+                )
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory: Union[str, Path], fmt: str = 'pstats') -> List[Path]:
+        """Write one profile file per action plus a summary.
+
+        Args:
+            directory: Output directory, created if needed
+            fmt: 'pstats' (for pstats/snakeviz) or 'collapsed' (folded
+                stacks in microseconds, for flamegraph.pl/speedscope)
+
+        Returns:
+            Paths written
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown profile format: {fmt}")
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        written = []
+
+        with self._lock:
+            profiles = dict(self._profiles)
+        for name, profile in sorted(profiles.items()):
+            try:
+                stats = pstats.Stats(profile)
+            except TypeError:
+                continue  # Never ran to completion
+            if fmt == 'pstats':
+                path = directory / f"{name}.pstats"
+                stats.dump_stats(path)
+            else:
+                path = directory / f"{name}.folded"
+                stacks = collapse(stats.stats)
+                path.write_text(''.join(
+                    f"{stack} {round(seconds * 1e6)}\n"
+                    for stack, seconds in sorted(stacks.items())
+                    if seconds >= 0.5e-6
+                ))
+            written.append(path)
+
+        path = directory / 'actions.txt'
+        path.write_text(self.summary())
+        written.append(path)
+        return written
+
+class _ActionRun:
+    """One run of an action; enables its profile only around the body."""
+    __slots__ = ('profiler', 'name', 'claimed', 'profile', 'started')
+
+    def __init__(self, profiler: ActionProfiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.claimed = False
+        self.profile = None
+        self.started = 0.0
+
+    def __enter__(self) -> None:
+        profile = self.profiler._begin(self.name)
+        self.claimed = profile is not None
+        if profile is not None:
+            try:
+                profile.enable()
+                self.profiler._local.active = True
+                self.profile = profile
+            except ValueError:
+                pass  # Another profiler is active (Python 3.12+ allows one)
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        elapsed = time.perf_counter() - self.started
+        if self.profile is not None:
+            self.profile.disable()
+            self.profiler._local.active = False
+        self.profiler._end(self.name, elapsed, self.claimed, self.profile is not None)
+
+def profiled(name: str):
+    """Decorator running a method as a named action of `self.profiler`."""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.action(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+def _label(func) -> str:
+    """Folded-stack frame name for a pstats function key."""
+    filename, line, function = func
+    if filename == '~':
+        return function  # Built-in
+    return f"{function} ({Path(filename).name}:{line})"
+
+def collapse(stats: dict, max_depth: int = 64) -> Dict[str, float]:
+    """Approximate folded stacks from a cProfile caller graph.
+
+    cProfile keeps caller/callee edges rather than whole stacks, so the
+    time of a function is split between its callers in proportion to
+    the time each edge accounts for, the way gprof-style tools do.
+
+    Args:
+        stats: `pstats.Stats.stats` mapping
+        max_depth: Stacks are cut off below this depth
+
+    Returns:
+        Seconds of self time per ';'-joined stack
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge[3]
+
+    folded: Dict[str, float] = defaultdict(float)
+
+    def walk(func, path: tuple, seen: frozenset, scale: float) -> None:
+        _, _, self_time, total, _ = stats[func]
+        path = path + (_label(func),)
+        stack = ';'.join(path)
+        folded[stack] += self_time * scale
+        if len(path) >= max_depth:
+            return
+        for callee, edge_time in callees.get(func, {}).items():
+            callee_total = stats[callee][3]
+            if callee in seen or edge_time * scale < 1e-6 or not callee_total:
+                continue
+            walk(callee, path, seen | {callee}, scale * edge_time / callee_total)
+
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            walk(func, (), frozenset((func,)), 1.0)
+    return folded
@@ -6,194 +6,731 @@ Developed by Khanfar Systems © 2025
 """
 
 import struct
-from typing import List, Dict, Optional
+import logging
+import binascii
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Store header: magic, version, slot size, slot count, reserved
+_STORE_HEADER = struct.Struct('>4sBBH6x')
 
 class CommandStorage:
-    """Handles storage and retrieval of custom commands in phone memory."""
-    
+    """Handles storage and retrieval of custom commands in phone memory.
+
+    Store layout (version 2) starting at MEM_START:
+
+        [Header (16)]  magic 'N3CS', version, slot size, slot count,
+                       reserved, CRC-16 of the preceding 14 bytes
+        [Index (N)]    one byte per slot: record length, 0 = empty,
+                       0xFF = taken by the record in the slot before
+        [Slots (N x SLOT_SIZE)]
+                       CRC-16 of the record (2), then the record:
+                       [Name length (1)] [Name (...)] [Type (1)] [Command (...)]
+                       Records longer than one slot run on into the
+                       following slots.
+
+    Every record has a fixed address, so one command can be read or
+    replaced without touching the others, and a corrupted record only
+    loses that record. Records stay in the order they were added: new
+    ones go after the last one, and the slots are compacted when the end
+    of the store is full. The old layout (count byte followed by
+    length-prefixed records) is migrated on first load. A store that
+    cannot be read safely (unreadable, corrupt header, unknown version,
+    or an old layout that cannot be migrated) is kept as it is and
+    read-only.
+    """
+
     # FBUS memory commands
     CMD_READ_MEM = 0x23
     CMD_WRITE_MEM = 0x24
-    
+
     # Memory locations (using phone's free memory area)
     MEM_START = 0x1000  # Starting address for command storage
-    MAX_COMMANDS = 10   # Maximum number of stored commands
-    
+    MAX_COMMANDS = 200  # Number of slots in a new store
+    READ_CHUNK = 255    # Largest read the memory command's length byte allows
+    WRITE_OVERHEAD = 32 # Bytes' worth of link time one extra write round trip costs
+
+    # Store format
+    MAGIC = b'N3CS'
+    VERSION = 2
+    HEADER_SIZE = 16
+    SLOT_SIZE = 32      # CRC (2) + record (up to 30) per slot
+    MAX_RECORD = 254    # Longest record the index byte can describe
+    CONTINUED = 0xFF    # Index byte of a slot taken by the record before it
+
     def __init__(self, fbus_protocol):
         """Initialize command storage.
-        
+
         Args:
             fbus_protocol: FBUS protocol instance for memory access
         """
         self.fbus = fbus_protocol
+        self.autocommit = True  # Flush every edit; see batch() and commit()
+        self.read_only = False  # Store could not be read safely, edits are refused
+        self.slot_count = self.MAX_COMMANDS
+        self.slot_size = self.SLOT_SIZE
+        self._slots: List[Optional[Dict]] = [None] * self.slot_count
+        self._image = bytearray(self._region_size())  # Region as stored on the phone
+        self._known = bytearray(len(self._image))     # 1 where _image is confirmed
         self.commands = self._load_commands()
-    
+
+    def _region_size(self) -> int:
+        return self.HEADER_SIZE + self.slot_count * (1 + self.slot_size)
+
+    def _slot_offset(self, slot: int) -> int:
+        """Offset of a slot from MEM_START."""
+        return self.HEADER_SIZE + self.slot_count + slot * self.slot_size
+
     def _load_commands(self) -> List[Dict]:
         """Load saved commands from phone memory.
-        
+
+        Header and index come in the first READ_CHUNK transfer; used
+        slots are then read in as few further transfers as possible.
+
         Returns:
             List of command dictionaries
         """
         try:
-            # Read command count
-            count_data = self._read_memory(self.MEM_START, 1)
-            if not count_data:
+            image = self._read_memory(self.MEM_START, self.READ_CHUNK)
+            if not image:
+                self._set_read_only("it could not be read")
                 return []
-            
-            count = count_data[0]
-            commands = []
-            
-            # Read each command
-            addr = self.MEM_START + 1
-            for _ in range(count):
-                # Read command length
-                len_data = self._read_memory(addr, 1)
-                if not len_data:
-                    break
-                    
-                length = len_data[0]
-                addr += 1
-                
-                # Read command data
-                cmd_data = self._read_memory(addr, length)
-                if not cmd_data:
-                    break
-                
-                # Parse command data
-                try:
-                    name_len = cmd_data[0]
-                    name = cmd_data[1:name_len+1].decode('ascii')
-                    cmd_type = cmd_data[name_len+1]
-                    cmd_bytes = bytes(cmd_data[name_len+2:])
-                    
-                    commands.append({
-                        'name': name,
-                        'type': cmd_type,
-                        'command': cmd_bytes
-                    })
-                except:
-                    continue
-                    
-                addr += length
-            
+            image = bytearray(image)
+
+            if image[:len(self.MAGIC)] == self.MAGIC:
+                return self._load_store(image)
+
+            commands, complete = self._load_legacy(image)
+            if commands:
+                self._migrate(commands, complete)
             return commands
-            
+
         except Exception as e:
             print(f"Error loading commands: {e}")
+            self._set_read_only("loading it failed")
+            return []
+
+    def _load_store(self, image: bytearray) -> List[Dict]:
+        """Parse a version 2 store whose first chunk has been read.
+
+        Args:
+            image: Bytes read from MEM_START
+
+        Returns:
+            List of command dictionaries
+        """
+        header = bytes(image[:self.HEADER_SIZE])
+        crc = struct.unpack('>H', header[-2:])[0]
+        if len(header) < self.HEADER_SIZE or binascii.crc_hqx(header[:-2], 0xFFFF) != crc:
+            self._set_read_only("its header is corrupt")
+            return []
+
+        _, version, slot_size, slot_count = _STORE_HEADER.unpack(header[:-2])
+        if version != self.VERSION:
+            self._set_read_only(f"it has unsupported version {version}")
+            return []
+
+        # Keep the geometry the store was created with
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self._slots = [None] * slot_count
+        self._image = bytearray(self._region_size())
+        self._known = bytearray(len(self._image))
+        self._store(0, image)
+
+        index_end = self.HEADER_SIZE + slot_count
+        if not self._read_region(len(image), index_end):
+            self._set_read_only("its index could not be read")
             return []
-    
+        index = self._image[self.HEADER_SIZE:index_end]
+
+        # First slot of each record; a start inside the previous record
+        # is corrupt and skipped
+        used = []
+        next_free = 0
+        for slot in range(slot_count):
+            length = index[slot]
+            if not length or length == self.CONTINUED:
+                continue
+            if slot < next_free:
+                logger.warning(f"Command slot {slot} overlaps the record before it, skipping it")
+                continue
+            used.append(slot)
+            next_free = slot + self._span(length)
+
+        # Read used slots not already in the first chunk, one transfer
+        # per READ_CHUNK-sized span
+        span_start = None
+        span_end = 0
+        complete = True
+        for slot in used:
+            start = self._slot_offset(slot)
+            end = min(start + 2 + index[slot], len(self._image))
+            if all(self._known[start:end]):
+                continue
+            if span_start is not None and end - span_start > self.READ_CHUNK:
+                complete &= self._read_region(span_start, span_end)
+                span_start = None
+            if span_start is None:
+                span_start = start
+            span_end = end
+        if span_start is not None:
+            complete &= self._read_region(span_start, span_end)
+        if not complete:
+            # Writing now would drop the commands that were not read
+            self._set_read_only("some commands could not be read")
+
+        for slot in used:
+            self._slots[slot] = self._parse_slot(slot, index[slot])
+
+        return [cmd for cmd in self._slots if cmd is not None]
+
+    def _parse_slot(self, slot: int, length: int) -> Optional[Dict]:
+        """Check and parse one slot already present in the image.
+
+        Args:
+            slot: Slot number
+            length: Record length from the index
+
+        Returns:
+            Command dictionary, or None if unread or corrupt
+        """
+        start = self._slot_offset(slot)
+        end = start + 2 + length
+        if end > len(self._image) or not all(self._known[start:end]):
+            logger.warning(f"Command slot {slot} could not be read")
+            return None
+
+        view = memoryview(self._image)
+        crc = (view[start] << 8) | view[start + 1]
+        record = view[start + 2:end]
+        if binascii.crc_hqx(record, 0xFFFF) != crc:
+            logger.warning(f"Command slot {slot} failed CRC check, skipping it")
+            return None
+        return self._parse_command(record)
+
+    def _load_legacy(self, image: bytearray) -> Tuple[List[Dict], bool]:
+        """Parse the old count-prefixed layout.
+
+        Args:
+            image: Bytes read from MEM_START, extended as needed
+
+        Returns:
+            Tuple of (command dictionaries, True if every record was
+            read and parsed)
+        """
+        count = image[0]
+        commands = []
+        complete = True
+
+        # Parse each length-prefixed command
+        pos = 1
+        for _ in range(count):
+            if not self._extend_image(image, pos + 1):
+                complete = False
+                break
+            length = image[pos]
+            end = pos + 1 + length
+            if not self._extend_image(image, end):
+                complete = False
+                break
+
+            command = self._parse_command(memoryview(image)[pos + 1:end])
+            if command is not None:
+                commands.append(command)
+            else:
+                complete = False
+            pos = end
+
+        return commands, complete
+
+    def _migrate(self, commands: List[Dict], complete: bool = True) -> None:
+        """Rewrite commands loaded from the old layout as a version 2 store.
+
+        Every record is checked before anything is written. If the old
+        store could not be read completely, has a record too long to
+        store, or needs more slots than there are, it is left untouched
+        and the storage becomes read-only.
+
+        Args:
+            commands: Commands parsed from the old layout
+            complete: Every record of the old layout was parsed
+        """
+        problem = None
+        if not complete:
+            problem = "it could not be read completely"
+        else:
+            for cmd in commands:
+                problem = self._record_problem(cmd['name'], cmd['command'])
+                if problem:
+                    break
+            else:
+                if not self._layout(commands):
+                    problem = f"its {len(commands)} commands need more than {self.slot_count} slots"
+        if problem:
+            self._set_read_only(f"the old layout cannot be migrated to format "
+                                f"v{self.VERSION}, {problem}")
+            return
+
+        logger.info(f"Migrating {len(commands)} stored commands to format v{self.VERSION}")
+
+        # Nothing of the new layout is on the phone yet
+        self._known = bytearray(len(self._image))
+        if not self.commit():
+            logger.error("Failed to migrate stored commands")
+
+    def _extend_image(self, image: bytearray, size: int) -> bool:
+        """Read further chunks of the command region until it holds size bytes.
+
+        Args:
+            image: Bytes read so far from MEM_START, extended in place
+            size: Number of bytes needed
+
+        Returns:
+            True if the image is now large enough, False if a read failed
+        """
+        while len(image) < size:
+            chunk = self._read_memory(self.MEM_START + len(image), self.READ_CHUNK)
+            if not chunk:
+                return False
+            image += chunk
+        return True
+
+    def _read_region(self, start: int, end: int) -> bool:
+        """Read part of the store into the image.
+
+        Args:
+            start: Offset from MEM_START
+            end: End offset (exclusive)
+
+        Returns:
+            True if every byte was read, False otherwise
+        """
+        while start < end:
+            chunk = self._read_memory(self.MEM_START + start, min(self.READ_CHUNK, end - start))
+            if not chunk:
+                return False
+            self._store(start, chunk)
+            start += len(chunk)
+        return True
+
+    def _store(self, start: int, data: bytes) -> None:
+        """Record bytes known to be on the phone."""
+        end = min(start + len(data), len(self._image))
+        self._image[start:end] = data[:end - start]
+        self._known[start:end] = b'\x01' * (end - start)
+
+    def _parse_command(self, data: memoryview) -> Optional[Dict]:
+        """Parse one stored command record.
+
+        Args:
+            data: Record bytes (without its length prefix)
+
+        Returns:
+            Command dictionary, or None if the record is malformed
+        """
+        try:
+            name_len = data[0]
+            name = bytes(data[1:name_len+1]).decode('ascii')
+            cmd_type = data[name_len+1]
+            cmd_bytes = bytes(data[name_len+2:])
+
+            return {
+                'name': name,
+                'type': cmd_type,
+                'command': cmd_bytes
+            }
+        except Exception:
+            return None
+
+    def _encode_command(self, cmd: Dict) -> bytes:
+        """Encode one command record."""
+        name_bytes = cmd['name'].encode('ascii')
+        return bytes([
+            len(name_bytes),  # Name length
+            *name_bytes,      # Name
+            cmd['type'],      # Command type
+            *cmd['command']   # Command bytes
+        ])
+
+    def _serialize(self) -> Tuple[bytearray, List[Tuple[int, int]]]:
+        """Serialize the store in its phone memory layout.
+
+        Empty slots keep whatever the phone has in them.
+
+        Returns:
+            Tuple of (store image, ranges that carry data)
+        """
+        data = bytearray(self._image)
+
+        header = _STORE_HEADER.pack(self.MAGIC, self.VERSION,
+                                    self.slot_size, self.slot_count)
+        data[:self.HEADER_SIZE] = header + struct.pack('>H', binascii.crc_hqx(header, 0xFFFF))
+
+        index_end = self.HEADER_SIZE + self.slot_count
+        data[self.HEADER_SIZE:index_end] = bytes(self.slot_count)
+        ranges = [(0, index_end)]
+
+        for slot, cmd in enumerate(self._slots):
+            if cmd is None:
+                continue
+            record = self._encode_command(cmd)
+            start = self._slot_offset(slot)
+            end = start + 2 + len(record)
+            index = self.HEADER_SIZE + slot
+            data[index] = len(record)
+            data[index + 1:index + self._span(len(record))] = \
+                bytes((self.CONTINUED,)) * (self._span(len(record)) - 1)
+            data[start:start + 2] = struct.pack('>H', binascii.crc_hqx(record, 0xFFFF))
+            data[start + 2:end] = record
+            ranges.append((start, end))
+
+        return data, ranges
+
     def _save_commands(self) -> bool:
         """Save commands to phone memory.
-        
+
+        Nothing is written while autocommit is off; changes accumulate
+        until commit() is called.
+
         Returns:
             True if successful, False otherwise
         """
+        self.commands = [cmd for cmd in self._slots if cmd is not None]
+        if not self.autocommit:
+            return True
+        return self.commit()
+
+    def _dirty_ranges(self, data: bytes, ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Find byte ranges that differ from what the phone holds.
+
+        Ranges closer together than WRITE_OVERHEAD are merged, since
+        resending a few unchanged bytes is cheaper than another memory
+        write. If many ranges remain, one spanning write is used instead.
+
+        Args:
+            data: Newly serialized store image
+            ranges: Parts of the image that carry data
+
+        Returns:
+            List of (start, end) offsets from MEM_START
+        """
+        old = self._image
+        known = self._known
+        dirty = []
+        start = None
+        last = None
+        for begin, end in ranges:
+            for i in range(begin, end):
+                if known[i] and old[i] == data[i]:
+                    continue
+                if start is None:
+                    start = i
+                elif i - last > self.WRITE_OVERHEAD:
+                    dirty.append((start, last + 1))
+                    start = i
+                last = i
+        if start is not None:
+            dirty.append((start, last + 1))
+
+        separate = sum(self.WRITE_OVERHEAD + end - begin for begin, end in dirty)
+        if dirty and separate > self.WRITE_OVERHEAD + dirty[-1][1] - dirty[0][0]:
+            return [(dirty[0][0], dirty[-1][1])]
+        return dirty
+
+    def commit(self) -> bool:
+        """Write pending changes to phone memory.
+
+        Only the changed bytes are written, e.g. one slot and its index
+        byte when a command is added or replaced.
+
+        Returns:
+            True if successful, False otherwise
+        """
+        if not self._writable():
+            return False
         try:
-            # Prepare data
-            data = bytearray([len(self.commands)])  # Command count
-            
-            for cmd in self.commands:
-                name_bytes = cmd['name'].encode('ascii')
-                cmd_data = bytes([
-                    len(name_bytes),  # Name length
-                    *name_bytes,      # Name
-                    cmd['type'],      # Command type
-                    *cmd['command']   # Command bytes
-                ])
-                data.extend([len(cmd_data)])  # Command length
-                data.extend(cmd_data)
-            
-            # Write to memory
-            return self._write_memory(self.MEM_START, data)
-            
+            data, ranges = self._serialize()
+
+            # Slots before index and header, so a new index never points
+            # at records that have not been written
+            for start, end in reversed(self._dirty_ranges(data, ranges)):
+                if not self._write_memory(self.MEM_START + start, data[start:end]):
+                    return False
+                self._store(start, data[start:end])
+
+            return True
+
         except Exception as e:
             print(f"Error saving commands: {e}")
             return False
-    
+
+    @contextmanager
+    def batch(self):
+        """Group several edits into a single commit.
+
+        If the block raises or the commit fails, the edits are undone in
+        memory, so the command list keeps matching the phone.
+
+        Raises:
+            ConnectionError: If the batch could not be written
+
+        Example:
+            with storage.batch():
+                storage.add_command('RPM', 0x01, b'\\x01\\x0c')
+                storage.remove_command(0)
+        """
+        previous = self.autocommit
+        slots = list(self._slots)
+        self.autocommit = False
+        try:
+            yield self
+        except BaseException:
+            self._restore(slots)
+            raise
+        finally:
+            self.autocommit = previous
+        # A read-only store refused every edit, so there is nothing to write
+        if previous and not self.read_only and not self.commit():
+            self._restore(slots)
+            raise ConnectionError("Failed to write command batch to phone memory")
+
+    def _restore(self, slots: List[Optional[Dict]]) -> None:
+        """Undo uncommitted edits by going back to an earlier slot list."""
+        self._slots = slots
+        self.commands = [cmd for cmd in slots if cmd is not None]
+
     def _read_memory(self, address: int, length: int) -> Optional[bytes]:
         """Read data from phone memory.
-        
+
         Args:
             address: Memory address to read from
             length: Number of bytes to read
-            
+
         Returns:
             Read data if successful, None otherwise
         """
         cmd = struct.pack('>HB', address, length)
         response = self.fbus.send_command(self.CMD_READ_MEM, cmd)
-        
+
         if response and len(response) >= length:
             return response[:length]
         return None
-    
+
     def _write_memory(self, address: int, data: bytes) -> bool:
         """Write data to phone memory.
-        
+
         Args:
             address: Memory address to write to
             data: Data to write
-            
+
         Returns:
             True if successful, False otherwise
         """
         cmd = struct.pack('>H', address) + data
         response = self.fbus.send_command(self.CMD_WRITE_MEM, cmd)
         return response is not None
-    
+
+    def _slot_for_index(self, index: int) -> Optional[int]:
+        """Map a position in the command list to its slot number."""
+        if index < 0:
+            return None
+        for slot, cmd in enumerate(self._slots):
+            if cmd is not None:
+                if index == 0:
+                    return slot
+                index -= 1
+        return None
+
+    def _span(self, length: int) -> int:
+        """Number of slots taken by a record of the given length."""
+        return -(-(2 + length) // self.slot_size)
+
+    def _record_problem(self, name: str, command: bytes) -> Optional[str]:
+        """Explain why a record cannot be stored.
+
+        Returns:
+            Reason, or None if the record can be stored
+        """
+        if not name.isascii():
+            return f"name '{name}' is not ASCII"
+        length = len(name) + 2 + len(command)
+        if length > self.MAX_RECORD:
+            return (f"command '{name}' takes {length} bytes, "
+                    f"at most {self.MAX_RECORD} can be stored")
+        return None
+
+    def _layout(self, commands: List[Dict]) -> bool:
+        """Place commands in consecutive slots from the first one, in order.
+
+        Returns:
+            True if they fit, False (slots unchanged) if not
+        """
+        slots: List[Optional[Dict]] = [None] * self.slot_count
+        slot = 0
+        for cmd in commands:
+            span = self._span(len(self._encode_command(cmd)))
+            if slot + span > self.slot_count:
+                return False
+            slots[slot] = cmd
+            slot += span
+        self._slots = slots
+        return True
+
+    def _end_slot(self) -> int:
+        """First slot after the last record."""
+        for slot in range(self.slot_count - 1, -1, -1):
+            cmd = self._slots[slot]
+            if cmd is not None:
+                return slot + self._span(len(self._encode_command(cmd)))
+        return 0
+
+    def _room(self, slot: int) -> int:
+        """Slots from `slot` up to the next record or the end of the store."""
+        end = slot + 1
+        while end < self.slot_count and self._slots[end] is None:
+            end += 1
+        return end - slot
+
+    def _set_read_only(self, reason: str) -> None:
+        """Refuse all edits, so a store that was not read safely is not overwritten."""
+        logger.error(f"Command store is read-only: {reason}")
+        self.read_only = True
+
+    def _writable(self) -> bool:
+        """Check that edits may be written, logging why not."""
+        if self.read_only:
+            logger.error("Command store could not be read safely, not changing it")
+            return False
+        return True
+
     def add_command(self, name: str, cmd_type: int, command: bytes) -> bool:
         """Add new command to storage.
-        
+
         Args:
             name: Command name (max 12 chars)
             cmd_type: Command type
             command: Command bytes
-            
+
         Returns:
             True if successful, False otherwise
         """
-        if len(self.commands) >= self.MAX_COMMANDS:
-            return False
-            
         # Truncate name if too long
         name = name[:12]
-        
-        self.commands.append({
+
+        if not self._writable():
+            return False
+        problem = self._record_problem(name, command)
+        if problem:
+            logger.error(f"Not storing command: {problem}")
+            return False
+
+        cmd = {
+            'name': name,
+            'type': cmd_type,
+            'command': command
+        }
+
+        # Append, so existing commands keep their numbers
+        slot = self._end_slot()
+        if slot + self._span(len(self._encode_command(cmd))) <= self.slot_count:
+            self._slots[slot] = cmd
+        elif not self._layout([c for c in self._slots if c is not None] + [cmd]):
+            logger.error(f"Not storing command '{name}': command store is full")
+            return False
+
+        return self._save_commands()
+
+    def replace_command(self, index: int, name: str, cmd_type: int, command: bytes) -> bool:
+        """Replace command at specified index in place.
+
+        Args:
+            index: Command index to replace
+            name: Command name (max 12 chars)
+            cmd_type: Command type
+            command: Command bytes
+
+        Returns:
+            True if successful, False otherwise
+        """
+        name = name[:12]
+        slot = self._slot_for_index(index)
+        if not self._writable() or slot is None:
+            return False
+        problem = self._record_problem(name, command)
+        if problem:
+            logger.error(f"Not replacing command: {problem}")
+            return False
+
+        cmd = {
             'name': name,
             'type': cmd_type,
             'command': command
-        })
-        
+        }
+        if self._span(len(self._encode_command(cmd))) <= self._room(slot):
+            self._slots[slot] = cmd
+        else:
+            # Longer than the gap before the next command: compact
+            commands = [c for c in self._slots if c is not None]
+            commands[index] = cmd
+            if not self._layout(commands):
+                logger.error(f"Not replacing command '{name}': command store is full")
+                return False
         return self._save_commands()
-    
+
     def remove_command(self, index: int) -> bool:
         """Remove command at specified index.
-        
+
         Args:
             index: Command index to remove
-            
+
         Returns:
             True if successful, False otherwise
         """
-        if 0 <= index < len(self.commands):
-            self.commands.pop(index)
+        slot = self._slot_for_index(index)
+        if slot is not None and self._writable():
+            self._slots[slot] = None
             return self._save_commands()
         return False
-    
+
+    def read_command(self, index: int) -> Optional[Dict]:
+        """Re-read one command from phone memory.
+
+        Only that command's slot is transferred.
+
+        Args:
+            index: Command index to read
+
+        Returns:
+            Command dictionary if the slot is intact, None otherwise
+        """
+        slot = self._slot_for_index(index)
+        if slot is None:
+            return None
+
+        length = len(self._encode_command(self._slots[slot]))
+        start = self._slot_offset(slot)
+        self._known[start:start + 2 + length] = bytes(2 + length)
+        if not self._read_region(start, start + 2 + length):
+            return None
+        return self._parse_slot(slot, length)
+
     def get_commands(self) -> List[Dict]:
         """Get list of stored commands.
-        
+
         Returns:
             List of command dictionaries
         """
         return self.commands.copy()
-    
+
     def execute_command(self, index: int) -> Optional[bytes]:
         """Execute stored command.
-        
+
         Args:
             index: Index of command to execute
-            
+
         Returns:
             Command response if successful, None otherwise
         """
@@ -0,0 +1,163 @@
+"""
+Display Model for Nokia 3310 CAN Bus Interface
+Tracks the screen shown on the phone and sends only what changed
+
+Developed by Khanfar Systems 2025
+"""
+
+import logging
+import threading
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+class DisplayModel:
+    """Last screen sent to the phone and the screen it should show next.
+
+    `flush` runs on the link writer thread, so the difference is always
+    worked out against what the phone really has, even when several
+    redraws were coalesced while queued.
+
+    Partial updates use MSG_DISPLAY_UPDATE with one or more runs of
+    [row (1)] [column (1)] [length (1)] [characters (...)]. Phones that
+    do not know the message never answer it; when the first partial
+    update goes unanswered but the full redraw sent after it succeeds,
+    partial updates are switched off for good.
+    """
+
+    RUN_HEADER = 3  # Row, column, length
+    MERGE_GAP = 3   # Unchanged characters cheaper to resend than a new run
+
+    def __init__(self, width: int, height: int, msg_full: int, msg_update: int):
+        """Initialize display model.
+
+        Args:
+            width: Display width in characters
+            height: Display height in lines
+            msg_full: FBUS message type for a full redraw
+            msg_update: FBUS message type for a partial update
+        """
+        self.width = width
+        self.height = height
+        self.msg_full = msg_full
+        self.msg_update = msg_update
+        self._lock = threading.Lock()
+        self._target: Optional[bytes] = None  # Screen to show next
+        self._sent: Optional[bytes] = None    # Screen known to be on the phone
+        self.partial_supported: Optional[bool] = None  # None until the phone answered one
+        self.full_redraws = 0
+        self.partial_updates = 0
+        self.skipped = 0
+
+    def set(self, screen: bytes) -> bool:
+        """Set the screen to show next.
+
+        Args:
+            screen: Formatted screen, `height` lines of `width` characters
+                joined by newlines
+
+        Returns:
+            True if it differs from the screen set before
+        """
+        with self._lock:
+            changed = screen != self._target
+            self._target = screen
+        return changed
+
+    def invalidate(self) -> None:
+        """Forget what the phone shows so the next flush is a full redraw."""
+        with self._lock:
+            self._sent = None
+
+    def flush(self, fbus) -> Optional[bytes]:
+        """Bring the phone display up to date.
+
+        Args:
+            fbus: Object with a send_command(msg_type, payload) method
+
+        Returns:
+            Response payload (b'' when nothing had to be sent), None on failure
+        """
+        with self._lock:
+            target, sent = self._target, self._sent
+
+        if target is None or target == sent:
+            self.skipped += 1
+            return b''
+
+        update = None
+        if sent is not None and self.partial_supported is not False:
+            update = self._encode_update(sent, target)
+        if update is not None:
+            response = fbus.send_command(self.msg_update, update)
+            self.partial_updates += 1
+            if response is not None:
+                self.partial_supported = True
+            elif self.partial_supported is None:
+                # Unanswered before it ever worked: try a full redraw
+                response = fbus.send_command(self.msg_full, target)
+                self.full_redraws += 1
+                if response is not None:
+                    logger.info("Phone does not answer partial display updates, "
+                                "using full redraws")
+                    self.partial_supported = False
+        else:
+            response = fbus.send_command(self.msg_full, target)
+            self.full_redraws += 1
+
+        with self._lock:
+            # Unknown phone state after a failure, redraw fully next time
+            self._sent = target if response is not None else None
+        return response
+
+    def _encode_update(self, old: bytes, new: bytes) -> Optional[bytes]:
+        """Encode the changed character runs between two screens.
+
+        Args:
+            old: Screen currently on the phone
+            new: Screen to show
+
+        Returns:
+            Partial update payload, or None if a full redraw is no larger
+        """
+        old_rows = old.split(b'\n')
+        new_rows = new.split(b'\n')
+        if len(old_rows) != len(new_rows):
+            return None
+
+        update = bytearray()
+        for row, (old_line, new_line) in enumerate(zip(old_rows, new_rows)):
+            if old_line == new_line:
+                continue
+            if len(old_line) != len(new_line):
+                return None
+
+            for start, end in self._changed_runs(old_line, new_line):
+                update += bytes((row, start, end - start))
+                update += new_line[start:end]
+
+        if len(update) >= len(new):
+            return None
+        return bytes(update)
+
+    def _changed_runs(self, old_line: bytes, new_line: bytes) -> List[tuple]:
+        """Find (start, end) column runs that differ between two lines.
+
+        Runs separated by fewer unchanged characters than a run header
+        costs are merged.
+        """
+        runs = []
+        start = None
+        last = None
+        for col, (a, b) in enumerate(zip(old_line, new_line)):
+            if a == b:
+                continue
+            if start is None:
+                start = col
+            elif col - last > self.MERGE_GAP:
+                runs.append((start, last + 1))
+                start = col
+            last = col
+        if start is not None:
+            runs.append((start, last + 1))
+        return runs
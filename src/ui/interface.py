@@ -5,14 +5,22 @@ Handles communication between FBUS and CAN bus interfaces
 Developed by Khanfar Systems 2025
 """
 
-import time
+import queue
 import logging
 from typing import Dict, Any
 from threading import Thread, Event
 
 from src.fbus.protocol import FBUSProtocol
+from src.fbus.scheduler import (
+    LinkScheduler, PRIORITY_KEYPRESS, PRIORITY_INTERACTIVE,
+    PRIORITY_MONITOR, PRIORITY_BULK
+)
 from src.canbus.interface import CANBusInterface
+from src.canbus.sampler import SensorSampler
+from src.canbus.history import SensorHistory
 from src.storage.commands import CommandStorage
+from src.ui.display import DisplayModel
+from src.stats.profiler import ActionProfiler, profiled
 
 logger = logging.getLogger(__name__)
 
@@ -27,17 +35,63 @@ class UserInterface:
     MSG_DISPLAY = 0x20
     MSG_KEYPRESS = 0x21
     MSG_MENU = 0x22
+    MSG_DISPLAY_UPDATE = 0x25  # Partial redraw, see DisplayModel
     
-    def __init__(self, fbus: FBUSProtocol, canbus: CANBusInterface):
+    # Sensors offered in the sensor menu, with their dashboard labels
+    SENSORS = [
+        ('RPM', 'RPM'),
+        ('SPEED', 'Speed'),
+        ('COOLANT_TEMP', 'Temp'),
+        ('ENGINE_LOAD', 'Load'),
+    ]
+    
+    # Target sampling rates (Hz), fast-changing signals first
+    SENSOR_RATES = {
+        'RPM': 10.0,
+        'SPEED': 5.0,
+        'ENGINE_LOAD': 5.0,
+        'COOLANT_TEMP': 0.2,
+    }
+    DEFAULT_RATE = 2.0
+    MONITOR_REFRESH = 0.25  # Seconds between monitor screen redraws
+    TREND_SPAN = 60.0  # Seconds of history in the single-sensor sparkline
+    SPARK_CHARS = "_.-=+*#"  # Sparkline levels, lowest first
+    
+    # Keypress polling backoff when the phone does not push keys (seconds);
+    # a keypress or a screen change returns to the fast rate
+    KEYPOLL_MIN = 0.02
+    KEYPOLL_MAX = 2.0
+    _WAKE = object()  # Queued to end an idle poll wait early
+    
+    def __init__(self, fbus: FBUSProtocol, canbus: CANBusInterface,
+                 profiler: ActionProfiler = None):
         """Initialize user interface.
         
         Args:
             fbus: FBUS protocol handler
             canbus: CAN bus interface
+            profiler: Optional profiler receiving each menu action,
+                monitor redraw and sensor poll cycle
         """
         self.fbus = fbus
         self.canbus = canbus
-        self.command_storage = CommandStorage(fbus)
+        self.profiler = profiler or ActionProfiler(enabled=False)
+        # Keypress polling and the monitoring thread share the link, so
+        # all reads go through one background reader
+        self.fbus.start_reader()
+        self.keys = queue.Queue()
+        self.keys_pushed = False  # Set once the phone pushes keypresses
+        self.poll_interval = self.KEYPOLL_MIN
+        self.fbus.reader.subscribe(self.MSG_KEYPRESS, self._on_key_event)
+        # Every sender goes through one prioritized writer
+        self.link = LinkScheduler(fbus)
+        self.link.start()
+        self.command_storage = CommandStorage(self.link.channel(PRIORITY_BULK))
+        self.display = DisplayModel(
+            self.DISPLAY_WIDTH, self.DISPLAY_HEIGHT,
+            self.MSG_DISPLAY, self.MSG_DISPLAY_UPDATE
+        )
+        self.history = SensorHistory()
         self.running = False
         self.current_menu = "main"
         self.monitoring_thread = None
@@ -71,6 +125,28 @@ class UserInterface:
         
         return '\n'.join(formatted).encode('ascii')
     
+    def _show(self, text: str, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Send text to the phone display.
+        
+        Only the characters that differ from the screen already on the
+        phone are sent. Redraws share one coalesce key, so a queued
+        screen that has not been sent yet is replaced by the newer one.
+        
+        Args:
+            text: Text to display
+            priority: Link priority of this redraw
+        """
+        if self.display.set(self._format_display(text)) and not self.keys_pushed:
+            # Someone is likely looking at the phone: poll keys fast again
+            if self.poll_interval > self.KEYPOLL_MIN:
+                self.poll_interval = self.KEYPOLL_MIN
+                self.keys.put(self._WAKE)
+        self.link.submit_call(
+            self.display.flush,
+            priority,
+            coalesce_key='display'
+        ).result()
+    
     def _handle_keypress(self, key: int) -> None:
         """Handle keypress from Nokia 3310.
         
@@ -112,8 +188,9 @@ class UserInterface:
         if key == 0:  # Back
             self._show_main_menu()
         elif key in [1, 2, 3, 4]:  # Sensor selection
-            sensors = ['RPM', 'SPEED', 'TEMP', 'LOAD']
-            self._monitor_sensor(sensors[key-1])
+            self._monitor_sensor(self.SENSORS[key-1][0])
+        elif key == 5:  # All sensors
+            self._monitor_dashboard()
     
     def _handle_dtc_menu(self, key: int) -> None:
         """Handle DTC menu keypresses.
@@ -146,6 +223,7 @@ class UserInterface:
         elif 1 <= key <= len(self.command_storage.get_commands()):
             self._execute_command(key - 1)
 
+    @profiled('menu.main')
     def _show_main_menu(self) -> None:
         """Display main menu on phone."""
         menu_text = (
@@ -154,20 +232,22 @@ class UserInterface:
             "2.DTCs\n"
             "3.Info 4.Cmd"
         )
-        self.fbus.send_command(self.MSG_DISPLAY, self._format_display(menu_text))
+        self._show(menu_text)
         self.current_menu = "main"
 
+    @profiled('menu.sensors')
     def _show_sensor_menu(self) -> None:
         """Display sensor selection menu on phone."""
         menu_text = (
             "Select Sensor:\n"
             "1.RPM  2.Speed\n"
             "3.Temp 4.Load\n"
-            "0.Back"
+            "5.All  0.Back"
         )
-        self.fbus.send_command(self.MSG_DISPLAY, self._format_display(menu_text))
+        self._show(menu_text)
         self.current_menu = "sensors"
 
+    @profiled('menu.dtc')
     def _show_dtc_menu(self) -> None:
         """Display DTC menu on phone."""
         menu_text = (
@@ -176,9 +256,10 @@ class UserInterface:
             "2.Clear\n"
             "0.Back"
         )
-        self.fbus.send_command(self.MSG_DISPLAY, self._format_display(menu_text))
+        self._show(menu_text)
         self.current_menu = "dtc"
 
+    @profiled('menu.commands')
     def _show_command_menu(self) -> None:
         """Display custom command menu."""
         menu_text = (
@@ -187,9 +268,10 @@ class UserInterface:
             "2.Add 3.Run\n"
             "0.Back"
         )
-        self.fbus.send_command(self.MSG_DISPLAY, self._format_display(menu_text))
+        self._show(menu_text)
         self.current_menu = "commands"
 
+    @profiled('vehicle.info')
     def _show_vehicle_info(self) -> None:
         """Display vehicle information on phone."""
         info = self.canbus.get_vehicle_info()
@@ -202,7 +284,7 @@ class UserInterface:
         if 'ENGINE_LOAD' in info:
             info_text += f"Load:{info['ENGINE_LOAD']}%\n"
         
-        self.fbus.send_command(self.MSG_DISPLAY, self._format_display(info_text))
+        self._show(info_text)
 
     def _monitor_sensor(self, sensor_name: str) -> None:
         """Start monitoring a sensor.
@@ -210,6 +292,19 @@ class UserInterface:
         Args:
             sensor_name: Name of sensor to monitor
         """
+        self._start_monitoring([sensor_name])
+
+    def _monitor_dashboard(self) -> None:
+        """Start monitoring all menu sensors on one screen."""
+        self._start_monitoring([name for name, _ in self.SENSORS])
+
+    @profiled('monitor.start')
+    def _start_monitoring(self, sensor_names: list) -> None:
+        """Start the monitoring thread for a set of sensors.
+        
+        Args:
+            sensor_names: Names of sensors to monitor
+        """
         # Stop any existing monitoring
         self._stop_monitoring()
         
@@ -217,32 +312,99 @@ class UserInterface:
         self.stop_monitoring.clear()
         self.monitoring_thread = Thread(
             target=self._monitoring_loop,
-            args=(sensor_name,)
+            args=(sensor_names,)
         )
         self.monitoring_thread.start()
 
-    def _monitoring_loop(self, sensor_name: str) -> None:
+    def _monitoring_loop(self, sensor_names: list) -> None:
         """Background loop for sensor monitoring.
         
+        Each sensor is sampled at its own rate by a SensorSampler; this
+        loop only redraws the latest values. Samples are also kept in
+        the sensor history, which a single-sensor screen shows as a
+        sparkline with rolling statistics.
+        
         Args:
-            sensor_name: Name of sensor to monitor
+            sensor_names: Names of sensors to monitor
         """
-        while not self.stop_monitoring.is_set():
-            value = self.canbus.read_sensor(sensor_name)
-            if value is not None:
-                display_text = f"{sensor_name}:\n{value:.1f}"
-                self.fbus.send_command(
-                    self.MSG_DISPLAY,
-                    self._format_display(display_text)
-                )
-            time.sleep(0.5)  # Update every 500ms
+        values = {}
+        
+        def on_sample(name, value, timestamp):
+            values[name] = value
+            self.history.record(name, value, timestamp)
+        
+        sampler = SensorSampler(self.canbus, on_sample, profiler=self.profiler)
+        for priority, name in enumerate(sensor_names):
+            rate = self.SENSOR_RATES.get(name, self.DEFAULT_RATE)
+            self.history.track(name, rate)
+            sampler.add(name, rate, priority)
+        sampler.start()
+        
+        labels = dict(self.SENSORS)
+        try:
+            while not self.stop_monitoring.wait(self.MONITOR_REFRESH):
+                if len(sensor_names) == 1 and values.get(sensor_names[0]) is None:
+                    continue
+                with self.profiler.action('monitor.redraw'):
+                    if len(sensor_names) == 1:
+                        name = sensor_names[0]
+                        display_text = self._format_trend(
+                            labels.get(name, name), name, values[name]
+                        )
+                    else:
+                        lines = []
+                        for name in sensor_names:
+                            value = values.get(name)
+                            shown = f"{value:.1f}" if value is not None else "---"
+                            lines.append(f"{labels.get(name, name)[:6]:<6}{shown:>8}")
+                        display_text = "\n".join(lines)
+                    self._show(display_text, PRIORITY_MONITOR)
+        finally:
+            sampler.stop()
 
+    def _format_trend(self, label: str, name: str, value: float) -> str:
+        """Format one sensor with its sparkline and rolling statistics.
+        
+        Args:
+            label: Display label
+            name: Sensor name in the history
+            value: Latest reading
+            
+        Returns:
+            Screen text
+        """
+        lines = [f"{label[:6]:<6}{value:>8.1f}"]
+        stats = self.history.stats(name, self.TREND_SPAN)
+        if stats is not None:
+            lowest, highest, mean = stats
+            windows = self.history.downsample(name, self.DISPLAY_WIDTH, self.TREND_SPAN)
+            lines.append(self._sparkline(
+                [window[2] if window else None for window in windows],
+                lowest, highest
+            ))
+            lines.append(f"Min{lowest:>11.1f}")
+            lines.append(f"Max{highest:>11.1f}")
+            lines.append(f"Avg{mean:>11.1f}")
+        return "\n".join(lines)
+
+    def _sparkline(self, points: list, lowest: float, highest: float) -> str:
+        """Draw values as one line of SPARK_CHARS, blank where None."""
+        levels = len(self.SPARK_CHARS) - 1
+        scale = levels / (highest - lowest) if highest > lowest else 0.0
+        return "".join(
+            self.SPARK_CHARS[min(levels, max(0, round((point - lowest) * scale)))]
+            if point is not None else " "
+            for point in points
+        )
+
+    @profiled('monitor.stop')
     def _stop_monitoring(self) -> None:
         """Stop current sensor monitoring."""
         if self.monitoring_thread and self.monitoring_thread.is_alive():
             self.stop_monitoring.set()
             self.monitoring_thread.join()
 
+    @profiled('dtc.read')
     def _show_dtc_codes(self) -> None:
         """Display DTC codes on phone."""
         codes = self.canbus.get_dtc_codes()
@@ -254,11 +416,9 @@ class UserInterface:
             if len(codes) > 4:
                 display_text += f"\n+{len(codes)-4} more"
         
-        self.fbus.send_command(
-            self.MSG_DISPLAY,
-            self._format_display(display_text)
-        )
+        self._show(display_text)
 
+    @profiled('dtc.clear')
     def _clear_dtc_codes(self) -> None:
         """Clear DTC codes and show result."""
         if self.canbus.clear_dtc_codes():
@@ -266,11 +426,9 @@ class UserInterface:
         else:
             display_text = "Clear failed"
             
-        self.fbus.send_command(
-            self.MSG_DISPLAY,
-            self._format_display(display_text)
-        )
+        self._show(display_text)
 
+    @profiled('commands.list')
     def _list_commands(self) -> None:
         """Display list of stored commands."""
         commands = self.command_storage.get_commands()
@@ -284,11 +442,9 @@ class UserInterface:
             if len(commands) > 4:
                 display_text += f"\n+{len(commands)-4} more"
         
-        self.fbus.send_command(
-            self.MSG_DISPLAY,
-            self._format_display(display_text)
-        )
+        self._show(display_text)
 
+    @profiled('menu.add_command')
     def _add_command_menu(self) -> None:
         """Show add command menu."""
         # This would need a more complex UI implementation
@@ -299,11 +455,9 @@ class UserInterface:
             "new commands\n"
             "0.Back"
         )
-        self.fbus.send_command(
-            self.MSG_DISPLAY,
-            self._format_display(display_text)
-        )
+        self._show(display_text)
 
+    @profiled('menu.run_command')
     def _run_command_menu(self) -> None:
         """Show run command menu."""
         commands = self.command_storage.get_commands()
@@ -320,12 +474,10 @@ class UserInterface:
             )
             display_text += "\n0.Back"
         
-        self.fbus.send_command(
-            self.MSG_DISPLAY,
-            self._format_display(display_text)
-        )
+        self._show(display_text)
         self.current_menu = "run_command"
 
+    @profiled('command.execute')
     def _execute_command(self, index: int) -> None:
         """Execute stored command and display result."""
         response = self.command_storage.execute_command(index)
@@ -334,27 +486,72 @@ class UserInterface:
         else:
             display_text = "Command\nfailed"
         
-        self.fbus.send_command(
-            self.MSG_DISPLAY,
-            self._format_display(display_text)
-        )
+        self._show(display_text)
 
+    def _on_key_event(self, frame) -> None:
+        """Reader thread callback for keypresses pushed by the phone.
+        
+        Args:
+            frame: Unsolicited keypress frame
+        """
+        if frame.payload:
+            self.keys_pushed = True
+            self.keys.put(frame.payload[0])
+    
+    def _next_key(self, timeout: float) -> Any:
+        """Wait for a pushed keypress.
+        
+        Args:
+            timeout: Seconds to wait
+            
+        Returns:
+            Key code, or None if no key arrived in time or the wait was
+            ended early by a screen change
+        """
+        try:
+            key = self.keys.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return None if key is self._WAKE else key
+    
     def run(self) -> None:
-        """Start the user interface."""
+        """Start the user interface.
+        
+        Keypresses pushed by the phone are handled as they arrive. Until
+        the phone has pushed one, keys are polled, backing off while idle
+        so an unused phone does not keep the link and a CPU core busy.
+        """
         self.running = True
         self._show_main_menu()
         
         try:
             while self.running:
-                # Wait for and handle keypresses
-                response = self.fbus.send_command(self.MSG_KEYPRESS, b'')
-                if response:
-                    self._handle_keypress(response[0])
+                if self.keys_pushed:
+                    key = self._next_key(timeout=1.0)
+                else:
+                    key = None
+                    response = self.link.send_command(
+                        self.MSG_KEYPRESS, b'', PRIORITY_KEYPRESS
+                    )
+                    if response:
+                        key = response[0]
+                    else:
+                        # A pushed key or a screen change ends the wait early
+                        interval = self.poll_interval
+                        key = self._next_key(timeout=interval)
+                        if self.poll_interval == interval:
+                            self.poll_interval = min(interval * 2, self.KEYPOLL_MAX)
+                
+                if key is not None:
+                    self.poll_interval = self.KEYPOLL_MIN
+                    self._handle_keypress(key)
                     
         except KeyboardInterrupt:
             self.running = False
             self._stop_monitoring()
         
         finally:
+            self.fbus.reader.unsubscribe(self.MSG_KEYPRESS, self._on_key_event)
+            self.link.stop()
             self.fbus.close()
             self.canbus.close()